@@ -2,15 +2,24 @@
 
 
 import os
+import asyncio
+import base64
 import redis
 import numpy as np
 import faiss
-import json
+import orjson
 import sqlite3
 from neo4j import GraphDatabase
 import uuid
 import time
-from typing import List, Dict, Any, Optional
+import hashlib
+import importlib
+import itertools
+import queue
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import List, Dict, Any, Optional, Tuple, Callable
 import requests
 from contextlib import asynccontextmanager # [新增] 导入 asynccontextmanager
 
@@ -19,17 +28,91 @@ from fastapi import FastAPI, HTTPException
 from pydantic import BaseModel
 
 # --- 0. 辅助工具 ---
-class EnhancedJSONEncoder(json.JSONEncoder):
-    """一个可以处理Numpy数据类型的JSON编码器"""
-    def default(self, o):
-        if isinstance(o, np.integer): return int(o)
-        if isinstance(o, np.floating): return float(o)
-        if isinstance(o, np.ndarray): return o.tolist()
-        return super(EnhancedJSONEncoder, self).default(o)
+ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+def dumps_json(obj: Any) -> str:
+    """序列化为JSON字符串，orjson 原生支持Numpy标量和数组"""
+    return orjson.dumps(obj, option=ORJSON_OPTIONS).decode('utf-8')
+
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA wal_autocheckpoint=1000",
+)
+
+def connect_sqlite(db_path: str) -> sqlite3.Connection:
+    """打开启用WAL的SQLite连接，锁冲突由 busy_timeout 在SQLite内部重试"""
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    for pragma in SQLITE_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+class ThreadLocalSQLite:
+    """每个线程惰性打开自己的SQLite连接和游标，读操作在WAL下可并发，不再串行于单一连接"""
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = connect_sqlite(self.db_path)
+        return conn
+
+    @property
+    def cursor(self) -> sqlite3.Cursor:
+        cursor = getattr(self._local, 'cursor', None)
+        if cursor is None:
+            cursor = self._local.cursor = self.conn.cursor()
+        return cursor
+
+class MicroBatcher:
+    """把多个线程并发提交的单条请求合并成一批处理：攒够 max_batch 条或等待 max_wait 秒后统一执行"""
+    def __init__(self, batch_fn, max_batch: int = 64, max_wait: float = 0.01, name: str = "micro-batcher"):
+        self.batch_fn = batch_fn  # 接收 List[item]，返回与之一一对应的结果序列
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name=name, daemon=True)
+        self._worker.start()
+
+    def submit(self, item):
+        """提交单条请求并阻塞等待所在批次的结果"""
+        future = Future()
+        self._queue.put((item, future))
+        return future.result()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            try:
+                results = self.batch_fn([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
 
 # --- 1. 短期记忆模块 (STM) - 优化版：存储对话摘要 ---
 class ShortTermMemory:
     def __init__(self, redis_client, conversation_ttl=1800):
+        # 客户端须以 decode_responses=True 创建，以下读取路径直接使用 str
+        assert redis_client.connection_pool.connection_kwargs.get('decode_responses'), "ShortTermMemory 需要 decode_responses=True 的 Redis 客户端"
         self.client = redis_client
         self.ttl = conversation_ttl
         print("✅ 短期记忆模块 (Redis Hash结构) 初始化完成。")
@@ -46,17 +129,31 @@ class ShortTermMemory:
             "conversation_length": conversation_summary.get('conversation_length', 0)
         }
         
-        # 使用Hash结构存储，字段名为轮次号
+        # 使用Hash结构存储，字段名为轮次号；HSET+EXPIRE 通过 pipeline 一次往返完成
         key = f"stm:conversation:{conversation_id}:summaries"
-        self.client.hset(key, f"round_{round_id}", json.dumps(summary_data, cls=EnhancedJSONEncoder))
-        self.client.expire(key, self.ttl)
+        pipe = self.client.pipeline()
+        pipe.hset(key, f"round_{round_id}", dumps_json(summary_data))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
         print(f"🧠 STM: 存储第{round_id}轮对话摘要到 {conversation_id}")
     
     def retrieve_summaries(self, conversation_id: str, last_k: int = 15) -> List[Dict[str, Any]]:
         """检索对话摘要（新方法）"""
         key = f"stm:conversation:{conversation_id}:summaries"
-        all_summaries = self.client.hgetall(key)
-        
+        return self._parse_summaries(conversation_id, self.client.hgetall(key), last_k)
+    
+    def retrieve_summaries_bulk(self, conversation_ids: List[str], last_k: int = 15) -> Dict[str, List[Dict[str, Any]]]:
+        """批量检索多个对话的摘要，所有 HGETALL 通过 pipeline 一次往返完成"""
+        pipe = self.client.pipeline()
+        for conversation_id in conversation_ids:
+            pipe.hgetall(f"stm:conversation:{conversation_id}:summaries")
+        all_results = pipe.execute()
+        return {
+            conversation_id: self._parse_summaries(conversation_id, all_summaries, last_k)
+            for conversation_id, all_summaries in zip(conversation_ids, all_results)
+        }
+    
+    def _parse_summaries(self, conversation_id: str, all_summaries: Dict[str, str], last_k: int) -> List[Dict[str, Any]]:
         if not all_summaries:
             print(f"🧠 STM: 对话 {conversation_id} 无摘要记录。")
             return []
@@ -65,9 +162,9 @@ class ShortTermMemory:
         summaries = []
         for field, data in all_summaries.items():
             try:
-                summary = json.loads(data)
+                summary = orjson.loads(data)
                 summaries.append(summary)
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError as e:
                 print(f"⚠️ STM: 解析摘要数据失败: {e}")
                 continue
         
@@ -81,21 +178,30 @@ class ShortTermMemory:
     def store(self, conversation_id: str, message: Dict[str, Any]):
         """存储原始消息（兼容方法）"""
         key = f"stm:conversation:{conversation_id}"
-        self.client.rpush(key, json.dumps(message, cls=EnhancedJSONEncoder))
-        self.client.expire(key, self.ttl)
+        pipe = self.client.pipeline()
+        pipe.rpush(key, dumps_json(message))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
         print(f"🧠 STM: 存储消息到对话 {conversation_id}")
     
+    def store_batch(self, conversation_id: str, messages: List[Dict[str, Any]]):
+        """批量存储原始消息，一次 RPUSH 多值 + EXPIRE，单次往返"""
+        if not messages:
+            return
+        key = f"stm:conversation:{conversation_id}"
+        pipe = self.client.pipeline()
+        pipe.rpush(key, *(dumps_json(message) for message in messages))
+        pipe.expire(key, self.ttl)
+        pipe.execute()
+        print(f"🧠 STM: 批量存储 {len(messages)} 条消息到对话 {conversation_id}")
+    
     def retrieve(self, conversation_id: str, last_k: int = 10) -> List[Dict[str, Any]]:
         """检索原始消息（兼容方法）"""
         key = f"stm:conversation:{conversation_id}"
         
-        # 检查key的类型 - 修复decode错误
+        # 检查key的类型（decode_responses 下直接返回 str，不存在时为 'none'）
         try:
-            key_type_bytes = self.client.type(key)
-            if key_type_bytes:
-                key_type = key_type_bytes.decode('utf-8') if isinstance(key_type_bytes, bytes) else str(key_type_bytes)
-            else:
-                key_type = 'none'
+            key_type = self.client.type(key)
         except Exception as e:
             print(f"⚠️ STM: 检查key类型失败: {e}")
             key_type = 'none'
@@ -104,7 +210,7 @@ class ShortTermMemory:
             # 新格式：JSON对象存储
             data = self.client.get(key)
             if data:
-                conv_data = json.loads(data)
+                conv_data = orjson.loads(data)
                 messages = conv_data.get('messages', [])
                 print(f"🧠 STM: 从对话 {conversation_id} 中检索到 {len(messages)} 条消息。")
                 return messages[-last_k:] if messages else []
@@ -112,7 +218,7 @@ class ShortTermMemory:
             # 旧格式：list存储（当前使用的格式）
             items = self.client.lrange(key, -last_k, -1)
             print(f"🧠 STM: 从对话 {conversation_id} 中检索最近 {len(items)} 条消息。")
-            return [json.loads(item.decode('utf-8') if isinstance(item, bytes) else item) for item in items]
+            return [orjson.loads(item) for item in items]
         
         print(f"🧠 STM: 对话 {conversation_id} 无记录。")
         return []
@@ -124,7 +230,7 @@ class WorkingMemory:
         self.client = redis_client
         print("✅ 工作记忆模块 (Redis) 初始化完成。")
     def store(self, agent_id: str, task_id: str, data: Dict[str, Any]):
-        key = f"wm:task:{task_id}"; self.client.set(key, json.dumps(data, cls=EnhancedJSONEncoder))
+        key = f"wm:task:{task_id}"; self.client.set(key, dumps_json(data))
         print(f"📝 WM: 为任务 {task_id} 更新工作记忆。")
     def retrieve(self, agent_id: str = None, task_id: str = None) -> Optional[Dict[str, Any]]:
         # 支持多种查询方式
@@ -134,7 +240,7 @@ class WorkingMemory:
             data = self.client.get(key)
             if data:
                 print(f"📝 WM: 检索到任务 {task_id} 的工作记忆。")
-                return json.loads(data)
+                return orjson.loads(data)
         
         if agent_id and task_id:
             # 通过agent_id和task_id查询
@@ -142,7 +248,7 @@ class WorkingMemory:
             data = self.client.get(key)
             if data:
                 print(f"📝 WM: 检索到任务 {task_id} 的工作记忆。")
-                return json.loads(data)
+                return orjson.loads(data)
         
         print(f"📝 WM: 未找到任务 {task_id} 的工作记忆。")
         return None
@@ -151,143 +257,220 @@ class WorkingMemory:
         print(f"🗑️ WM: 清除任务 {task_id} 的工作记忆。")
 class StructuredLTM:
     def __init__(self, db_path='ltm.db'):
-        self.conn = sqlite3.connect(db_path, check_same_thread=False); self.cursor = self.conn.cursor()
-        self.cursor.execute("CREATE TABLE IF NOT EXISTS preferences (user_id TEXT, key TEXT, value TEXT, updated_at REAL, PRIMARY KEY (user_id, key))")
-        self.conn.commit(); print(f"✅ 结构化长期记忆模块 (SQLite @ {db_path}) 初始化完成。")
+        self.db = ThreadLocalSQLite(db_path)
+        self.db.cursor.execute("CREATE TABLE IF NOT EXISTS preferences (user_id TEXT, key TEXT, value TEXT, updated_at REAL, PRIMARY KEY (user_id, key))")
+        self.db.conn.commit(); print(f"✅ 结构化长期记忆模块 (SQLite @ {db_path}) 初始化完成。")
     def store(self, user_id: str, key: str, value: Any):
-        # 添加数据库锁定重试机制
-        max_retries = 5
-        for retry in range(max_retries):
-            try:
-                self.cursor.execute("INSERT OR REPLACE INTO preferences VALUES (?, ?, ?, ?)", (user_id, key, json.dumps(value), time.time()))
-                self.conn.commit()
-                break
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e) and retry < max_retries - 1:
-                    import time as time_module
-                    time_module.sleep(0.1 * (retry + 1))  # 递增等待时间
-                    continue
-                else:
-                    raise
+        # 数据库锁等待由 busy_timeout 在SQLite内部处理
+        self.db.cursor.execute("INSERT OR REPLACE INTO preferences VALUES (?, ?, ?, ?)", (user_id, key, dumps_json(value), time.time()))
+        self.db.conn.commit()
         print(f"⚙️ LTM: 为用户 {user_id} 存储偏好 '{key}'。")
     def retrieve(self, user_id: str, key: str) -> Optional[Any]:
         # 先尝试ltm_preferences表
-        self.cursor.execute("SELECT value FROM ltm_preferences WHERE user_id = ? AND key = ?", (user_id, key))
-        row = self.cursor.fetchone()
+        self.db.cursor.execute("SELECT value FROM ltm_preferences WHERE user_id = ? AND key = ?", (user_id, key))
+        row = self.db.cursor.fetchone()
         if row:
             print(f"⚙️ LTM: 检索到用户 {user_id} 的偏好 '{key}'。")
             # 数据库中存储的是字符串，直接返回，不需要json.loads
             return row[0]
         
         # 兼容旧表名
-        self.cursor.execute("SELECT value FROM preferences WHERE user_id = ? AND key = ?", (user_id, key))
-        row = self.cursor.fetchone()
+        self.db.cursor.execute("SELECT value FROM preferences WHERE user_id = ? AND key = ?", (user_id, key))
+        row = self.db.cursor.fetchone()
         if row:
             print(f"⚙️ LTM: 检索到用户 {user_id} 的偏好 '{key}'。")
-            return json.loads(row[0])
+            return orjson.loads(row[0])
         
         print(f"⚙️ LTM: 未找到用户 {user_id} 的偏好 '{key}'。")
         return None
 class KnowledgeGraphMemory:
     def __init__(self, uri="bolt://localhost:7687", user="neo4j", password="*****"):
         self.driver = GraphDatabase.driver(uri, auth=(user, password))
+        self._local = threading.local()  # Session 非线程安全，每个线程持有一个长连接会话
+        # 全文索引，替代逐关键词的 CONTAINS 全表扫描
+        self.session.run("CREATE FULLTEXT INDEX entityNameFT IF NOT EXISTS FOR (e:Entity) ON EACH [e.name]").consume()
         print(f"✅ 知识图谱模块 (Neo4j @ {uri}) 初始化完成。默认用户: {user}")
 
+    # 参数化查询模板，服务端按语句文本缓存执行计划
+    STORE_QUERY = (
+        "UNWIND $rows AS r "
+        "MERGE (a:Entity {name: r.subject}) "
+        "MERGE (b:Entity {name: r.object}) "
+        "MERGE (a)-[:RELATION {type: r.relation}]->(b)"
+    )
+    EXACT_QUERY = "MATCH (a)-[r:RELATION]->(b) WHERE a.name = $subject RETURN a.name as subject, type(r) as relation, b.name as target"
+    FULLTEXT_QUERY = (
+        "CALL db.index.fulltext.queryNodes('entityNameFT', $q) YIELD node AS a "
+        "MATCH (a)-[r:RELATION]->(b) RETURN a.name as subject, type(r) as relation, b.name as target LIMIT 3"
+    )
+    # 全文索引没有命中时回退到原来的子串匹配 (英文部分词等分词后无法命中的情况)
+    CONTAINS_QUERY = (
+        "MATCH (a)-[r:RELATION]->(b) WHERE any(keyword IN $keywords WHERE a.name CONTAINS keyword) "
+        "RETURN a.name as subject, type(r) as relation, b.name as target LIMIT 3"
+    )
+
+    @staticmethod
+    def _fulltext_query(keywords: List[str]) -> str:
+        """每个关键词作为短语查询并以 OR 连接：标准分词器把中文拆成单字，短语要求这些字相邻且有序；
+        引号内 AND/OR/NOT 等也只是普通词，只需转义反斜杠和双引号"""
+        phrases = ('"' + keyword.replace('\\', '\\\\').replace('"', '\\"') + '"' for keyword in keywords)
+        return ' OR '.join(phrases)
+
+    @property
+    def session(self):
+        session = getattr(self._local, 'session', None)
+        if session is None or session.closed():
+            session = self._local.session = self.driver.session()
+        return session
+
     def store(self, subject: str, relation: str, obj: str):
-        with self.driver.session() as session:
-            session.run(
-                "MERGE (a:Entity {name: $subject}) "
-                "MERGE (b:Entity {name: $object}) "
-                "MERGE (a)-[r:RELATION {type: $relation}]->(b)",
-                subject=subject, relation=relation, object=obj
-            )
+        self.session.run(self.STORE_QUERY, rows=[{'subject': subject, 'relation': relation, 'object': obj}]).consume()
         print(f"🕸️ KG: 存储关系 '{subject} -[{relation}]-> {obj}'。")
 
+    def store_batch(self, triples: List[Tuple[str, str, str]]):
+        """批量存储 (subject, relation, obj) 三元组，一次 UNWIND 查询完成全部 MERGE"""
+        if not triples:
+            return
+        rows = [{'subject': s, 'relation': r, 'object': o} for s, r, o in triples]
+        self.session.run(self.STORE_QUERY, rows=rows).consume()
+        print(f"🕸️ KG: 批量存储 {len(rows)} 条关系。")
+
     def retrieve(self, subject: str, relation: str) -> dict:
-        with self.driver.session() as session:
-            # 策略1: 精确匹配
-            result = session.run(
-                "MATCH (a)-[r:RELATION]->(b) WHERE a.name = $subject RETURN a.name as subject, type(r) as relation, b.name as target",
-                subject=subject
-            )
-            records = result.data()
-            
-            # 策略2: 如果精确匹配失败，尝试模糊匹配
-            if not records:
-                # 提取关键词进行模糊查询
-                keywords = subject.split()
-                for keyword in keywords:
-                    if len(keyword) > 1:  # 跳过太短的词
-                        result = session.run(
-                            "MATCH (a)-[r:RELATION]->(b) WHERE a.name CONTAINS $keyword RETURN a.name as subject, type(r) as relation, b.name as target LIMIT 3",
-                            keyword=keyword
-                        )
-                        records = result.data()
-                        if records:
-                            print(f"🕸️ KG: 通过关键词 '{keyword}' 找到相关关系")
-                            break
-            
-            if records:
-                # 格式化返回结果
-                results = []
-                for record in records:
-                    results.append({
-                        'subject': record['subject'],
-                        'relation': record['relation'], 
-                        'target': record['target']
-                    })
-                print(f"🕸️ KG: 查询 '{subject}' 找到 {len(results)} 条关系")
-                return {'status': 'success', 'data': results}
-            else:
-                print(f"🕸️ KG: 未查询到 '{subject}' 相关的任何关系。")
-                return {'status': 'success', 'data': None}
+        session = self.session
+        # 策略1: 精确匹配
+        result = session.run(self.EXACT_QUERY, subject=subject)
+        records = result.data()
+        
+        # 策略2: 如果精确匹配失败，尝试模糊匹配
+        if not records:
+            # 提取关键词，通过全文索引一次查询
+            keywords = [keyword for keyword in subject.split() if len(keyword) > 1]  # 跳过太短的词
+            if keywords:
+                records = session.run(self.FULLTEXT_QUERY, q=self._fulltext_query(keywords)).data()
+                if not records:
+                    records = session.run(self.CONTAINS_QUERY, keywords=keywords).data()
+                if records:
+                    print(f"🕸️ KG: 通过关键词 {keywords} 找到相关关系")
+        
+        if records:
+            # 格式化返回结果
+            results = []
+            for record in records:
+                results.append({
+                    'subject': record['subject'],
+                    'relation': record['relation'], 
+                    'target': record['target']
+                })
+            print(f"🕸️ KG: 查询 '{subject}' 找到 {len(results)} 条关系")
+            return {'status': 'success', 'data': results}
+        else:
+            print(f"🕸️ KG: 未查询到 '{subject}' 相关的任何关系。")
+            return {'status': 'success', 'data': None}
+
+    def close(self):
+        self.driver.close()
+
 class ProceduralMemory:
     def __init__(self, skills_dir='skills'):
         self.skills_dir = skills_dir;
         if not os.path.exists(self.skills_dir): os.makedirs(self.skills_dir)
+        self._skill_cache: Dict[str, Callable] = {}  # 技能名 -> execute 函数
+        self._stale_skills = set()  # 代码已被覆盖、下次调用需 reload 的技能
         print(f"✅ 程序性记忆模块 (File System @ {skills_dir}) 初始化完成。")
     def store(self, skill_name: str, code: str):
         with open(os.path.join(self.skills_dir, f"{skill_name}.py"), "w", encoding="utf-8") as f: f.write(code)
+        self._skill_cache.pop(skill_name, None); self._stale_skills.add(skill_name)
         print(f"🛠️ ProcMem: 存储新技能 '{skill_name}'。")
+    def _load_skill(self, skill_name: str) -> Callable:
+        module = importlib.import_module(f"{self.skills_dir}.{skill_name}")
+        if skill_name in self._stale_skills: module = importlib.reload(module); self._stale_skills.discard(skill_name)
+        fn = self._skill_cache[skill_name] = module.execute
+        return fn
     def retrieve(self, skill_name: str, *args, **kwargs) -> Any:
         try:
-            module_path = f"{self.skills_dir}.{skill_name}"; skill_module = __import__(module_path, fromlist=[None])
-            result = skill_module.execute(*args, **kwargs); print(f"🚀 ProcMem: 成功执行技能 '{skill_name}'。"); return result
+            fn = self._skill_cache.get(skill_name) or self._load_skill(skill_name)
+            result = fn(*args, **kwargs); print(f"🚀 ProcMem: 成功执行技能 '{skill_name}'。"); return result
         except (ImportError, AttributeError) as e: print(f"❌ ProcMem: 执行技能 '{skill_name}' 失败: {e}"); return None
 
 # --- 3. 向量记忆 (Vector Memory) ---
+# IVFPQ 参数：向量数达到训练阈值前使用精确索引，达到后在后台线程训练 IVFPQ，训练完成后替换
+# nlist 取 4·√N，并保证每个聚类中心至少有 39 个训练点 (faiss k-means 的建议下限)，不超过 IVF_NLIST
+IVF_NLIST = 1024
+IVF_MIN_POINTS_PER_CENTROID = 39
+IVF_PQ_M = 32
+IVF_PQ_NBITS = 8
+IVF_NPROBE = 16
+IVF_TRAIN_THRESHOLD = 30000
+# 嵌入缓存：进程内LRU + 磁盘 {sha256(模型|维度|文本)}.npy (float16)
+EMBEDDING_CACHE_DIR = 'embeddings_cache'
+EMBEDDING_LRU_SIZE = 4096
+# 启动时补入索引缺失向量的每批条数
+REPAIR_BATCH_SIZE = 64
+# vector_id 按记忆类型分段，检索时用 IDSelectorRange 在索引内部完成类型过滤
+VECTOR_ID_SPAN = 10 ** 15
+VECTOR_ID_BASES = {'episodic': 1 * VECTOR_ID_SPAN, 'semantic': 2 * VECTOR_ID_SPAN, 'ltm_doc': 3 * VECTOR_ID_SPAN}
+# 索引持久化去抖：距上次保存超过30秒或累计1000个变更才写盘
+INDEX_SAVE_INTERVAL = 30
+INDEX_SAVE_MAX_DIRTY = 1000
+
 class VectorMemory:
     def __init__(self, embedding_service_url: str, embedding_model_name: str, dimension: int, db_path='ltm.db'):
         self.embedding_service_url = embedding_service_url
         self.embedding_model_name = embedding_model_name
         self.dimension = dimension
         self._needs_save = False  # 🆕 保存标志
+        self._dirty_count = 0
+        self._last_save = time.time()
+        self._index_lock = threading.RLock()  # 索引的添加/检索/快照互斥
+        self._local = threading.local()  # 每个线程复用的向量缓冲区
+        self._id_counters: Dict[str, Any] = {}  # 记忆类型 -> itertools.count，单进程内分配vector_id
+        self._id_counters_lock = threading.Lock()
         
         # 加载现有索引或创建新索引
-        index_path = 'vector_index.faiss'
-        mapping_path = 'vector_mapping.json'
+        self.index_path = 'vector_index.faiss'
+        self.mapping_path = 'vector_mapping.json'  # 仅旧版索引迁移时读取，vector_id 由 IndexIDMap2/IVF 自身保存
+        self._drop_legacy_mapping = False
         
-        if os.path.exists(index_path):
-            self.index = faiss.read_index(index_path)
+        if os.path.exists(self.index_path):
+            self.index = faiss.read_index(self.index_path)
             print(f"📁 加载现有向量索引: {self.index.ntotal} 个向量")
+            if not isinstance(self.index, (faiss.IndexIDMap, faiss.IndexIVF)):
+                # 旧格式：IndexFlatL2 + 位置→vector_id 映射文件，迁移为以 vector_id 为键的索引
+                self.index = self._migrate_legacy_index(self.index)
+                self._needs_save = True
+                self._drop_legacy_mapping = True  # 迁移后的索引写盘成功再删除映射文件
+            elif isinstance(self.index, faiss.IndexIDMap) and self.index.metric_type != faiss.METRIC_INNER_PRODUCT:
+                # L2 度量的精确索引：归一化后重建为内积索引
+                self.index = self._rebuild_flat_index(self.index)
+                self._needs_save = True
         else:
-            self.index = faiss.IndexFlatL2(self.dimension)
+            self.index = self._new_flat_index()
             print(f"🆕 创建新向量索引")
+        if not self._drop_legacy_mapping and os.path.exists(self.mapping_path):
+            os.remove(self.mapping_path)
         
-        # 加载向量映射
-        if os.path.exists(mapping_path):
-            with open(mapping_path, 'r') as f:
-                mapping_data = json.load(f)
-                # 处理旧格式：{"0": "0", "1": "1", ...}
-                self.vector_mapping = {int(k): v for k, v in mapping_data.items()}
-            print(f"📁 加载向量映射: {len(self.vector_mapping)} 个映射")
-        else:
-            self.vector_mapping = {}
-            print(f"🆕 创建新向量映射")
+        self._ivf_training = False  # 后台 IVFPQ 训练进行中
+        faiss.omp_set_num_threads(os.cpu_count() or 1)
+        
+        # 索引写盘在后台线程完成；单槽队列中只保留最新快照
+        self._save_queue = queue.Queue(maxsize=1)
+        self._save_worker = threading.Thread(target=self._run_save_worker, name="index-saver", daemon=True)
+        self._save_worker.start()
+        
+        # 相同文本的嵌入按 sha256 缓存，避免重复HTTP调用；键含模型名与维度，换模型后不会读到旧向量
+        self._emb_key_prefix = f"{embedding_model_name}|{dimension}|".encode('utf-8')
+        self._emb_cache_dir = EMBEDDING_CACHE_DIR
+        os.makedirs(self._emb_cache_dir, exist_ok=True)
+        self._emb_lru = OrderedDict()
+        self._emb_lru_lock = threading.Lock()
+        
+        # 并发的单条嵌入请求每10ms或攒满64条合并为一次HTTP调用
+        self._embedding_batcher = MicroBatcher(self._get_embeddings, max_batch=64, max_wait=0.01, name="embedding-batcher")
+        # 并发的检索请求每5ms或攒满32条合并为一次 (B, d) 批量检索
+        self._search_batcher = MicroBatcher(self._search_batch, max_batch=32, max_wait=0.005, name="search-batcher")
         
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self.cursor = self.conn.cursor()
-        self.cursor.execute("""
+        self.db = ThreadLocalSQLite(db_path)
+        self.db.cursor.execute("""
             CREATE TABLE IF NOT EXISTS vector_metadata (
                 vector_id INTEGER PRIMARY KEY,
                 memory_type TEXT,
@@ -295,125 +478,437 @@ class VectorMemory:
                 metadata TEXT
             )
         """)
-        self.conn.commit()
+        self.db.conn.commit()
+        self._partition_legacy_ids()
+        self._reconcile_with_metadata()
+        # 旧ID迁移与缺失向量补入都完成后再开始训练，训练期间索引只会追加向量
+        with self._index_lock:
+            self._maybe_train_ivfpq()
         print(f"✅ 向量记忆模块 (Faiss + 外部嵌入服务 @ {embedding_service_url}) 初始化完成。")
         print(f"   - 使用模型: {self.embedding_model_name}")
         print(f"   - 向量维度: {self.dimension}")
 
-    def _get_embedding(self, text: str) -> np.ndarray:
+    def _new_flat_index(self):
+        """训练阈值前的精确索引：归一化向量 + 内积度量，float16 存储，向量以 vector_id 为键"""
+        return faiss.IndexIDMap2(faiss.IndexScalarQuantizer(self.dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT))
+
+    @staticmethod
+    def _normalized(embeddings: np.ndarray) -> np.ndarray:
+        """返回L2归一化后的 (n, d) float32 副本，单位向量上内积即余弦相似度"""
+        vectors = np.array(embeddings, dtype='float32', ndmin=2)
+        faiss.normalize_L2(vectors)
+        return vectors
+
+    def _vector_buffer(self) -> np.ndarray:
+        """当前线程复用的 (1, d) float32 缓冲区，单条向量无需每次分配新数组"""
+        buf = getattr(self._local, 'vector_buf', None)
+        if buf is None:
+            buf = self._local.vector_buf = np.empty((1, self.dimension), dtype='float32')
+        return buf
+
+    def _http_session(self) -> requests.Session:
+        """当前线程复用的 HTTP 会话，保持到嵌入服务的长连接"""
+        session = getattr(self._local, 'http_session', None)
+        if session is None:
+            session = self._local.http_session = requests.Session()
+        return session
+
+    def _rebuild_flat_index(self, old_index):
+        """将旧的 IndexIDMap2(IndexFlatL2) 迁移为归一化内积索引"""
+        index = self._new_flat_index()
+        if old_index.ntotal:
+            ids = faiss.vector_to_array(old_index.id_map).astype('int64')
+            index.add_with_ids(self._normalized(old_index.index.reconstruct_n(0, old_index.ntotal)), ids)
+        print(f"🔄 向量索引已迁移为内积度量: {index.ntotal} 个向量")
+        return index
+
+    def _migrate_legacy_index(self, legacy_index):
+        """将旧版按位置映射的索引迁移为 IndexIDMap2"""
+        legacy_mapping = {}
+        if os.path.exists(self.mapping_path):
+            with open(self.mapping_path, 'rb') as f:
+                # 旧格式：{"0": "0", "1": "1", ...}
+                legacy_mapping = {int(k): int(v) for k, v in orjson.loads(f.read()).items()}
+        
+        index = self._new_flat_index()
+        positions = [pos for pos in sorted(legacy_mapping) if pos < legacy_index.ntotal]
+        if positions:
+            vectors = legacy_index.reconstruct_n(0, legacy_index.ntotal)[positions]
+            ids = np.array([legacy_mapping[pos] for pos in positions], dtype='int64')
+            index.add_with_ids(self._normalized(vectors), ids)
+        print(f"🔄 旧版向量索引已迁移: {index.ntotal}/{legacy_index.ntotal} 个向量")
+        return index
+
+    @staticmethod
+    def _ivf_nlist(n: int) -> int:
+        return max(1, min(IVF_NLIST, int(4 * np.sqrt(n)), n // IVF_MIN_POINTS_PER_CENTROID))
+
+    def _maybe_train_ivfpq(self):
+        """精确索引达到训练阈值时，复制当前全部向量并在后台线程训练 IVFPQ (调用方持有 _index_lock)"""
+        if self._ivf_training or isinstance(self.index, faiss.IndexIVF) or self.index.ntotal < IVF_TRAIN_THRESHOLD:
+            return
+        self._ivf_training = True
+        ids = faiss.vector_to_array(self.index.id_map).astype('int64')
+        vectors = self.index.index.reconstruct_n(0, self.index.ntotal)
+        threading.Thread(target=self._train_ivfpq, args=(ids, vectors), name="ivfpq-trainer", daemon=True).start()
+
+    def _train_ivfpq(self, ids: np.ndarray, vectors: np.ndarray):
+        """后台训练 IVFPQ：训练期间继续由精确索引提供服务，完成后在锁内补入训练期间新增的向量并替换索引"""
+        nlist = self._ivf_nlist(len(ids))
+        print(f"🏋️ 向量数达到 {len(ids)}，后台训练 IVFPQ 索引 (nlist={nlist})...")
+        try:
+            quantizer = faiss.IndexFlatIP(self.dimension)
+            index = faiss.IndexIVFPQ(quantizer, self.dimension, nlist, IVF_PQ_M, IVF_PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+            index.add_with_ids(vectors, ids)
+            index.nprobe = IVF_NPROBE
+            
+            with self._index_lock:
+                # 训练期间精确索引只会追加，按ID差集找出新增向量
+                current_ids = faiss.vector_to_array(self.index.id_map).astype('int64')
+                positions = np.flatnonzero(~np.isin(current_ids, ids))
+                if len(positions):
+                    added = np.vstack([self.index.index.reconstruct(int(pos)) for pos in positions])
+                    index.add_with_ids(added, current_ids[positions])
+                self.index = index
+                self._needs_save = True
+            print(f"✅ IVFPQ 索引训练完成 (nlist={nlist}, M={IVF_PQ_M}, nprobe={IVF_NPROBE}，训练期间新增 {len(positions)} 个向量)")
+        except Exception as e:
+            print(f"⚠️ IVFPQ 索引训练失败，继续使用精确索引: {e}")
+        finally:
+            with self._index_lock:
+                self._ivf_training = False
+
+    def _text_hash(self, text: str) -> str:
+        return hashlib.sha256(self._emb_key_prefix + text.encode('utf-8')).hexdigest()
+
+    def _remember_embedding(self, text_hash: str, embedding: np.ndarray):
+        with self._emb_lru_lock:
+            self._emb_lru[text_hash] = embedding
+            self._emb_lru.move_to_end(text_hash)
+            if len(self._emb_lru) > EMBEDDING_LRU_SIZE:
+                self._emb_lru.popitem(last=False)
+
+    def _cached_embedding(self, text_hash: str) -> Optional[np.ndarray]:
+        """依次查询进程内LRU和磁盘缓存，未命中返回None"""
+        with self._emb_lru_lock:
+            embedding = self._emb_lru.get(text_hash)
+            if embedding is not None:
+                self._emb_lru.move_to_end(text_hash)
+                return embedding
+        
+        cache_path = os.path.join(self._emb_cache_dir, f"{text_hash}.npy")
+        if not os.path.exists(cache_path):
+            return None
+        try:
+            # astype 生成独立的float32副本，不保留对映射文件的引用
+            embedding = np.load(cache_path, mmap_mode='r').astype('float32')
+        except (OSError, ValueError) as e:
+            print(f"⚠️ 读取嵌入缓存失败: {e}")
+            return None
+        self._remember_embedding(text_hash, embedding)
+        return embedding
+
+    def _cache_embedding(self, text_hash: str, embedding: np.ndarray) -> np.ndarray:
+        """以float16写入磁盘缓存（先写临时文件再替换，避免读到半个文件），返回写入LRU的float32向量。
+        该向量与磁盘命中时一样按float16取整，同一文本无论是否命中缓存都得到相同的嵌入；
+        它是独立副本，LRU不会引用整批请求结果的数组"""
+        stored = embedding.astype('float16')
+        canonical = stored.astype('float32')
+        self._remember_embedding(text_hash, canonical)
+        cache_path = os.path.join(self._emb_cache_dir, f"{text_hash}.npy")
+        tmp_path = f"{cache_path}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.save(f, stored)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"⚠️ 写入嵌入缓存失败: {e}")
+        return canonical
+
+    def _get_embeddings(self, texts: List[str]) -> np.ndarray:
+        """批量获取嵌入，缓存未命中的文本合并为一次HTTP请求，返回 (len(texts), dimension) 的 float32 数组"""
+        hashes = [self._text_hash(text) for text in texts]
+        embeddings = np.empty((len(texts), self.dimension), dtype='float32')
+        missing = []
+        for i, text_hash in enumerate(hashes):
+            cached = self._cached_embedding(text_hash)
+            if cached is None:
+                missing.append(i)
+            else:
+                embeddings[i] = cached
+        
+        if missing:
+            fetched = self._request_embeddings([texts[i] for i in missing])
+            for i, embedding in zip(missing, fetched):
+                embeddings[i] = self._cache_embedding(hashes[i], embedding)
+        return embeddings
+
+    def _request_embeddings(self, texts: List[str]) -> np.ndarray:
+        """一次HTTP请求批量获取嵌入"""
+        if not texts:
+            return np.empty((0, self.dimension), dtype='float32')
         try:
-            payload = {"model": self.embedding_model_name, "input": [text]}
-            response = requests.post(self.embedding_service_url, json=payload, timeout=10)
+            payload = {"model": self.embedding_model_name, "input": texts, "encoding_format": "base64"}
+            response = self._http_session().post(self.embedding_service_url, data=orjson.dumps(payload), headers={'Content-Type': 'application/json'}, timeout=10)
             response.raise_for_status()
-            result = response.json()
-            embedding = np.array(result['data'][0]['embedding'], dtype='float32')
-            return embedding
+            result = orjson.loads(response.content)
+            embeddings = np.empty((len(result['data']), self.dimension), dtype='float32')
+            for i, item in enumerate(result['data']):
+                embedding = item['embedding']
+                # base64 为 float32 小端字节，直接按缓冲区解码；不支持该格式的服务仍返回浮点列表
+                embeddings[i] = np.frombuffer(base64.b64decode(embedding), dtype='<f4') if isinstance(embedding, str) else embedding
+            if len(embeddings) != len(texts):
+                raise IndexError(f"嵌入数量不匹配: 请求 {len(texts)} 条，返回 {len(embeddings)} 条")
+            return embeddings
         except requests.exceptions.RequestException as e:
             print(f"❌ 调用嵌入服务失败: {e}"); raise
         except (KeyError, IndexError) as e:
             print(f"❌ 解析嵌入服务响应失败: {e}"); raise
 
+    def _get_embedding(self, text: str) -> np.ndarray:
+        # 返回的数组可能与缓存共享内存，调用方只读或先复制到自己的缓冲区
+        cached = self._cached_embedding(self._text_hash(text))
+        if cached is not None:
+            return cached
+        return self._embedding_batcher.submit(text)
+
     def store(self, memory_type: str, text: str, metadata: Dict[str, Any]):
-        embedding = self._get_embedding(text)
-        
-        # 生成唯一的vector_id，使用时间戳+随机数确保唯一性
-        import time
-        import random
-        vector_id = int(time.time() * 1000000) + random.randint(1000, 9999)
-        
-        # 检查ID是否已存在，如果存在则重新生成
-        max_retries = 10
-        for retry in range(max_retries):
-            self.cursor.execute("SELECT COUNT(*) FROM vector_metadata WHERE vector_id = ?", (vector_id,))
-            if self.cursor.fetchone()[0] == 0:
-                break
-            vector_id = int(time.time() * 1000000) + random.randint(1000, 9999)
-            if retry == max_retries - 1:
-                print(f"❌ 无法生成唯一vector_id，重试{max_retries}次后失败")
-                return
+        self._store_embeddings(memory_type, [(text, metadata)], self._get_embedding(text))
+
+    def store_batch(self, memory_type: str, items: List[Tuple[str, Dict[str, Any]]]):
+        """批量存储：一次嵌入请求、一次索引添加、一次事务提交"""
+        if not items:
+            return
+        self._store_embeddings(memory_type, items, self._get_embeddings([text for text, _ in items]))
+
+    def _new_vector_id(self, memory_type: str) -> int:
+        """从记忆类型对应ID区间的单调计数器取下一个vector_id；计数器首次使用时从该区间已有的最大ID续接"""
+        counter = self._id_counters.get(memory_type)
+        if counter is None:
+            with self._id_counters_lock:
+                counter = self._id_counters.get(memory_type)
+                if counter is None:
+                    base = VECTOR_ID_BASES.get(memory_type, 0)
+                    self.db.cursor.execute(
+                        "SELECT MAX(vector_id) FROM vector_metadata WHERE vector_id >= ? AND vector_id < ?",
+                        (base, base + VECTOR_ID_SPAN)
+                    )
+                    max_id = self.db.cursor.fetchone()[0]
+                    counter = self._id_counters[memory_type] = itertools.count(max_id + 1 if max_id is not None else base + 1)
+        return next(counter)
+
+    def _store_embeddings(self, memory_type: str, items: List[Tuple[str, Dict[str, Any]]], embeddings: np.ndarray):
+        vector_ids = []
+        rows = []
+        for text, metadata in items:
+            vector_id = self._new_vector_id(memory_type)
+            
+            # 准备元数据
+            metadata['memory_type'] = memory_type
+            metadata['text'] = text
+            vector_ids.append(vector_id)
+            rows.append((vector_id, memory_type, text, dumps_json(metadata)))
         
-        # 记录当前index位置和vector_id的映射
-        current_index_pos = self.index.ntotal
-        self.vector_mapping[current_index_pos] = vector_id
+        # 所有元数据在一个事务中写入，数据库锁等待由 busy_timeout 在SQLite内部处理
+        self.db.cursor.executemany(
+            "INSERT INTO vector_metadata (vector_id, memory_type, content, metadata) VALUES (?, ?, ?, ?)",
+            rows
+        )
+        self.db.conn.commit()
         
-        # 添加向量到索引
-        self.index.add(np.array([embedding]))
+        # 元数据写入成功后再以vector_id为键一次性添加向量到索引
+        if len(vector_ids) == 1:
+            vectors = self._vector_buffer()
+            np.copyto(vectors[0], embeddings.reshape(-1))
+            faiss.normalize_L2(vectors)
+        else:
+            vectors = self._normalized(embeddings)
+        with self._index_lock:
+            self.index.add_with_ids(vectors, np.array(vector_ids, dtype='int64'))
+            self._maybe_train_ivfpq()
+            self._dirty_count += len(vector_ids)
         
-        # 准备元数据
-        metadata['memory_type'] = memory_type
-        metadata['text'] = text
+        if len(items) == 1:
+            print(f"💾 VectorDB ({memory_type}): 存储向量ID {vector_ids[0]} - '{items[0][0][:30]}...'")
+        else:
+            print(f"💾 VectorDB ({memory_type}): 批量存储 {len(items)} 条记忆")
         
-        # 存储到数据库，添加重试机制处理数据库锁定
-        max_db_retries = 5
-        for db_retry in range(max_db_retries):
+
+    def _run_save_worker(self):
+        """后台写盘线程：取出最新快照写入临时文件后原子替换，不占用请求线程"""
+        while True:
+            snapshot, ntotal = self._save_queue.get()
             try:
-                self.cursor.execute(
-                    "INSERT INTO vector_metadata (vector_id, memory_type, content, metadata) VALUES (?, ?, ?, ?)",
-                    (vector_id, memory_type, text, json.dumps(metadata, cls=EnhancedJSONEncoder))
-                )
-                self.conn.commit()
-                break
-            except sqlite3.OperationalError as e:
-                if "database is locked" in str(e) and db_retry < max_db_retries - 1:
-                    import time as time_module
-                    time_module.sleep(0.1 * (db_retry + 1))  # 递增等待时间
-                    continue
-                else:
-                    raise
-            except sqlite3.IntegrityError as e:
-                if "UNIQUE constraint failed" in str(e):
-                    # ID冲突，重新生成
-                    vector_id = int(time.time() * 1000000) + random.randint(1000, 9999)
-                    self.vector_mapping[current_index_pos] = vector_id
-                    if db_retry < max_db_retries - 1:
-                        continue
-                raise
-        
-        print(f"💾 VectorDB ({memory_type}): 存储向量ID {vector_id} - '{text[:30]}...'")
-        
-        # 🆕 标记需要保存，但不立即保存（避免频繁I/O）
-        self._needs_save = True
-
-    def _save_index_and_mapping(self):
-        """保存向量索引和映射关系到磁盘"""
-        if not self._needs_save:
+                tmp_path = f"{self.index_path}.tmp"
+                snapshot.tofile(tmp_path)
+                os.replace(tmp_path, self.index_path)
+                if self._drop_legacy_mapping and os.path.exists(self.mapping_path):
+                    os.remove(self.mapping_path)
+                self._drop_legacy_mapping = False
+                print(f"📁 向量索引已保存 (索引大小: {ntotal})")
+            except Exception as e:
+                print(f"⚠️  保存索引失败: {e}")
+            finally:
+                self._save_queue.task_done()
+
+    def save_if_needed(self, force: bool = False):
+        """去抖保存：满足时间或变更数阈值时，将索引快照交给后台线程写盘"""
+        if not self._needs_save and self._dirty_count == 0:
             return
-            
-        try:
-            # 保存向量索引
-            faiss.write_index(self.index, 'vector_index.faiss')
-            
-            # 保存向量映射
-            with open('vector_mapping.json', 'w', encoding='utf-8') as f:
-                json.dump(self.vector_mapping, f, ensure_ascii=False, indent=2)
-            
-            print(f"📁 向量索引和映射已保存 (索引大小: {self.index.ntotal})")
+        if not force and time.time() - self._last_save < INDEX_SAVE_INTERVAL and self._dirty_count < INDEX_SAVE_MAX_DIRTY:
+            return
+        
+        with self._index_lock:
+            # 内存中序列化快照后立即释放锁，磁盘I/O留给后台线程
+            snapshot = faiss.serialize_index(self.index)
+            item = (snapshot, self.index.ntotal)
             self._needs_save = False
-        except Exception as e:
-            print(f"⚠️  保存索引失败: {e}")
-    
-    def save_if_needed(self):
-        """如果有更改则保存索引和映射"""
-        self._save_index_and_mapping()
+            self._dirty_count = 0
+            self._last_save = time.time()
+            try:
+                self._save_queue.get_nowait()  # 丢弃尚未写出的旧快照
+                self._save_queue.task_done()
+            except queue.Empty:
+                pass
+            self._save_queue.put(item)
+
+    def flush(self):
+        """立即保存所有未写盘的更改并等待写盘完成（服务关闭时调用）"""
+        self.save_if_needed(force=True)
+        self._save_queue.join()
+
+    def _partition_legacy_ids(self):
+        """把不在所属类型ID区间内的旧vector_id迁移到对应区间，使类型过滤可以下推到索引"""
+        moves = []
+        for memory_type, base in VECTOR_ID_BASES.items():
+            self.db.cursor.execute(
+                "SELECT vector_id FROM vector_metadata WHERE memory_type = ? AND (vector_id < ? OR vector_id >= ?)",
+                (memory_type, base, base + VECTOR_ID_SPAN)
+            )
+            for (old_id,) in self.db.cursor.fetchall():
+                new_id = self._new_vector_id(memory_type)
+                moves.append((old_id, new_id))
+        if not moves:
+            return
+        
+        with self._index_lock:
+            # 只迁移索引中确实存在的向量 (两种索引都按实际ID判断)；缺失的由 _reconcile_with_metadata 按新ID补入
+            indexed = set(self._indexed_ids().tolist())
+            in_index = [(old_id, new_id) for old_id, new_id in moves if old_id in indexed]
+            if in_index:
+                is_ivf = isinstance(self.index, faiss.IndexIVF)
+                if is_ivf:
+                    self.index.set_direct_map_type(faiss.DirectMap.Hashtable)
+                try:
+                    old_ids = np.array([old_id for old_id, _ in in_index], dtype='int64')
+                    vectors = np.vstack([self.index.reconstruct(int(old_id)) for old_id in old_ids])
+                    self.index.remove_ids(old_ids)
+                    self.index.add_with_ids(vectors, np.array([new_id for _, new_id in in_index], dtype='int64'))
+                finally:
+                    if is_ivf:
+                        self.index.set_direct_map_type(faiss.DirectMap.NoMap)
+            self._needs_save = True
+        
+        self.db.cursor.executemany("UPDATE vector_metadata SET vector_id = ? WHERE vector_id = ?", [(new_id, old_id) for old_id, new_id in moves])
+        self.db.conn.commit()
+        print(f"🔄 已将 {len(moves)} 个旧vector_id迁移到按类型分段的ID区间")
+
+    def _indexed_ids(self) -> np.ndarray:
+        """索引中全部 vector_id：精确索引读 id_map，IVF 索引逐个倒排列表读取"""
+        if not isinstance(self.index, faiss.IndexIVF):
+            return faiss.vector_to_array(self.index.id_map).astype('int64')
+        invlists = self.index.invlists
+        ids = [faiss.rev_swig_ptr(invlists.get_ids(l), invlists.list_size(l)).copy()
+               for l in range(invlists.nlist) if invlists.list_size(l)]
+        return np.concatenate(ids).astype('int64') if ids else np.empty(0, dtype='int64')
+
+    def _reconcile_with_metadata(self):
+        """启动时核对元数据与已写盘的索引：元数据先提交、索引稍后才去抖写盘，
+        两者之间崩溃会留下索引中没有向量的元数据行，这些行按其文本重新嵌入并补入索引"""
+        self.db.cursor.execute("SELECT vector_id FROM vector_metadata")
+        metadata_ids = np.fromiter((row[0] for row in self.db.cursor.fetchall()), dtype='int64')
+        with self._index_lock:
+            indexed_ids = self._indexed_ids()
+        orphan_ids = metadata_ids[~np.isin(metadata_ids, indexed_ids)].tolist()
+        if not orphan_ids:
+            return
+        
+        print(f"🔧 发现 {len(orphan_ids)} 条元数据的向量未写入索引，重新嵌入补入索引...")
+        repaired = 0
+        for start in range(0, len(orphan_ids), REPAIR_BATCH_SIZE):
+            chunk = orphan_ids[start:start + REPAIR_BATCH_SIZE]
+            self.db.cursor.execute(
+                f"SELECT vector_id, metadata FROM vector_metadata WHERE vector_id IN ({','.join('?' * len(chunk))})", chunk)
+            rows = [(vector_id, orjson.loads(metadata).get('text', '')) for vector_id, metadata in self.db.cursor.fetchall()]
+            try:
+                # 嵌入在写入元数据前已进入磁盘缓存，通常无需再请求嵌入服务
+                embeddings = self._get_embeddings([text for _, text in rows])
+            except (requests.exceptions.RequestException, KeyError, IndexError) as e:
+                print(f"⚠️ 重新嵌入失败，剩余 {len(orphan_ids) - repaired} 条将在下次启动时重试: {e}")
+                break
+            with self._index_lock:
+                self.index.add_with_ids(self._normalized(embeddings), np.array([vector_id for vector_id, _ in rows], dtype='int64'))
+                self._dirty_count += len(rows)
+            repaired += len(rows)
+        if repaired:
+            self.flush()
+            print(f"✅ 已补入 {repaired} 个向量 (索引大小: {self.index.ntotal})")
+
+    def _search_params(self, filter_by_type: Optional[str]):
+        """构造检索参数：按类型ID区间过滤，IVF索引同时指定 nprobe"""
+        params = {}
+        if filter_by_type in VECTOR_ID_BASES:
+            base = VECTOR_ID_BASES[filter_by_type]
+            params['sel'] = faiss.IDSelectorRange(base, base + VECTOR_ID_SPAN)
+        if isinstance(self.index, faiss.IndexIVF):
+            return faiss.SearchParametersIVF(nprobe=IVF_NPROBE, **params)
+        return faiss.SearchParameters(**params) if params else None
+
+    def _search_batch(self, queries: List[Tuple[np.ndarray, int, Optional[str]]]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """将并发查询按类型过滤条件分组，每组堆叠为 (B, d) 矩阵一次检索，再按各自的 k 切分结果"""
+        groups: Dict[Optional[str], List[int]] = {}
+        for i, (_, _, filter_by_type) in enumerate(queries):
+            groups.setdefault(filter_by_type, []).append(i)
+        
+        results = [None] * len(queries)
+        for filter_by_type, positions in groups.items():
+            fetch_k = max(queries[i][1] for i in positions)
+            # np.stack 已生成新数组，直接原地归一化
+            query_matrix = np.stack([queries[i][0] for i in positions]).astype('float32', copy=False)
+            faiss.normalize_L2(query_matrix)
+            with self._index_lock:
+                scores, vector_ids = self.index.search(query_matrix, fetch_k, params=self._search_params(filter_by_type))
+            for row, i in enumerate(positions):
+                k = queries[i][1]
+                results[i] = (scores[row, :k], vector_ids[row, :k])
+        return results
 
     def retrieve(self, query_text: str, k: int = 5, filter_by_type: Optional[str] = None) -> List[Dict[str, Any]]:
         query_embedding = self._get_embedding(query_text)
-        distances, indices = self.index.search(np.array([query_embedding]), k * 2)
+        # 类型过滤已在索引内完成，无需超额召回
+        scores, vector_ids = self._search_batcher.submit((query_embedding, k, filter_by_type))
+        # 索引直接返回vector_id，-1 表示结果不足；一次 IN 查询取回全部元数据
+        hit_ids = [int(vector_id) for vector_id in vector_ids if vector_id != -1]
+        rows = {}
+        if hit_ids:
+            self.db.cursor.execute(
+                f"SELECT vector_id, metadata, memory_type FROM vector_metadata WHERE vector_id IN ({','.join('?' * len(hit_ids))})",
+                hit_ids
+            )
+            rows = {vector_id: (metadata, memory_type) for vector_id, metadata, memory_type in self.db.cursor.fetchall()}
+        
         results = []
-        for i, idx in enumerate(indices[0]):
+        # 按索引返回的相似度顺序组装结果
+        for i, vector_id in enumerate(vector_ids):
             if len(results) >= k:
                 break
-            # 使用映射获取正确的vector_id
-            if idx in self.vector_mapping:
-                vector_id = self.vector_mapping[idx]
-                self.cursor.execute("SELECT metadata, memory_type FROM vector_metadata WHERE vector_id = ?", (vector_id,))
-                row = self.cursor.fetchone()
-                if row:
-                    metadata = json.loads(row[0])
-                    memory_type = row[1]
-                    if filter_by_type and memory_type != filter_by_type:
-                        continue
-                    results.append({'metadata': metadata, 'score': float(distances[0][i])})
+            row = rows.get(int(vector_id))
+            if row:
+                metadata, memory_type = row
+                if filter_by_type and memory_type != filter_by_type:  # 未分段的类型仍在此兜底过滤
+                    continue
+                results.append({'metadata': orjson.loads(metadata), 'score': float(scores[i])})
         print(f"🔍 VectorDB: 查询 '{query_text[:30]}...'，找到 {len(results)} 个结果。")
         return results
 
@@ -439,78 +934,101 @@ class MemoryOrchestrator:
         self.structured_ltm = StructuredLTM(db_path=db_path)
         self.kg_mem = KnowledgeGraphMemory()
         self.procedural_mem = ProceduralMemory()
+        self._build_dispatch()
         print("--- 记忆编排器初始化完成 ---\n")
 
-    def store(self, memory_type: str, **kwargs):
-        if memory_type == 'stm': 
-            # 支持新版摘要存储和旧版消息存储
-            if 'conversation_summary' in kwargs:
-                # 新版摘要存储
-                self.stm.store_summary(
-                    kwargs['conversation_id'], 
-                    kwargs['conversation_summary'],
-                    kwargs['round_id']
-                )
-            else:
-                # 旧版消息存储，保持向后兼容
-                message = {
-                    'role': kwargs.get('role', 'user'),
-                    'content': kwargs.get('content', ''),
-                    'timestamp': kwargs.get('timestamp', time.time())
-                }
-                self.stm.store(kwargs['conversation_id'], message)
-        elif memory_type == 'wm': 
-            # context重命名为data
-            data = kwargs.get('context', kwargs.get('data', {}))
-            self.wm.store(kwargs['agent_id'], kwargs['task_id'], data)
-        elif memory_type in ['episodic', 'semantic_fact', 'ltm_doc']:
-            vec_type_map = {'semantic_fact': 'semantic', 'ltm_doc': 'ltm_doc', 'episodic': 'episodic'}
-            self.vector_mem.store(vec_type_map[memory_type], kwargs['text'], kwargs['metadata'])
-        elif memory_type == 'episodic': 
-            # 情节记忆存储
-            vector_id = self.store_vector(kwargs['text'], kwargs.get('metadata', {}), 'episodic')
-            return {'status': 'success', 'vector_id': vector_id}
-        elif memory_type == 'semantic_fact': 
-            # 语义事实存储
-            vector_id = self.store_vector(kwargs['text'], kwargs.get('metadata', {}), 'semantic')
-            return {'status': 'success', 'vector_id': vector_id}
-        elif memory_type == 'ltm_preference': self.structured_ltm.store(kwargs['user_id'], kwargs['key'], kwargs['value'])
-        elif memory_type == 'kg_relation': self.kg_mem.store(kwargs['subject'], kwargs['relation'], kwargs['obj'])
-        elif memory_type == 'procedural_skill': self.procedural_mem.store(kwargs['skill_name'], kwargs['code'])
-        else: raise HTTPException(status_code=400, detail=f"未知的记忆类型: {memory_type}")
-    def retrieve(self, memory_type: str, **kwargs) -> Any:
-        if memory_type == 'stm': 
-            # 支持旧版消息检索和新版摘要检索
-            if 'retrieve_type' in kwargs and kwargs['retrieve_type'] == 'summaries':
-                return self.stm.retrieve_summaries(kwargs['conversation_id'], kwargs.get('last_k', 15))
-            else:
-                return self.stm.retrieve(kwargs['conversation_id'], kwargs.get('last_k', 10))
-        elif memory_type == 'wm': 
+    # 对外的向量记忆类型名 -> VectorMemory 内部类型
+    VECTOR_TYPE_MAP = {'semantic_fact': 'semantic', 'semantic': 'semantic', 'ltm_doc': 'ltm_doc', 'episodic': 'episodic'}
+
+    def _build_dispatch(self):
+        """按记忆类型分发到对应处理函数，取代 if/elif 链"""
+        self._store_dispatch = {
+            'stm': self._store_stm, 'wm': self._store_wm,
+            'episodic': self._store_vector, 'semantic_fact': self._store_vector, 'ltm_doc': self._store_vector,
+            'ltm_preference': lambda memory_type, **kwargs: self.structured_ltm.store(kwargs['user_id'], kwargs['key'], kwargs['value']),
+            'kg_relation': self._store_kg,
+            'procedural_skill': lambda memory_type, **kwargs: self.procedural_mem.store(kwargs['skill_name'], kwargs['code']),
+        }
+        self._retrieve_dispatch = {
+            'stm': self._retrieve_stm,
             # 支持只传task_id或同时传agent_id和task_id
-            agent_id = kwargs.get('agent_id')
-            task_id = kwargs.get('task_id')
-            return self.wm.retrieve(agent_id, task_id)
-        elif memory_type in ['episodic', 'semantic', 'semantic_fact', 'ltm_doc']:
-            vec_type_map = {'semantic_fact': 'semantic', 'semantic': 'semantic', 'ltm_doc': 'ltm_doc', 'episodic': 'episodic'}
-            return self.vector_mem.retrieve(kwargs['query_text'], kwargs.get('k', 5), vec_type_map.get(memory_type))
-        elif memory_type == 'episodic': 
-            # 情节记忆检索
-            results = self.retrieve_vector(kwargs['query_text'], memory_type='episodic')
-            return {'status': 'success', 'data': results}
-        elif memory_type == 'semantic_fact': 
-            # 语义事实检索
-            results = self.retrieve_vector(kwargs['query_text'], memory_type='semantic')
-            return {'status': 'success', 'data': results}
-        elif memory_type == 'ltm_preference': return self.structured_ltm.retrieve(kwargs['user_id'], kwargs['key'])
-        elif memory_type == 'kg_relation': 
+            'wm': lambda memory_type, **kwargs: self.wm.retrieve(kwargs.get('agent_id'), kwargs.get('task_id')),
+            'episodic': self._retrieve_vector, 'semantic': self._retrieve_vector, 'semantic_fact': self._retrieve_vector, 'ltm_doc': self._retrieve_vector,
+            'ltm_preference': lambda memory_type, **kwargs: self.structured_ltm.retrieve(kwargs['user_id'], kwargs['key']),
             # 知识图谱查询已经返回标准格式，直接返回
-            return self.kg_mem.retrieve(kwargs['subject'], kwargs['relation'])
-        elif memory_type == 'procedural_skill': return self.procedural_mem.retrieve(kwargs['skill_name'], *kwargs.get('args', []), **kwargs.get('kwargs', {}))
-        else: raise HTTPException(status_code=400, detail=f"未知的记忆类型: {memory_type}")
+            'kg_relation': lambda memory_type, **kwargs: self.kg_mem.retrieve(kwargs['subject'], kwargs['relation']),
+            'procedural_skill': lambda memory_type, **kwargs: self.procedural_mem.retrieve(kwargs['skill_name'], *kwargs.get('args', []), **kwargs.get('kwargs', {})),
+        }
+        self._clear_dispatch = {
+            'stm': lambda memory_type, **kwargs: self.stm.clear(kwargs['conversation_id']),
+            'wm': lambda memory_type, **kwargs: self.wm.clear(kwargs['agent_id'], kwargs['task_id']),
+        }
+
+    def _store_stm(self, memory_type: str, **kwargs):
+        # 支持新版摘要存储和旧版消息存储
+        if 'conversation_summary' in kwargs:
+            # 新版摘要存储
+            self.stm.store_summary(
+                kwargs['conversation_id'], 
+                kwargs['conversation_summary'],
+                kwargs['round_id']
+            )
+        elif 'messages' in kwargs:
+            # 批量消息存储：messages 为 [{"role", "content", "timestamp"}, ...]
+            self.stm.store_batch(kwargs['conversation_id'], [{
+                'role': m.get('role', 'user'),
+                'content': m.get('content', ''),
+                'timestamp': m.get('timestamp', time.time())
+            } for m in kwargs['messages']])
+        else:
+            # 旧版消息存储，保持向后兼容
+            message = {
+                'role': kwargs.get('role', 'user'),
+                'content': kwargs.get('content', ''),
+                'timestamp': kwargs.get('timestamp', time.time())
+            }
+            self.stm.store(kwargs['conversation_id'], message)
+
+    def _store_wm(self, memory_type: str, **kwargs):
+        # context重命名为data
+        data = kwargs.get('context', kwargs.get('data', {}))
+        self.wm.store(kwargs['agent_id'], kwargs['task_id'], data)
+
+    def _store_vector(self, memory_type: str, **kwargs):
+        if 'items' in kwargs:
+            # 批量存储：items 为 [{"text": ..., "metadata": {...}}, ...]
+            items = [(item['text'], item.get('metadata', {})) for item in kwargs['items']]
+            self.vector_mem.store_batch(self.VECTOR_TYPE_MAP[memory_type], items)
+        else:
+            self.vector_mem.store(self.VECTOR_TYPE_MAP[memory_type], kwargs['text'], kwargs['metadata'])
+
+    def _store_kg(self, memory_type: str, **kwargs):
+        if 'triples' in kwargs: self.kg_mem.store_batch([tuple(t) for t in kwargs['triples']])
+        else: self.kg_mem.store(kwargs['subject'], kwargs['relation'], kwargs['obj'])
+
+    def _retrieve_stm(self, memory_type: str, **kwargs):
+        # 支持旧版消息检索和新版摘要检索
+        if kwargs.get('retrieve_type') == 'summaries':
+            if 'conversation_ids' in kwargs:
+                return self.stm.retrieve_summaries_bulk(kwargs['conversation_ids'], kwargs.get('last_k', 15))
+            return self.stm.retrieve_summaries(kwargs['conversation_id'], kwargs.get('last_k', 15))
+        return self.stm.retrieve(kwargs['conversation_id'], kwargs.get('last_k', 10))
+
+    def _retrieve_vector(self, memory_type: str, **kwargs):
+        return self.vector_mem.retrieve(kwargs['query_text'], kwargs.get('k', 5), self.VECTOR_TYPE_MAP[memory_type])
+
+    def store(self, memory_type: str, **kwargs):
+        handler = self._store_dispatch.get(memory_type)
+        if handler is None: raise HTTPException(status_code=400, detail=f"未知的记忆类型: {memory_type}")
+        return handler(memory_type, **kwargs)
+    def retrieve(self, memory_type: str, **kwargs) -> Any:
+        handler = self._retrieve_dispatch.get(memory_type)
+        if handler is None: raise HTTPException(status_code=400, detail=f"未知的记忆类型: {memory_type}")
+        return handler(memory_type, **kwargs)
     def clear(self, memory_type: str, **kwargs):
-        if memory_type == 'stm': self.stm.clear(kwargs['conversation_id'])
-        elif memory_type == 'wm': self.wm.clear(kwargs['agent_id'], kwargs['task_id'])
-        else: raise HTTPException(status_code=400, detail=f"清除操作不支持记忆类型: {memory_type}")
+        handler = self._clear_dispatch.get(memory_type)
+        if handler is None: raise HTTPException(status_code=400, detail=f"清除操作不支持记忆类型: {memory_type}")
+        return handler(memory_type, **kwargs)
 
 # --- 8. FastAPI 应用 [已修正] ---
 
@@ -522,7 +1040,9 @@ async def lifespan(app: FastAPI):
     # 应用启动时执行的代码
     print("🚀 记忆服务启动完成，等待客户端植入知识...")
     yield
-    # 应用关闭时执行的代码
+    # 应用关闭时执行的代码：写出尚未保存的向量索引
+    orchestrator.vector_mem.flush()
+    orchestrator.kg_mem.close()
     print("👋 记忆服务正在关闭。")
 
 app = FastAPI(title="Agent Memory System API", version="1.4", lifespan=lifespan)
@@ -536,35 +1056,51 @@ def health_check():
 class StoreRequest(BaseModel): memory_type: str; params: Dict[str, Any]
 class RetrieveRequest(BaseModel): memory_type: str; params: Dict[str, Any]
 class ClearRequest(BaseModel): memory_type: str; params: Dict[str, Any]
+class RetrieveBatchRequest(BaseModel): batch: List[RetrieveRequest]
+def _store_and_schedule_save(memory_type: str, params: Dict[str, Any]):
+    orchestrator.store(memory_type, **params)
+    # 🆕 存储后按去抖策略在后台保存向量索引（如果有更改）
+    orchestrator.vector_mem.save_if_needed()
+
+# 处理函数为 async，阻塞的 Redis/SQLite/Neo4j/HTTP 调用放到线程中执行，不占用事件循环
 @app.post("/store")
-def store_memory(request: StoreRequest):
+async def store_memory(request: StoreRequest):
     try: 
-        orchestrator.store(request.memory_type, **request.params)
-        # 🆕 存储后保存向量索引（如果有更改）
-        orchestrator.vector_mem.save_if_needed()
+        await asyncio.to_thread(_store_and_schedule_save, request.memory_type, request.params)
         return {"status": "success"}
     except Exception as e: 
         print(f"❌ API存储错误 - 记忆类型: {request.memory_type}, 参数: {request.params}, 错误: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+def _format_retrieve_result(result: Any) -> Dict[str, Any]:
+    # 🔧 修复双层嵌套：如果result已经是标准格式，直接返回
+    if isinstance(result, dict) and 'status' in result:
+        return result
+    return {"status": "success", "data": result}
 @app.post("/retrieve")
-def retrieve_memory(request: RetrieveRequest):
+async def retrieve_memory(request: RetrieveRequest):
     try: 
-        result = orchestrator.retrieve(request.memory_type, **request.params)
-        # 🔧 修复双层嵌套：如果result已经是标准格式，直接返回
-        if isinstance(result, dict) and 'status' in result:
-            return result
-        else:
-            return {"status": "success", "data": result}
+        result = await asyncio.to_thread(orchestrator.retrieve, request.memory_type, **request.params)
+        return _format_retrieve_result(result)
     except Exception as e: 
         print(f"❌ API错误 - 记忆类型: {request.memory_type}, 参数: {request.params}, 错误: {str(e)}")
         import traceback
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
+async def _retrieve_one(item: RetrieveRequest) -> Dict[str, Any]:
+    try:
+        return _format_retrieve_result(await asyncio.to_thread(orchestrator.retrieve, item.memory_type, **item.params))
+    except Exception as e:
+        print(f"❌ API批量检索错误 - 记忆类型: {item.memory_type}, 参数: {item.params}, 错误: {str(e)}")
+        return {"status": "error", "detail": str(e.detail) if isinstance(e, HTTPException) else str(e)}
+@app.post("/retrieve_batch")
+async def retrieve_memory_batch(request: RetrieveBatchRequest):
+    """一次请求检索多个记忆模块，各项并发执行；结果顺序与请求一致，单项失败只影响该项"""
+    return {"status": "success", "results": await asyncio.gather(*(_retrieve_one(item) for item in request.batch))}
 @app.post("/clear")
-def clear_memory(request: ClearRequest):
-    try: orchestrator.clear(request.memory_type, **request.params); return {"status": "success"}
+async def clear_memory(request: ClearRequest):
+    try: await asyncio.to_thread(orchestrator.clear, request.memory_type, **request.params); return {"status": "success"}
     except Exception as e: raise HTTPException(status_code=500, detail=str(e))
 
 # 原有的 @app.on_event("startup") 已被移除
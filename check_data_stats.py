@@ -13,13 +13,36 @@ neo4j 用你自己密码*
 """
 
 import redis
+import redis.asyncio as aioredis
 import sqlite3
 import faiss
+import asyncio
+import atexit
+import contextvars
+import io
 import json
 import os
+import re
 import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
 from datetime import datetime
 
+# orjson 解析更快，未安装时回退到标准库 json
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# ijson 可选：流式统计大映射文件
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
 # 尝试导入Neo4j，如果失败则设置为None
 try:
     from neo4j import GraphDatabase
@@ -30,15 +53,52 @@ except ImportError:
 
 # 配置信息
 REDIS_CONFIG = {'host': 'localhost', 'port': 6379, 'db': 0}
+REDIS_SCAN_COUNT = 500  # SCAN 每批返回的key数量提示
+# 在服务端按类型取大小：list/hash 返回元素数，string 返回原值，其他类型计为 1
+KEY_SIZE_LUA = """
+local t = redis.call('TYPE', KEYS[1])['ok']
+if t == 'list' then return redis.call('LLEN', KEYS[1])
+elseif t == 'hash' then return redis.call('HLEN', KEYS[1])
+elseif t == 'string' then return redis.call('GET', KEYS[1])
+else return 1 end
+"""
+# 统计与健康检查共用的连接池；keepalive + 周期健康检查避免长时间运行时复用失效连接
+_REDIS_POOL = redis.ConnectionPool(
+    max_connections=16, decode_responses=True,
+    socket_keepalive=True, socket_timeout=2, health_check_interval=30,
+    **REDIS_CONFIG
+)
 SQLITE_DB = 'ltm.db'
+# 统计的表: (表名, 分组列, (结果键, 分布键))
+SQLITE_STAT_QUERIES = (
+    ('preferences', 'user_id', ('old_preferences', 'users')),
+    ('ltm_preferences', 'user_id', ('new_preferences', 'users')),
+    ('vector_metadata', 'memory_type', ('vector_metadata', 'types')),
+)
+SQLITE_DEBUG = '--debug' in sys.argv  # 仅调试时打印执行的SQL，平时不挂 trace 回调
+# 只读统计连接的参数：大页缓存 + mmap 读，query_only 防止误写
+SQLITE_READ_PRAGMAS = (
+    "PRAGMA query_only=ON",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-65536",
+    "PRAGMA mmap_size=268435456",
+)
 NEO4J_CONFIG = {
     'uri': 'bolt://localhost:7687',
     'user': 'neo4j', 
     'password': '*****'
 }
+NEO4J_POOL_CONFIG = {'max_connection_pool_size': 10, 'connection_acquisition_timeout': 5}
 VECTOR_INDEX_FILE = 'vector_index.faiss'
+# 统计只需索引头部的 ntotal/d，以 mmap 只读方式打开，不把整个索引读入内存
+FAISS_READ_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
 VECTOR_MAPPING_FILE = 'vector_mapping.json'
+MAPPING_HEAD_BYTES = 4096
+MAPPING_NEW_FORMAT_RE = re.compile(rb'\s*\{\s*"ids"\s*:')
 SKILLS_DIR = 'skills'
+# 健康检查结果短期缓存，监控脚本背靠背调用时直接复用
+HEALTH_CACHE_FILE = '/tmp/agent_memoryforge_health.json'
+HEALTH_CACHE_TTL = 5
 
 def print_header():
     """打印统计头部信息"""
@@ -47,94 +107,164 @@ def print_header():
     print(f"⏰ 统计时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print("=" * 60)
 
+class _TaskBufferedStdout:
+    """按任务缓冲的 stdout：并发执行的检查（协程或 to_thread 线程）各自写入自己的缓冲区，避免输出交错"""
+    def __init__(self, stream):
+        self.stream = stream
+        # to_thread 会复制当前上下文，线程中的 print 同样写入所属任务的缓冲区
+        self._buffer = contextvars.ContextVar('check_output', default=None)
+    
+    def write(self, text):
+        buffer = self._buffer.get()
+        return (buffer if buffer is not None else self.stream).write(text)
+    
+    def flush(self):
+        self.stream.flush()
+    
+    def capture(self):
+        self._buffer.set(io.StringIO())
+    
+    def release(self) -> str:
+        output = self._buffer.get().getvalue()
+        self._buffer.set(None)
+        return output
+
+@contextmanager
+def buffered_stdout():
+    """整段报告先写入内存，结束时一次 write 输出，减少逐行 print 的系统调用"""
+    stream = sys.stdout
+    buffer = io.StringIO()
+    sys.stdout = buffer
+    try:
+        yield
+    finally:
+        sys.stdout = stream
+        stream.write(buffer.getvalue())
+        stream.flush()
+
+async def run_checks_async(checks):
+    """并发执行互相独立的检查 [(name, func), ...]：协程函数直接 await，同步函数放入 to_thread；
+    按传入顺序输出各自的打印内容，返回 {name: result}"""
+    stdout = _TaskBufferedStdout(sys.stdout)
+    
+    async def run(func):
+        stdout.capture()
+        try:
+            if asyncio.iscoroutinefunction(func):
+                result = await func()
+            else:
+                result = await asyncio.to_thread(func)
+        finally:
+            output = stdout.release()
+        return result, output
+    
+    sys.stdout = stdout
+    try:
+        # gather 为每个检查创建独立任务（各自的上下文副本）
+        outcomes = await asyncio.gather(*(run(func) for _, func in checks))
+    finally:
+        sys.stdout = stdout.stream
+    results = {}
+    for (name, _), (result, output) in zip(checks, outcomes):
+        results[name] = result
+        stdout.stream.write(output)
+    return results
+
+def run_checks_concurrently(checks):
+    return asyncio.run(run_checks_async(checks))
+
+def _get_redis() -> redis.Redis:
+    return redis.Redis(connection_pool=_REDIS_POOL)
+
+def _get_async_redis() -> aioredis.Redis:
+    """异步客户端的连接池绑定事件循环，每次检查单独创建，用完关闭"""
+    return aioredis.Redis(decode_responses=True, socket_keepalive=True, socket_timeout=2, **REDIS_CONFIG)
+
+async def _scan_key_batches(redis_client, pattern):
+    """边 SCAN 边按 REDIS_SCAN_COUNT 分批产出key，内存占用只与批大小有关"""
+    batch = []
+    async for key in redis_client.scan_iter(match=pattern, count=REDIS_SCAN_COUNT):
+        batch.append(key)
+        if len(batch) >= REDIS_SCAN_COUNT:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+async def _pipeline_each(redis_client, keys, command, *args):
+    """对一批key各执行一次同一命令，整批一个管道往返；单个key出错（如类型不符）时结果为 None"""
+    if not keys:
+        return []
+    pipe = redis_client.pipeline(transaction=False)
+    for key in keys:
+        getattr(pipe, command)(*args, key)
+    values = await pipe.execute(raise_on_error=False)
+    return [None if isinstance(value, Exception) else value for value in values]
+
 def check_redis_data():
-    """检查Redis数据"""
+    """检查Redis数据（同步入口）"""
+    return asyncio.run(check_redis_data_async())
+
+async def check_redis_data_async():
+    """检查Redis数据：SCAN 与管道探测均为异步，与其他后端的检查在同一事件循环中重叠等待"""
+    redis_client = _get_async_redis()
     try:
-        redis_client = redis.Redis(**REDIS_CONFIG, decode_responses=True)
-        redis_client.ping()
+        await redis_client.ping()
         
-        # STM 对话数据统计
-        stm_keys = redis_client.keys('stm:conversation:*')
+        # STM 对话数据统计（SCAN 增量遍历，不阻塞服务端；按批探测，不在内存中保留完整key列表）
         stm_conversation_count = 0
         stm_summary_count = 0
+        key_size_sha = await redis_client.script_load(KEY_SIZE_LUA)
         
-        # 分类处理不同类型的STM key
-        conversation_keys = [k for k in stm_keys if not k.endswith(':summaries')]
-        summary_keys = [k for k in stm_keys if k.endswith(':summaries')]
-        
-        # 统计对话数据
-        for key in conversation_keys:
-            try:
-                # 检查数据类型
-                key_type = redis_client.type(key)
-                if key_type == 'string':
-                    data = redis_client.get(key)
-                    if data:
-                        try:
-                            conv_data = json.loads(data)
-                            stm_conversation_count += 1
-                        except json.JSONDecodeError:
-                            stm_conversation_count += 1  # 非JSON数据也算一个对话
-                elif key_type == 'list':
-                    length = redis_client.llen(key)
-                    if length > 0:
-                        stm_conversation_count += 1
-                elif key_type == 'hash':
-                    fields = redis_client.hlen(key)
-                    if fields > 0:
-                        stm_conversation_count += 1
-            except Exception:
-                # 静默处理错误，避免干扰统计
-                continue
-        
-        # 统计摘要数据
-        for key in summary_keys:
-            try:
-                key_type = redis_client.type(key)
-                if key_type == 'hash':
-                    stm_summary_count += redis_client.hlen(key)
-                elif key_type == 'list':
-                    stm_summary_count += redis_client.llen(key)
-                elif key_type == 'string':
-                    data = redis_client.get(key)
-                    if data:
-                        try:
-                            summary_data = json.loads(data)
-                            if isinstance(summary_data, list):
-                                stm_summary_count += len(summary_data)
-                            else:
-                                stm_summary_count += 1
-                        except json.JSONDecodeError:
+        async for stm_keys in _scan_key_batches(redis_client, 'stm:conversation:*'):
+            # 分类处理不同类型的STM key
+            conversation_keys = [k for k in stm_keys if not k.endswith(':summaries')]
+            summary_keys = [k for k in stm_keys if k.endswith(':summaries')]
+            
+            # 统计对话数据：每个存在的key算一个对话（Redis 不保留空的 list/hash），只需 EXISTS
+            stm_conversation_count += sum(1 for exists in await _pipeline_each(redis_client, conversation_keys, 'exists') if exists)
+            
+            # 统计摘要数据：服务端脚本按类型返回元素数，字符串返回原值再在本地解析
+            for value in await _pipeline_each(redis_client, summary_keys, 'evalsha', key_size_sha, 1):
+                if isinstance(value, int):
+                    stm_summary_count += value
+                elif value:
+                    try:
+                        summary_data = json_loads(value)
+                        if isinstance(summary_data, list):
+                            stm_summary_count += len(summary_data)
+                        else:
                             stm_summary_count += 1
-            except Exception:
-                continue
+                    except json.JSONDecodeError:
+                        stm_summary_count += 1
         
         # WM 工作任务数据
-        wm_keys = redis_client.keys('wm:task:*')
-        wm_valid_tasks = 0
-        task_types = {}
-        task_status = {}
-        
-        for key in wm_keys:
-            try:
-                key_type = redis_client.type(key)
-                if key_type == 'string':
-                    data = redis_client.get(key)
-                    if data:
-                        try:
-                            task_data = json.loads(data)
-                            if isinstance(task_data, dict):
-                                wm_valid_tasks += 1
-                                task_type = task_data.get('task_type', 'unknown')
-                                status = task_data.get('status', 'unknown')
-                                task_types[task_type] = task_types.get(task_type, 0) + 1
-                                task_status[status] = task_status.get(status, 0) + 1
-                        except json.JSONDecodeError:
-                            wm_valid_tasks += 1
-                            task_types['unknown'] = task_types.get('unknown', 0) + 1
-                            task_status['unknown'] = task_status.get('unknown', 0) + 1
-            except Exception:
-                continue
+        wm_key_count = 0
+        task_types = Counter()
+        task_status = Counter()
+        
+        async for wm_keys in _scan_key_batches(redis_client, 'wm:task:*'):
+            wm_key_count += len(wm_keys)
+            batch_types = []
+            batch_status = []
+            # 任务为字符串值，直接 GET；非字符串key返回类型错误，结果为 None 被跳过
+            for data in await _pipeline_each(redis_client, wm_keys, 'get'):
+                if not data:
+                    continue
+                # 任务值约定为JSON对象，直接取字段，只在异常时处理
+                try:
+                    task_data = json_loads(data)
+                    task_type = task_data.get('task_type', 'unknown')
+                    status = task_data.get('status', 'unknown')
+                except json.JSONDecodeError:
+                    task_type = status = 'unknown'
+                except AttributeError:
+                    continue  # 非对象JSON不算有效任务
+                batch_types.append(task_type)
+                batch_status.append(status)
+            task_types.update(batch_types)
+            task_status.update(batch_status)
+        wm_valid_tasks = sum(task_types.values())
         
         print(f'🔴 Redis存储统计:')
         print(f'  � STM短期记忆:')
@@ -142,7 +272,7 @@ def check_redis_data():
         print(f'    - 对话摘要: {stm_summary_count} 条')
         
         print(f'  🔄 WM工作记忆:')
-        print(f'    - 有效任务: {wm_valid_tasks} 个 (总key: {len(wm_keys)})')
+        print(f'    - 有效任务: {wm_valid_tasks} 个 (总key: {wm_key_count})')
         if task_types:
             print(f'    - 任务类型: {dict(list(task_types.items())[:3])}{"..." if len(task_types) > 3 else ""}')
         if task_status:
@@ -158,6 +288,22 @@ def check_redis_data():
     except Exception as e:
         print(f'❌ Redis连接失败: {e}')
         return {'status': 'error', 'error': str(e)}
+    finally:
+        await redis_client.close()
+
+_SQLITE_CONN = None
+
+def _get_sqlite() -> sqlite3.Connection:
+    """模块级只读连接，统计与健康检查共用，避免重复打开数据库文件；WAL 下不会阻塞服务端写入"""
+    global _SQLITE_CONN
+    if _SQLITE_CONN is None:
+        conn = sqlite3.connect(f'file:{SQLITE_DB}?mode=ro', uri=True, check_same_thread=False)
+        for pragma in SQLITE_READ_PRAGMAS:
+            conn.execute(pragma)
+        if SQLITE_DEBUG:
+            conn.set_trace_callback(lambda sql: print(f'🐞 SQL: {sql}'))
+        _SQLITE_CONN = conn
+    return _SQLITE_CONN
 
 def check_sqlite_data():
     """检查SQLite数据"""
@@ -166,49 +312,27 @@ def check_sqlite_data():
             print(f'⚠️ SQLite数据库文件 {SQLITE_DB} 不存在')
             return {'status': 'error', 'error': 'Database file not found'}
         
-        conn = sqlite3.connect(SQLITE_DB)
-        cursor = conn.cursor()
+        cursor = _get_sqlite().cursor()
         
         # 检查表是否存在
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
         tables = [row[0] for row in cursor.fetchall()]
         
-        results = {}
-        
-        # LTM偏好数据 (旧表)
-        if 'preferences' in tables:
-            cursor.execute('SELECT COUNT(*) FROM preferences')
-            prefs_count = cursor.fetchone()[0]
-            
-            # 统计用户分布
-            cursor.execute('SELECT user_id, COUNT(*) FROM preferences GROUP BY user_id')
-            user_prefs = dict(cursor.fetchall())
-            results['old_preferences'] = {'count': prefs_count, 'users': user_prefs}
-        else:
-            results['old_preferences'] = {'count': 0, 'users': {}}
-        
-        # LTM偏好数据 (新表)
-        if 'ltm_preferences' in tables:
-            cursor.execute('SELECT COUNT(*) FROM ltm_preferences')
-            ltm_prefs_count = cursor.fetchone()[0]
-            
-            cursor.execute('SELECT user_id, COUNT(*) FROM ltm_preferences GROUP BY user_id')
-            ltm_user_prefs = dict(cursor.fetchall())
-            results['new_preferences'] = {'count': ltm_prefs_count, 'users': ltm_user_prefs}
-        else:
-            results['new_preferences'] = {'count': 0, 'users': {}}
-        
-        # 向量元数据
-        if 'vector_metadata' in tables:
-            cursor.execute('SELECT COUNT(*) FROM vector_metadata')
-            vector_meta_count = cursor.fetchone()[0]
-            
-            # 按类型统计
-            cursor.execute('SELECT memory_type, COUNT(*) FROM vector_metadata GROUP BY memory_type')
-            memory_types = dict(cursor.fetchall())
-            results['vector_metadata'] = {'count': vector_meta_count, 'types': memory_types}
-        else:
-            results['vector_metadata'] = {'count': 0, 'types': {}}
+        # 各表的分组计数合并为一条 UNION ALL 查询，总数由分组求和得到；不存在的表直接跳过
+        groups = {table: {} for table, _, _ in SQLITE_STAT_QUERIES}
+        selects = [
+            f"SELECT '{table}', {group_column}, COUNT(*) FROM {table} GROUP BY {group_column}"
+            for table, group_column, _ in SQLITE_STAT_QUERIES if table in tables
+        ]
+        if selects:
+            cursor.execute(' UNION ALL '.join(selects))
+            for table, group, count in cursor.fetchall():
+                groups[table][group] = count
+        
+        results = {
+            key: {'count': sum(groups[table].values()), detail_key: groups[table]}
+            for table, _, (key, detail_key) in SQLITE_STAT_QUERIES
+        }
         
         # 获取文件大小
         file_size = os.path.getsize(SQLITE_DB)
@@ -226,13 +350,25 @@ def check_sqlite_data():
         if results['vector_metadata']['types']:
             print(f'    - 类型分布: {results["vector_metadata"]["types"]}')
         
-        conn.close()
+        cursor.close()
         return {'status': 'success', **results, 'file_size_mb': size_mb}
         
     except Exception as e:
         print(f'❌ SQLite统计失败: {e}')
         return {'status': 'error', 'error': str(e)}
 
+def _scan_mapping_file(path):
+    """返回映射文件的 (顶层条目数, 格式)：格式只看文件头部，计数在有 ijson 时流式完成，内存占用恒定"""
+    with open(path, 'rb') as f:
+        head = f.read(MAPPING_HEAD_BYTES)
+        mapping_format = 'new' if MAPPING_NEW_FORMAT_RE.match(head) else 'old'
+        f.seek(0)
+        if ijson is not None:
+            count = sum(1 for prefix, event, _ in ijson.parse(f) if prefix == '' and event == 'map_key')
+        else:
+            count = len(json_loads(f.read()))
+    return count, mapping_format
+
 def check_faiss_data():
     """检查Faiss向量数据"""
     try:
@@ -240,7 +376,7 @@ def check_faiss_data():
         
         # 检查向量索引文件
         if os.path.exists(VECTOR_INDEX_FILE):
-            index = faiss.read_index(VECTOR_INDEX_FILE)
+            index = faiss.read_index(VECTOR_INDEX_FILE, FAISS_READ_FLAGS)
             vector_count = index.ntotal
             vector_dim = index.d
             
@@ -258,19 +394,17 @@ def check_faiss_data():
         
         # 检查映射文件
         if os.path.exists(VECTOR_MAPPING_FILE):
-            with open(VECTOR_MAPPING_FILE, 'r') as f:
-                mapping_data = json.load(f)
-                mapping_count = len(mapping_data)
-                
-                # 文件大小
-                file_size = os.path.getsize(VECTOR_MAPPING_FILE)
-                size_kb = file_size / 1024
-                
-                results['mapping'] = {
-                    'count': mapping_count,
-                    'size_kb': size_kb,
-                    'format': 'new' if 'ids' in mapping_data else 'old'
-                }
+            mapping_count, mapping_format = _scan_mapping_file(VECTOR_MAPPING_FILE)
+            
+            # 文件大小
+            file_size = os.path.getsize(VECTOR_MAPPING_FILE)
+            size_kb = file_size / 1024
+            
+            results['mapping'] = {
+                'count': mapping_count,
+                'size_kb': size_kb,
+                'format': mapping_format
+            }
         else:
             results['mapping'] = {'count': 0, 'size_kb': 0, 'format': 'none'}
         
@@ -297,6 +431,30 @@ def check_faiss_data():
         print(f'❌ Faiss统计失败: {e}')
         return {'status': 'error', 'error': str(e)}
 
+_NEO4J_DRIVER = None
+_NEO4J_DRIVER_LOCK = threading.Lock()
+
+def _get_neo4j_driver():
+    """模块级惰性创建的Neo4j驱动，统计与健康检查共用同一连接池"""
+    global _NEO4J_DRIVER
+    with _NEO4J_DRIVER_LOCK:
+        if _NEO4J_DRIVER is None:
+            neo4j_user = NEO4J_CONFIG.get('user') or NEO4J_CONFIG.get('username')
+            _NEO4J_DRIVER = GraphDatabase.driver(
+                NEO4J_CONFIG['uri'], auth=(neo4j_user, NEO4J_CONFIG['password']), **NEO4J_POOL_CONFIG
+            )
+            atexit.register(_NEO4J_DRIVER.close)
+    return _NEO4J_DRIVER
+
+def _read_graph_stats(tx):
+    """一条查询同时返回节点标签与关系类型的分组计数：[(kind, name, count), ...]"""
+    result = tx.run(
+        "CALL { MATCH (n) RETURN 'node' AS kind, labels(n)[0] AS name "
+        "UNION ALL MATCH ()-[r]->() RETURN 'rel' AS kind, type(r) AS name } "
+        "RETURN kind, name, count(*) AS count"
+    )
+    return [(record['kind'], record['name'], record['count']) for record in result]
+
 def check_neo4j_data():
     """检查Neo4j图数据"""
     try:
@@ -314,38 +472,27 @@ def check_neo4j_data():
             print(f'❌ Neo4j配置不完整: uri={bool(neo4j_uri)}, user={bool(neo4j_user)}, password={bool(neo4j_password)}')
             return {'status': 'error', 'error': 'Neo4j配置缺失'}
         
-        # 连接数据库
+        # 连接数据库（复用模块级驱动的连接池）
         try:
-            driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password))
+            driver = _get_neo4j_driver()
             driver.verify_connectivity()
         except Exception as conn_error:
             print(f'❌ Neo4j连接失败: {conn_error}')
             return {'status': 'error', 'error': f'连接失败: {conn_error}'}
         
         with driver.session() as session:
-            # 节点统计
-            result = session.run('MATCH (n) RETURN COUNT(n) as count')
-            nodes_count = result.single()['count']
-            
-            # 关系统计
-            result = session.run('MATCH ()-[r]->() RETURN COUNT(r) as count')
-            relations_count = result.single()['count']
-            
-            # 节点类型统计
-            result = session.run('MATCH (n) RETURN DISTINCT labels(n) as labels, COUNT(n) as count')
+            # 节点/关系总数与类型分布在一次只读事务中取回
+            nodes_count = relations_count = 0
             node_types = {}
-            for record in result:
-                labels = record['labels']
-                if labels:
-                    label = labels[0] if labels else 'Unknown'
-                    node_types[label] = record['count']
-            
-            # 关系类型统计
-            result = session.run('MATCH ()-[r]->() RETURN type(r) as rel_type, COUNT(r) as count')
             relation_types = {}
-            for record in result:
-                rel_type = record['rel_type']
-                relation_types[rel_type] = record['count']
+            for kind, name, count in session.execute_read(_read_graph_stats):
+                if kind == 'node':
+                    nodes_count += count
+                    if name:
+                        node_types[name] = node_types.get(name, 0) + count
+                else:
+                    relations_count += count
+                    relation_types[name] = count
             
             print(f'🔵 Neo4j图数据库统计:')
             print(f'  🔗 连接状态: ✅ 正常 ({neo4j_uri})')
@@ -357,7 +504,6 @@ def check_neo4j_data():
             if relation_types:
                 print(f'    - 类型分布: {dict(list(relation_types.items())[:5])}{"..." if len(relation_types) > 5 else ""}')
         
-        driver.close()
         return {
             'status': 'success',
             'nodes': nodes_count,
@@ -377,36 +523,36 @@ def check_filesystem_data():
             print(f'🟠 技能文件系统: 目录 {SKILLS_DIR} 不存在')
             return {'status': 'error', 'error': 'Skills directory not found'}
         
-        # 扫描技能文件
-        all_files = os.listdir(SKILLS_DIR)
-        skill_files = [f for f in all_files if f.endswith('.py') and not f.startswith('__')]
-        
-        # 按类别统计
-        categories = {}
-        for skill_file in skill_files:
-            if '_' in skill_file:
-                category = skill_file.split('_')[0]
-                categories[category] = categories.get(category, 0) + 1
-        
-        # 计算总大小
+        # 一次 scandir 遍历同时完成计数、类别统计与大小累加（目录项自带类型信息）
+        all_count = 0
+        skill_count = 0
         total_size = 0
-        for skill_file in skill_files:
-            file_path = os.path.join(SKILLS_DIR, skill_file)
-            total_size += os.path.getsize(file_path)
+        categories = {}
+        with os.scandir(SKILLS_DIR) as entries:
+            for entry in entries:
+                all_count += 1
+                name = entry.name
+                if not name.endswith('.py') or name.startswith('__') or not entry.is_file(follow_symlinks=False):
+                    continue
+                skill_count += 1
+                total_size += entry.stat(follow_symlinks=False).st_size
+                category, sep, _ = name.partition('_')
+                if sep:
+                    categories[category] = categories.get(category, 0) + 1
         
         size_kb = total_size / 1024
         
         print(f'🟠 技能文件系统统计 ({SKILLS_DIR}/):')
-        print(f'  📁 总文件数: {len(all_files)} 个')
-        print(f'  🐍 技能文件: {len(skill_files)} 个')
+        print(f'  📁 总文件数: {all_count} 个')
+        print(f'  🐍 技能文件: {skill_count} 个')
         print(f'  💾 总大小: {size_kb:.1f}KB')
         if categories:
             print(f'  📂 类别分布: {dict(list(categories.items())[:5])}{"..." if len(categories) > 5 else ""}')
         
         return {
             'status': 'success',
-            'total_files': len(all_files),
-            'skill_files': len(skill_files),
+            'total_files': all_count,
+            'skill_files': skill_count,
             'categories': categories,
             'size_kb': size_kb
         }
@@ -466,18 +612,111 @@ def print_summary(stats):
     print("\n" + "="*60)
     print(f"✨ 统计完成! 系统数据丰富度: {'🌟🌟🌟' if total_records > 1000 else '🌟🌟' if total_records > 500 else '🌟'}")
 
+def probe_redis():
+    """健康探测：返回 (是否正常, 状态行)"""
+    try:
+        # DBSIZE 为 O(1)，一次往返同时确认连接并给出key总数
+        key_count = _get_redis().dbsize()
+        return True, f"✅ Redis: 正常 ({key_count} keys)"
+    except Exception as e:
+        return False, f"❌ Redis: 失败 ({e})"
+
+def probe_sqlite():
+    try:
+        if os.path.exists(SQLITE_DB):
+            _get_sqlite().execute("SELECT 1")
+            return True, "✅ SQLite: 正常"
+        return False, "⚠️ SQLite: 数据库文件不存在"
+    except Exception as e:
+        return False, f"❌ SQLite: 失败 ({e})"
+
+def probe_faiss():
+    try:
+        if os.path.exists(VECTOR_INDEX_FILE):
+            index = faiss.read_index(VECTOR_INDEX_FILE, FAISS_READ_FLAGS)
+            return True, f"✅ Faiss: 正常 ({index.ntotal} 向量)"
+        return False, "⚠️ Faiss: 向量文件不存在"
+    except Exception as e:
+        return False, f"❌ Faiss: 失败 ({e})"
+
+def probe_neo4j():
+    if not NEO4J_AVAILABLE:
+        return True, "⚠️ Neo4j: 库未安装"
+    try:
+        neo4j_user = NEO4J_CONFIG.get('user') or NEO4J_CONFIG.get('username')
+        neo4j_password = NEO4J_CONFIG.get('password')
+        neo4j_uri = NEO4J_CONFIG.get('uri')
+        
+        if all([neo4j_uri, neo4j_user, neo4j_password]):
+            _get_neo4j_driver().verify_connectivity()
+            return True, "✅ Neo4j: 正常"
+        return False, "⚠️ Neo4j: 配置缺失"
+    except Exception as e:
+        return False, f"❌ Neo4j: 失败 ({e})"
+
+def _health_from_stats(stats):
+    """由详细统计的结果推导健康状态，与 probe_* 的判定保持一致"""
+    health = {}
+    for name, label in (('redis', 'Redis'), ('sqlite', 'SQLite'), ('neo4j', 'Neo4j')):
+        if stats[name]['status'] == 'success':
+            health[name] = (True, f"✅ {label}: 正常")
+        else:
+            health[name] = (False, f"❌ {label}: 失败 ({stats[name].get('error', '未知错误')})")
+    if not NEO4J_AVAILABLE:
+        health['neo4j'] = (True, "⚠️ Neo4j: 库未安装")
+    if stats['faiss']['status'] != 'success':
+        health['faiss'] = (False, f"❌ Faiss: 失败 ({stats['faiss'].get('error', '未知错误')})")
+    elif not os.path.exists(VECTOR_INDEX_FILE):
+        health['faiss'] = (False, "⚠️ Faiss: 向量文件不存在")
+    else:
+        health['faiss'] = (True, f"✅ Faiss: 正常 ({stats['faiss']['index']['count']} 向量)")
+    return health
+
+def _load_health_cache():
+    """读取未过期的健康检查缓存，监控脚本连续调用时无需重新连接各后端"""
+    try:
+        with open(HEALTH_CACHE_FILE, 'rb') as f:
+            cache = json_loads(f.read())
+        if time.time() - cache['time'] <= HEALTH_CACHE_TTL:
+            return {name: tuple(result) for name, result in cache['results'].items()}
+    except (OSError, ValueError, KeyError, TypeError):
+        pass
+    return None
+
+def _save_health_cache(health):
+    try:
+        with open(HEALTH_CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump({'time': time.time(), 'results': health}, f, ensure_ascii=False)
+    except OSError:
+        pass
+
+def check_health():
+    """快速健康检查：优先使用短期缓存，否则并发执行各 probe_*，返回 {name: (ok, 状态行)}"""
+    health = _load_health_cache()
+    if health is None:
+        health = run_checks_concurrently([
+            ('redis', probe_redis),
+            ('sqlite', probe_sqlite),
+            ('faiss', probe_faiss),
+            ('neo4j', probe_neo4j)
+        ])
+        _save_health_cache(health)
+    return health
+
 def main():
     """主函数"""
     print_header()
     
-    # 收集所有统计数据
-    stats = {
-        'redis': check_redis_data(),
-        'sqlite': check_sqlite_data(),
-        'faiss': check_faiss_data(),
-        'neo4j': check_neo4j_data(),
-        'filesystem': check_filesystem_data()
-    }
+    # 各后端互相独立，并发收集所有统计数据
+    stats = run_checks_concurrently([
+        ('redis', check_redis_data_async),
+        ('sqlite', check_sqlite_data),
+        ('faiss', check_faiss_data),
+        ('neo4j', check_neo4j_data),
+        ('filesystem', check_filesystem_data)
+    ])
+    # 详细统计已连接过所有后端，顺带刷新健康检查缓存
+    _save_health_cache(_health_from_stats(stats))
     
     # 打印汇总
     print_summary(stats)
@@ -490,78 +729,26 @@ if __name__ == "__main__":
     # 检查命令行参数
     if len(sys.argv) > 1 and sys.argv[1] == '--health':
         # 快速健康检查模式
-        print("🏥 快速健康检查模式")
-        print("="*40)
-        
-        all_healthy = True
-        
-        # Redis
-        try:
-            redis_client = redis.Redis(**REDIS_CONFIG, decode_responses=True)
-            redis_client.ping()
-            print("✅ Redis: 正常")
-        except Exception as e:
-            print(f"❌ Redis: 失败 ({e})")
-            all_healthy = False
-        
-        # SQLite
-        try:
-            if os.path.exists(SQLITE_DB):
-                conn = sqlite3.connect(SQLITE_DB)
-                conn.execute("SELECT 1")
-                conn.close()
-                print("✅ SQLite: 正常")
-            else:
-                print("⚠️ SQLite: 数据库文件不存在")
-                all_healthy = False
-        except Exception as e:
-            print(f"❌ SQLite: 失败 ({e})")
-            all_healthy = False
-        
-        # Faiss
-        try:
-            if os.path.exists(VECTOR_INDEX_FILE):
-                index = faiss.read_index(VECTOR_INDEX_FILE)
-                print(f"✅ Faiss: 正常 ({index.ntotal} 向量)")
+        with buffered_stdout():
+            print("🏥 快速健康检查模式")
+            print("="*40)
+            
+            health = check_health()
+            for name in ('redis', 'sqlite', 'faiss', 'neo4j'):
+                print(health[name][1])
+            all_healthy = all(ok for ok, _ in health.values())
+            
+            print("="*40)
+            if all_healthy:
+                print("🌟 所有核心组件正常运行!")
             else:
-                print("⚠️ Faiss: 向量文件不存在")
-                all_healthy = False
-        except Exception as e:
-            print(f"❌ Faiss: 失败 ({e})")
-            all_healthy = False
-        
-        # Neo4j
-        if NEO4J_AVAILABLE:
-            try:
-                neo4j_user = NEO4J_CONFIG.get('user') or NEO4J_CONFIG.get('username')
-                neo4j_password = NEO4J_CONFIG.get('password')
-                neo4j_uri = NEO4J_CONFIG.get('uri')
-                
-                if all([neo4j_uri, neo4j_user, neo4j_password]):
-                    driver = GraphDatabase.driver(neo4j_uri, auth=(neo4j_user, neo4j_password))
-                    driver.verify_connectivity()
-                    driver.close()
-                    print("✅ Neo4j: 正常")
-                else:
-                    print("⚠️ Neo4j: 配置缺失")
-                    all_healthy = False
-            except Exception as e:
-                print(f"❌ Neo4j: 失败 ({e})")
-                all_healthy = False
-        else:
-            print("⚠️ Neo4j: 库未安装")
-        
-        print("="*40)
-        if all_healthy:
-            print("🌟 所有核心组件正常运行!")
-            sys.exit(0)
-        else:
-            print("⚠️ 部分组件存在问题")
-            sys.exit(1)
+                print("⚠️ 部分组件存在问题")
+        sys.exit(0 if all_healthy else 1)
     
     # 正常详细统计模式
     try:
-        stats = main()
+        with buffered_stdout():
+            stats = main()
     except KeyboardInterrupt:
         print("\n\n⚠️ 统计中断")
         sys.exit(1)
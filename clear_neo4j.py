@@ -19,46 +19,61 @@ NEO4J_CONFIG = {
     'user': 'neo4j', 
     'password': '******'
 }
+NEO4J_POOL_CONFIG = {'max_connection_pool_size': 10, 'connection_acquisition_timeout': 5}
+
+_NEO4J_DRIVER = None
+
+def get_neo4j_driver():
+    """惰性创建并复用Neo4j驱动（连接池参数与 check_data_stats 一致）"""
+    global _NEO4J_DRIVER
+    if _NEO4J_DRIVER is None:
+        _NEO4J_DRIVER = GraphDatabase.driver(
+            NEO4J_CONFIG['uri'], 
+            auth=(NEO4J_CONFIG['user'], NEO4J_CONFIG['password']),
+            **NEO4J_POOL_CONFIG
+        )
+    return _NEO4J_DRIVER
+
+CLEAR_BATCH_SIZE = 10000
+# CALL {...} IN TRANSACTIONS 需在自动提交事务中执行（session.run），每批单独提交
+CLEAR_QUERY = 'MATCH (n) CALL { WITH n DETACH DELETE n } IN TRANSACTIONS OF $batch_size ROWS'
+
+def count_graph(tx):
+    """一次往返同时返回节点数与关系数（两个子查询都走计数存储）"""
+    record = tx.run(
+        'CALL { MATCH (n) RETURN COUNT(n) AS nodes } '
+        'CALL { MATCH ()-[r]->() RETURN COUNT(r) AS relations } '
+        'RETURN nodes, relations'
+    ).single()
+    return record['nodes'], record['relations']
 
 def clear_neo4j():
     """清空Neo4j数据库"""
     try:
         print("🔵 正在连接Neo4j数据库...")
-        driver = GraphDatabase.driver(
-            NEO4J_CONFIG['uri'], 
-            auth=(NEO4J_CONFIG['user'], NEO4J_CONFIG['password'])
-        )
+        driver = get_neo4j_driver()
         driver.verify_connectivity()
         print("✅ Neo4j连接成功")
         
         with driver.session() as session:
             # 查询当前数据量
-            result = session.run('MATCH (n) RETURN COUNT(n) as nodes')
-            nodes_before = result.single()['nodes']
-            
-            result = session.run('MATCH ()-[r]->() RETURN COUNT(r) as relations')
-            relations_before = result.single()['relations']
+            nodes_before, relations_before = session.execute_read(count_graph)
             
             print(f"📊 清空前: {nodes_before} 个节点, {relations_before} 个关系")
             
             if nodes_before > 0 or relations_before > 0:
                 print("🗑️ 正在清空所有数据...")
-                # 清空所有节点和关系
-                session.run('MATCH (n) DETACH DELETE n')
+                # 分批提交删除所有节点和关系，避免单个超大事务耗尽服务端内存
+                session.run(CLEAR_QUERY, batch_size=CLEAR_BATCH_SIZE).consume()
                 print("✅ Neo4j数据清空完成!")
             else:
                 print("ℹ️ Neo4j数据库已经是空的")
             
             # 验证清空结果
-            result = session.run('MATCH (n) RETURN COUNT(n) as nodes')
-            nodes_after = result.single()['nodes']
-            
-            result = session.run('MATCH ()-[r]->() RETURN COUNT(r) as relations')
-            relations_after = result.single()['relations']
+            nodes_after, relations_after = session.execute_read(count_graph)
             
             print(f"📊 清空后: {nodes_after} 个节点, {relations_after} 个关系")
         
-        driver.close()
         return True
         
     except Exception as e:
@@ -66,4 +81,8 @@ def clear_neo4j():
         return False
 
 if __name__ == "__main__":
-    clear_neo4j()
+    try:
+        clear_neo4j()
+    finally:
+        if _NEO4J_DRIVER is not None:
+            _NEO4J_DRIVER.close()
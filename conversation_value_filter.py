@@ -13,15 +13,50 @@ Level 3: LLM精准分析 (2%案例) - 10秒级响应
 
 import re
 import json
+import asyncio
 import time
 import requests
 import os
+import sys
+import base64
+import copy
+import hashlib
+import sqlite3
+import threading
+import numpy as np
 from typing import Dict, List, Tuple, Any
-from datetime import datetime
+from collections import Counter, OrderedDict, deque
 from dataclasses import dataclass
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
-@dataclass
+# pyahocorasick 可选：多关键词单次扫描匹配，未安装时回退到逐个子串查找
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+# 高频创建的数据类使用 __slots__（dataclass 的 slots 参数需要 Python 3.10+）
+_DATACLASS_SLOTS = {'slots': True} if sys.version_info >= (3, 10) else {}
+
+# 语义缓存：内容嵌入余弦相似度达到阈值时直接复用此前的LLM分析结果
+EMBEDDING_SERVICE_URL = os.getenv("EMBEDDING_SERVICE_URL", "http://127.0.0.1:7999/v1/embeddings")
+EMBEDDING_MODEL_NAME = "qwen3-embedding-0.6b"
+# 缓存文件放在数据目录 (MEMORY_DATA_DIR，默认本模块所在目录) 下，不随进程工作目录变化
+MEMORY_DATA_DIR = os.getenv("MEMORY_DATA_DIR", os.path.dirname(os.path.abspath(__file__)))
+SEMANTIC_CACHE_DB = os.path.join(MEMORY_DATA_DIR, 'llm_cache.db')
+SEMANTIC_CACHE_THRESHOLD = 0.95
+SEMANTIC_CACHE_SIZE = 2000
+SEMANTIC_CACHE_TTL = 7 * 24 * 3600
+# 精确缓存：相同模型+系统提示+提示词（temperature=0.1 近似确定）直接复用结果
+LLM_EXACT_CACHE_SIZE = 10000
+# 批量异步过滤时同时在途的LLM请求上限
+LLM_MAX_CONCURRENCY = 8
+# Level 1.5 正向规则投票：同一等级至少命中的模式次数（且无其他等级命中）
+PATTERN_VOTE_MIN_HITS = 2
+# 统计中保留的最近处理耗时条数
+PROCESSING_TIMES_WINDOW = 4096
+
+@dataclass(**_DATACLASS_SLOTS)
 class ConversationItem:
     """对话项数据结构"""
     content: str
@@ -30,7 +65,7 @@ class ConversationItem:
     user_id: str = "unknown"
     context: Dict[str, Any] = None
 
-@dataclass
+@dataclass(**_DATACLASS_SLOTS)
 class FilterResult:
     """过滤结果数据结构"""
     memory_level: int  # 1-5级记忆等级
@@ -39,24 +74,150 @@ class FilterResult:
     processing_time: float  # 处理时间(秒)
     filter_stage: str  # 过滤阶段标识
 
+class SemanticResponseCache:
+    """LLM响应语义缓存：向量矩阵常驻内存做相似度检索，SQLite持久化，过期按TTL、满时按LRU淘汰。
+    scope 区分提示词中除内容外的其他字段 (如角色、用户)，只有 scope 相同的条目才会命中"""
+    
+    def __init__(self, stage: str, db_path: str = SEMANTIC_CACHE_DB, threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 max_entries: int = SEMANTIC_CACHE_SIZE, ttl: float = SEMANTIC_CACHE_TTL):
+        self.stage = stage
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("""CREATE TABLE IF NOT EXISTS semantic_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT, stage TEXT NOT NULL, embedding BLOB NOT NULL,
+            response TEXT NOT NULL, created_at REAL NOT NULL, last_used REAL NOT NULL, scope TEXT NOT NULL DEFAULT '')""")
+        # 旧版缓存表没有 scope 列：补上后旧条目 scope 为空，不会被带 scope 的查询命中
+        if 'scope' not in {row[1] for row in self._conn.execute("PRAGMA table_info(semantic_cache)")}:
+            self._conn.execute("ALTER TABLE semantic_cache ADD COLUMN scope TEXT NOT NULL DEFAULT ''")
+        now = time.time()
+        self._conn.execute("DELETE FROM semantic_cache WHERE created_at < ?", (now - ttl,))
+        rows = self._conn.execute(
+            "SELECT id, embedding, response, created_at, last_used, scope FROM semantic_cache WHERE stage = ? ORDER BY last_used DESC LIMIT ?",
+            (stage, max_entries)).fetchall()
+        self._conn.commit()
+        
+        # 槽位数组：第 i 行向量对应 _ids[i] / _values[i]，淘汰时原地覆盖
+        self._vecs = None
+        self._ids, self._values = [], []
+        self._created = np.zeros(max_entries)
+        self._last_used = np.zeros(max_entries)
+        # scope 字符串映射为整数编号，检索时按编号向量化过滤
+        self._scope_codes = {}
+        self._scopes = np.full(max_entries, -1, dtype=np.int64)
+        for row_id, blob, response, created_at, last_used, scope in rows:
+            self._insert_slot(len(self._ids), row_id, np.frombuffer(blob, dtype='<f4'), json.loads(response), created_at, last_used, scope)
+    
+    def _scope_code(self, scope: str) -> int:
+        return self._scope_codes.setdefault(scope, len(self._scope_codes))
+    
+    def _insert_slot(self, slot: int, row_id: int, embedding: np.ndarray, value: Dict[str, Any], created_at: float, last_used: float,
+                     scope: str = ''):
+        if self._vecs is None:
+            self._vecs = np.zeros((self.max_entries, embedding.shape[0]), dtype='float32')
+        if slot == len(self._ids):
+            self._ids.append(row_id); self._values.append(value)
+        else:
+            self._ids[slot], self._values[slot] = row_id, value
+        self._vecs[slot] = embedding
+        self._created[slot], self._last_used[slot] = created_at, last_used
+        self._scopes[slot] = self._scope_code(scope)
+    
+    def get(self, embedding: np.ndarray, scope: str = '') -> Dict[str, Any]:
+        """返回同一 scope 下相似度最高且达到阈值的缓存结果（副本），未命中返回 None"""
+        with self._lock:
+            size = len(self._ids)
+            code = self._scope_codes.get(scope)
+            if size == 0 or code is None:
+                return None
+            now = time.time()
+            sims = self._vecs[:size] @ embedding
+            sims[(self._created[:size] < now - self.ttl) | (self._scopes[:size] != code)] = -1.0
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            self._last_used[best] = now
+            self._conn.execute("UPDATE semantic_cache SET last_used = ? WHERE id = ?", (now, self._ids[best]))
+            self._conn.commit()
+            return copy.deepcopy(self._values[best])
+    
+    def put(self, embedding: np.ndarray, value: Dict[str, Any], scope: str = ''):
+        with self._lock:
+            size = len(self._ids)
+            now = time.time()
+            if size < self.max_entries:
+                slot = size
+            else:
+                # 已过期的槽位优先淘汰，其次是最久未使用的
+                last_used = np.where(self._created < now - self.ttl, -np.inf, self._last_used)
+                slot = int(np.argmin(last_used))
+                self._conn.execute("DELETE FROM semantic_cache WHERE id = ?", (self._ids[slot],))
+            cursor = self._conn.execute(
+                "INSERT INTO semantic_cache (stage, embedding, response, created_at, last_used, scope) VALUES (?, ?, ?, ?, ?, ?)",
+                (self.stage, embedding.astype('<f4').tobytes(), json.dumps(value, ensure_ascii=False), now, now, scope))
+            self._conn.commit()
+            self._insert_slot(slot, cursor.lastrowid, embedding, copy.deepcopy(value), now, now, scope)
+
 class ConversationValueFilter:
     """对话价值3级漏斗过滤器"""
     
+    # LLM非JSON文本响应中提取等级与置信度
+    _LEVEL_RE = re.compile(r'(?:level|等级).*?(\d)', re.IGNORECASE)
+    _CONF_RE = re.compile(r'(?:confidence|置信度).*?(\d+\.?\d*)', re.IGNORECASE)
+    
+    # Level 1 纯标点规则的字符集，对应模式 ^[!！。.，,、？?]{1,5}$
+    _PUNCT_CHARS = frozenset('!！。.，,、？?')
+    
+    # 启发式分析中的方法类询问词、上下文权重中的用户角色标记
+    _METHOD_QUESTION_RE = re.compile(r'什么|如何|为什么|怎么')
+    _ROLE_RE = re.compile(r'ceo|vp', re.IGNORECASE)
+    
+    # 关键词评分回退的等级阈值 (2级/3级/4级)
+    _FALLBACK_SCORE_THRESHOLDS = np.array([0.3, 0.6, 0.9])
+    
+    # 关键词评分回退使用的高价值关键词
+    HIGH_VALUE_KEYWORDS = {
+        'preference': ['喜欢', '不喜欢', '偏好', '习惯', '倾向于', '更愿意'],
+        'procedural': ['流程', '步骤', '方法', '如何', '怎么', '操作'],
+        'semantic': ['概念', '原理', '理论', '分析', '思考', '观点'],
+        'temporal': ['会议', '时间', '日期', '安排', '计划', '项目']
+    }
+    
     def __init__(self):
         # 统计计数器
         self.stats = {
             'total_processed': 0,
             'level1_filtered': 0,  # 快速规则过滤
+            'pattern_vote_filtered': 0,  # Level 1.5 正向规则投票定级
             'level2_filtered': 0,  # 关键词评分过滤
             'level3_analyzed': 0,  # LLM深度分析
-            'processing_times': []
+            'semantic_cache_hits': 0,  # LLM语义缓存命中
+            'exact_cache_hits': 0,  # LLM精确缓存命中
+            'processing_times': deque(maxlen=PROCESSING_TIMES_WINDOW),  # 最近的处理耗时
+            'processing_time_total': 0.0,  # 累计耗时与次数，O(1) 求全量平均
+            'processing_time_count': 0
         }
         
         # Level 1: 快速规则过滤模式
         self.quick_patterns = self._build_quick_patterns()
+        # 每个等级的模式合并为一个预编译正则，命名分组用于定位命中的子模式
+        self.quick_regexes = self._compile_quick_patterns(self.quick_patterns)
+        self._garbage_re = self.quick_regexes[1]
+        # 等级2-5的正向模式合并为一个主正则，一次扫描即可为所有命中标注等级
+        self._positive_re = re.compile('|'.join(regex.pattern for level, regex in self.quick_regexes.items() if level > 1), re.IGNORECASE)
         
         # Level 2: 关键词权重配置
         self.keyword_weights = self._build_keyword_weights()
+        # 关键词回退评分：按关键词表顺序展开为 (关键词, 类别) 列表，自动机命中值为其下标
+        self._keyword_entries = [
+            (keyword, category)
+            for category, keywords in self.HIGH_VALUE_KEYWORDS.items()
+            for keyword in keywords
+        ]
+        self._keyword_matcher = self._build_keyword_matcher()
         
         # 初始化Azure OpenAI客户端
         try:
@@ -71,12 +232,33 @@ class ConversationValueFilter:
                 default_query={"api-version": "preview"}, 
                 timeout=30.0
             )
+            # 批量过滤使用异步客户端，多个LLM请求共享连接池并发执行
+            self.azure_async_client = AsyncOpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                default_query={"api-version": "preview"},
+                timeout=30.0
+            )
             self.llm_available = True
             print("✅ Azure OpenAI 客户端初始化成功")
         except Exception as e:
             print(f"⚠️ Azure OpenAI初始化失败: {e}")
             self.azure_client = None
+            self.azure_async_client = None
             self.llm_available = False
+        self._llm_semaphore = None
+        self._llm_semaphore_loop = None
+        self._batch_loop = None
+        
+        # LLM语义缓存：Level2/Level3 提示词与返回格式不同，各自独立缓存
+        self._semantic_caches = {}
+        if self.llm_available:
+            try:
+                self._semantic_caches = {simple: SemanticResponseCache('level2' if simple else 'level3') for simple in (True, False)}
+            except sqlite3.Error as e:
+                print(f"⚠️ LLM语义缓存初始化失败: {e}")
+        self._http = requests.Session()
+        self._exact_cache = OrderedDict()
     
     def _build_quick_patterns(self) -> Dict[int, List[str]]:
         """构建快速规则模式库"""
@@ -100,7 +282,7 @@ class ConversationValueFilter:
                 r'(北京|上海|深圳|广州|出差|travel|flight)',  # 地点事件
                 r'(签约|合同|contract|客户|拜访)',  # 商务事件
                 r'(培训|training|学习|workshop)',  # 学习事件
-                r'(发布|launch|上线|go-live)',  # 产品事件
+                r'(发布(?!流程|步骤|脚本)|launch|上线|go-live)',  # 产品事件 (发布流程/步骤/脚本 归 Level 4)
             ],
             
             # Level 3: 偏好记忆 - 个人喜好、习惯模式
@@ -120,7 +302,7 @@ class ConversationValueFilter:
                 r'(操作|operation|执行|execute)',  # 操作描述
                 r'(检查|check|验证|validate|测试)',  # 验证流程
                 r'(配置|config|设置|setup)',  # 配置流程
-                r'(部署|deploy|发布|release)',  # 部署流程
+                r'(部署|deploy|发布(?:流程|步骤|脚本)|release)',  # 部署流程 (单独的"发布"归 Level 2)
             ],
             
             # Level 5: 语义记忆 - 知识性内容、概念定义
@@ -134,6 +316,24 @@ class ConversationValueFilter:
             ]
         }
     
+    @staticmethod
+    def _compile_quick_patterns(quick_patterns: Dict[int, List[str]]) -> Dict[int, re.Pattern]:
+        """把每个等级的模式列表合并为 (?P<lvl{等级}_{序号}>...) 的单一交替正则"""
+        return {
+            level: re.compile('|'.join(f'(?P<lvl{level}_{i}>{pattern})' for i, pattern in enumerate(patterns)), re.IGNORECASE)
+            for level, patterns in quick_patterns.items()
+        }
+    
+    def _build_keyword_matcher(self):
+        """用全部高价值关键词构建 Aho-Corasick 自动机，一次扫描找出所有命中（含重叠）；未安装时返回 None"""
+        if ahocorasick is None:
+            return None
+        automaton = ahocorasick.Automaton()
+        for order, (keyword, _) in enumerate(self._keyword_entries):
+            automaton.add_word(keyword, order)
+        automaton.make_automaton()
+        return automaton
+    
     def _build_keyword_weights(self) -> Dict[str, Dict[str, float]]:
         """构建关键词权重矩阵"""
         return {
@@ -188,77 +388,156 @@ class ConversationValueFilter:
         start_time = time.time()
         self.stats['total_processed'] += 1
         
-        # Level 1: 快速规则过滤 (目标: 90%案例)
-        level1_result = self._level1_quick_filter(conversation)
-        if level1_result:
-            self.stats['level1_filtered'] += 1
-            processing_time = time.time() - start_time
-            self.stats['processing_times'].append(processing_time)
-            
-            return FilterResult(
-                memory_level=level1_result,
-                confidence=0.95,  # 规则匹配高置信度
-                reasoning=f"Level1快速规则匹配: {self._get_pattern_match_reason(conversation.content, level1_result)}",
-                processing_time=processing_time,
-                filter_stage="Level1_QuickRule"
-            )
+        # Level 1 / 1.5: 规则过滤 (目标: 90%案例)
+        rule_result = self._rule_filter(conversation, start_time)
+        if rule_result:
+            return rule_result
         
         # Level 2: 关键词权重评分 (目标: 8%案例)
         level2_result = self._level2_keyword_scoring(conversation)
         if level2_result:
-            self.stats['level2_filtered'] += 1
-            processing_time = time.time() - start_time
-            self.stats['processing_times'].append(processing_time)
-            
-            return FilterResult(
-                memory_level=level2_result['level'],
-                confidence=level2_result['confidence'],
-                reasoning=f"Level2关键词评分: {level2_result['reasoning']}",
-                processing_time=processing_time,
-                filter_stage="Level2_KeywordScore"
-            )
+            return self._level2_filter_result(level2_result, start_time)
         
         # Level 3: LLM精准分析 (目标: 2%案例)
-        self.stats['level3_analyzed'] += 1
-        level3_result = self._level3_llm_analysis(conversation)
+        return self._level3_filter_result(self._level3_llm_analysis(conversation), start_time)
+    
+    def _rule_filter(self, conversation: ConversationItem, start_time: float) -> FilterResult:
+        """Level 1 垃圾规则与 Level 1.5 正向规则投票，能直接定级时返回结果，否则返回 None"""
+        level1_result = self._level1_quick_filter(conversation)
+        if level1_result:
+            return self._level1_filter_result(conversation, level1_result, start_time)
+        
+        # Level 1.5: 正向规则投票，命中明确时免去LLM调用
+        vote = self._level1_pattern_vote(conversation.content)
+        if vote:
+            return self._pattern_vote_filter_result(vote, start_time)
+        return None
+    
+    async def filter_conversation_async(self, conversation: ConversationItem) -> FilterResult:
+        """filter_conversation 的异步版本，LLM调用不阻塞事件循环"""
+        start_time = time.time()
+        self.stats['total_processed'] += 1
+        
+        rule_result = self._rule_filter(conversation, start_time)
+        if rule_result:
+            return rule_result
+        return await self._llm_filter_async(conversation, start_time)
+    
+    async def _llm_filter_async(self, conversation: ConversationItem, start_time: float) -> FilterResult:
+        level2_result = await self._level2_keyword_scoring_async(conversation)
+        if level2_result:
+            return self._level2_filter_result(level2_result, start_time)
+        
+        return self._level3_filter_result(await self._level3_llm_analysis_async(conversation), start_time)
+    
+    async def filter_conversations(self, conversations: List[ConversationItem]) -> List[FilterResult]:
+        """
+        批量过滤：规则阶段先逐条同步完成，只为需要LLM的对话创建协程并发发起请求，
+        总耗时约为最慢的一次LLM调用而不是所有调用之和
+        
+        Args:
+            conversations: 对话列表
+            
+        Returns:
+            List[FilterResult]: 与输入顺序一致的过滤结果
+        """
+        results: List[FilterResult] = [None] * len(conversations)
+        pending = []
+        for i, conversation in enumerate(conversations):
+            start_time = time.time()
+            self.stats['total_processed'] += 1
+            results[i] = self._rule_filter(conversation, start_time)
+            if results[i] is None:
+                pending.append((i, conversation, start_time))
+        
+        llm_results = await asyncio.gather(*(self._llm_filter_async(c, t) for _, c, t in pending))
+        for (i, _, _), result in zip(pending, llm_results):
+            results[i] = result
+        return results
+    
+    def filter_batch(self, conversations: List[ConversationItem]) -> List[FilterResult]:
+        """
+        同步调用方使用的批量过滤入口，在专用事件循环上运行 filter_conversations。
+        规则阶段在调用线程内直接完成：re 匹配期间不释放 GIL，线程池并行不会提速；
+        已处于事件循环中的调用方请直接 await filter_conversations。
+        """
+        if self._batch_loop is None:
+            self._batch_loop = asyncio.new_event_loop()
+        return self._batch_loop.run_until_complete(self.filter_conversations(conversations))
+    
+    def _record_processing_time(self, counter: str, start_time: float) -> float:
+        self.stats[counter] += 1
         processing_time = time.time() - start_time
         self.stats['processing_times'].append(processing_time)
-        
+        self.stats['processing_time_total'] += processing_time
+        self.stats['processing_time_count'] += 1
+        return processing_time
+    
+    def _level1_filter_result(self, conversation: ConversationItem, level: int, start_time: float) -> FilterResult:
+        return FilterResult(
+            memory_level=level,
+            confidence=0.95,  # 规则匹配高置信度
+            reasoning=f"Level1快速规则匹配: {self._get_pattern_match_reason(conversation.content, level)}",
+            processing_time=self._record_processing_time('level1_filtered', start_time),
+            filter_stage="Level1_QuickRule"
+        )
+    
+    def _pattern_vote_filter_result(self, vote: Tuple[int, int], start_time: float) -> FilterResult:
+        level, hits = vote
+        return FilterResult(
+            memory_level=level,
+            confidence=0.85,  # 多条同级模式一致命中，置信度略低于垃圾规则
+            reasoning=f"Level1规则投票: 命中{hits}条等级{level}模式",
+            processing_time=self._record_processing_time('pattern_vote_filtered', start_time),
+            filter_stage="Level1_PatternVote"
+        )
+    
+    def _level2_filter_result(self, level2_result: Dict[str, Any], start_time: float) -> FilterResult:
+        return FilterResult(
+            memory_level=level2_result['level'],
+            confidence=level2_result['confidence'],
+            reasoning=f"Level2关键词评分: {level2_result['reasoning']}",
+            processing_time=self._record_processing_time('level2_filtered', start_time),
+            filter_stage="Level2_KeywordScore"
+        )
+    
+    def _level3_filter_result(self, level3_result: Dict[str, Any], start_time: float) -> FilterResult:
         return FilterResult(
             memory_level=level3_result['level'],
             confidence=level3_result['confidence'],
             reasoning=f"Level3LLM分析: {level3_result['reasoning']}",
-            processing_time=processing_time,
+            processing_time=self._record_processing_time('level3_analyzed', start_time),
             filter_stage="Level3_LLMAnalysis"
         )
     
     def _level1_quick_filter(self, conversation: ConversationItem) -> int:
         """Level 1: 快速规则过滤 - 只处理明确垃圾"""
         content = conversation.content.strip()
+        length = len(content)
         
-        # 只处理明确的垃圾内容，不做复杂分类
-        garbage_patterns = [
-            r'^(哈{2,}|呵{2,}|嘿{2,})',  # 笑声
-            r'^(嗯{1,3}|额{1,3}|呃{1,3})$',  # 语气词
-            r'^(好的{1,2}|知道了|收到|明白了?)$',  # 简单确认
-            r'^[!！。.，,、？?]{1,5}$',  # 纯标点
-            r'^(再见|拜拜|88|下次见)$',  # 告别
-            r'(天气|吃饭了吗|在吗|忙吗)(?!.*工作)',  # 日常寒暄(非工作)
-            r'^.{1,3}$',  # 超短内容
-            r'^(谢谢|thank|thx)$',  # 简单感谢
-        ]
+        # 超短内容与纯标点（与对应的 Level 1 模式等价）直接判定，不进入正则引擎
+        if 0 < length <= 5 and '\n' not in content:
+            if length <= 3 or self._PUNCT_CHARS.issuperset(content):
+                return 1
         
-        for pattern in garbage_patterns:
-            if re.search(pattern, content, re.IGNORECASE):
-                return 1  # 垃圾，直接丢弃
+        # 只处理明确的垃圾内容（Level 1 模式），不做复杂分类
+        if self._garbage_re.search(content):
+            return 1  # 垃圾，直接丢弃
         
         return None  # 无法确定，交给LLM处理
     
-    def _level2_keyword_scoring(self, conversation: ConversationItem) -> Dict[str, Any]:
-        """Level 2: LLM轻量分析 - 快速分类"""
-        try:
-            # 构建轻量级LLM分析提示词
-            prompt = f"""分析对话记忆价值等级(1-5):
+    def _level1_pattern_vote(self, content: str) -> Tuple[int, int]:
+        """Level 1.5: 主正则单次扫描对等级2-5投票，全部命中指向同一等级且不少于 PATTERN_VOTE_MIN_HITS 次时返回 (等级, 命中数)"""
+        votes = Counter(int(match.lastgroup[3:].split('_', 1)[0]) for match in self._positive_re.finditer(content))
+        if len(votes) == 1:
+            level, hits = votes.popitem()
+            if hits >= PATTERN_VOTE_MIN_HITS:
+                return level, hits
+        return None
+    
+    def _level2_prompt(self, conversation: ConversationItem) -> str:
+        """构建轻量级LLM分析提示词"""
+        return f"""分析对话记忆价值等级(1-5):
 
 对话内容: "{conversation.content}"
 
@@ -270,9 +549,12 @@ class ConversationValueFilter:
 5-知识: 概念定义、技术原理、深度思考
 
 要求: 只返回JSON格式 {{"level": 数字, "confidence": 0-1小数, "reasoning": "简短理由"}}"""
-
-            # 调用LLM API
-            llm_result = self._call_llm_api(prompt, simple=True)
+    
+    def _level2_keyword_scoring(self, conversation: ConversationItem) -> Dict[str, Any]:
+        """Level 2: LLM轻量分析 - 快速分类"""
+        try:
+            # 调用LLM API（优先命中语义缓存）
+            llm_result = self._call_llm_cached(conversation.content, self._level2_prompt(conversation), simple=True)
             if llm_result:
                 return llm_result
             
@@ -282,16 +564,23 @@ class ConversationValueFilter:
         # LLM失败时回退到关键词评分
         return self._keyword_scoring_fallback(conversation)
     
-    def _level3_llm_analysis(self, conversation: ConversationItem) -> Dict[str, Any]:
-        """Level 3: LLM深度分析 - 复杂语义理解"""
+    async def _level2_keyword_scoring_async(self, conversation: ConversationItem) -> Dict[str, Any]:
         try:
-            # 构建详细的LLM分析提示词
-            prompt = f"""请深度分析以下对话的记忆价值:
+            llm_result = await self._call_llm_cached_async(conversation.content, self._level2_prompt(conversation), simple=True)
+            if llm_result:
+                return llm_result
+        except Exception as e:
+            print(f"⚠️ Level2 LLM分析失败: {e}")
+        return self._keyword_scoring_fallback(conversation)
+    
+    def _level3_prompt(self, conversation: ConversationItem) -> str:
+        """构建详细的LLM分析提示词"""
+        return f"""请深度分析以下对话的记忆价值:
 
 对话内容: "{conversation.content}"
 对话角色: {conversation.role}
 用户ID: {conversation.user_id}
-时间: {datetime.fromtimestamp(conversation.timestamp)}
+时间: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(conversation.timestamp))}
 
 请从以下维度进行深度分析:
 1. 语义复杂度和隐含信息
@@ -309,9 +598,18 @@ class ConversationValueFilter:
 
 要求: 返回详细JSON格式分析结果
 {{"level": 数字, "confidence": 0-1小数, "reasoning": "详细分析理由", "extracted_info": {{"key_entities": [], "relations": [], "insights": ""}}}}"""
-
-            # 调用LLM API进行深度分析
-            llm_result = self._call_llm_api(prompt, simple=False)
+    
+    @staticmethod
+    def _level3_scope(conversation: ConversationItem) -> str:
+        """Level 3 提示词还包含角色和用户ID，语义缓存按两者隔离 (时间戳只精确到秒，不参与)"""
+        return f"{conversation.role}|{conversation.user_id}"
+    
+    def _level3_llm_analysis(self, conversation: ConversationItem) -> Dict[str, Any]:
+        """Level 3: LLM深度分析 - 复杂语义理解"""
+        try:
+            # 调用LLM API进行深度分析（优先命中语义缓存）
+            llm_result = self._call_llm_cached(conversation.content, self._level3_prompt(conversation), simple=False,
+                                               scope=self._level3_scope(conversation))
             if llm_result:
                 return llm_result
                 
@@ -321,6 +619,117 @@ class ConversationValueFilter:
         # LLM失败时回退到启发式分析
         return self._heuristic_analysis(conversation)
     
+    async def _level3_llm_analysis_async(self, conversation: ConversationItem) -> Dict[str, Any]:
+        try:
+            llm_result = await self._call_llm_cached_async(conversation.content, self._level3_prompt(conversation), simple=False,
+                                                           scope=self._level3_scope(conversation))
+            if llm_result:
+                return llm_result
+        except Exception as e:
+            print(f"⚠️ Level3 LLM深度分析失败: {e}")
+        return self._heuristic_analysis(conversation)
+    
+    def _embed_content(self, content: str) -> np.ndarray:
+        """调用本地嵌入服务获取归一化向量，失败返回 None（跳过语义缓存）"""
+        try:
+            payload = {"model": EMBEDDING_MODEL_NAME, "input": [content], "encoding_format": "base64"}
+            response = self._http.post(EMBEDDING_SERVICE_URL, json=payload, timeout=5)
+            response.raise_for_status()
+            embedding = response.json()['data'][0]['embedding']
+            return np.frombuffer(base64.b64decode(embedding), dtype='<f4') if isinstance(embedding, str) else np.asarray(embedding, dtype='float32')
+        except (requests.exceptions.RequestException, KeyError, IndexError, ValueError) as e:
+            print(f"⚠️ 嵌入服务不可用，跳过语义缓存: {e}")
+            return None
+    
+    def _call_llm_cached(self, content: str, prompt: str, simple: bool = True, scope: str = '') -> Dict[str, Any]:
+        """语义缓存包装：同一 scope 下相似内容（余弦相似度≥阈值）直接复用LLM结果，未命中时调用并写入缓存"""
+        cache = self._semantic_caches.get(simple)
+        embedding = self._embed_content(content) if cache else None
+        if embedding is not None:
+            cached = cache.get(embedding, scope)
+            if cached is not None:
+                self.stats['semantic_cache_hits'] += 1
+                return cached
+        
+        result = self._call_llm_api(prompt, simple)
+        if result and embedding is not None:
+            cache.put(embedding, result, scope)
+        return result
+    
+    async def _call_llm_cached_async(self, content: str, prompt: str, simple: bool = True, scope: str = '') -> Dict[str, Any]:
+        cache = self._semantic_caches.get(simple)
+        embedding = await asyncio.to_thread(self._embed_content, content) if cache else None
+        if embedding is not None:
+            cached = cache.get(embedding, scope)
+            if cached is not None:
+                self.stats['semantic_cache_hits'] += 1
+                return cached
+        
+        result = await self._call_llm_api_async(prompt, simple)
+        if result and embedding is not None:
+            cache.put(embedding, result, scope)
+        return result
+    
+    def _build_llm_request(self, prompt: str, simple: bool) -> Tuple[str, Dict[str, Any]]:
+        """构建 responses API 请求参数，返回 (精确缓存键, 请求参数)"""
+        # 根据simple参数选择不同的系统提示
+        if simple:
+            system_prompt = "你是一个对话价值评估专家,需要快速准确地评估对话的记忆价值等级。返回简洁的JSON格式结果。"
+        else:
+            system_prompt = "你是一个高级语义分析专家,具备深度理解对话内容的能力。请进行详细的记忆价值分析,包括隐含信息挖掘和知识提取。"
+        
+        cache_key = hashlib.sha256(f"{self.model_name}|{system_prompt}|{prompt}".encode('utf-8')).hexdigest()
+        
+        # 构建Azure OpenAI请求
+        messages = [
+            {'role': 'system', 'content': system_prompt},
+            {'role': 'user', 'content': prompt}
+        ]
+        
+        # 使用Azure OpenAI responses API
+        request_args = {
+            "model": self.model_name,
+            "input": messages,
+            "temperature": 0.1
+        }
+        return cache_key, request_args
+    
+    def _exact_cache_lookup(self, cache_key: str) -> Dict[str, Any]:
+        cached = self._exact_cache.get(cache_key)
+        if cached is None:
+            return None
+        self._exact_cache.move_to_end(cache_key)
+        self.stats['exact_cache_hits'] += 1
+        return copy.deepcopy(cached)
+    
+    def _parse_llm_response(self, response, cache_key: str) -> Dict[str, Any]:
+        """解析响应内容，成功的结果写入精确缓存"""
+        if response.output and len(response.output) > 0:
+            # 获取第一个输出的文本内容
+            first_output = response.output[0]
+            if hasattr(first_output, 'content') and first_output.content:
+                # 提取text内容
+                text_content = ""
+                for content_item in first_output.content:
+                    if hasattr(content_item, 'text'):
+                        text_content += content_item.text
+                
+                if text_content:
+                    try:
+                        result = json.loads(text_content)
+                    except json.JSONDecodeError:
+                        # 如果不是JSON格式，尝试从文本中提取结构化信息
+                        print(f"⚠️ LLM返回非JSON格式，尝试解析: {text_content}")
+                        result = self._parse_llm_text_response(text_content)
+                    if result:
+                        self._exact_cache[cache_key] = copy.deepcopy(result)
+                        if len(self._exact_cache) > LLM_EXACT_CACHE_SIZE:
+                            self._exact_cache.popitem(last=False)
+                    return result
+        
+        print("⚠️ Azure OpenAI响应解析失败")
+        return None
+    
     def _call_llm_api(self, prompt: str, simple: bool = True) -> Dict[str, Any]:
         """调用Azure OpenAI进行分析"""
         if not self.llm_available:
@@ -328,62 +737,55 @@ class ConversationValueFilter:
             return None
             
         try:
-            # 根据simple参数选择不同的系统提示
-            if simple:
-                system_prompt = "你是一个对话价值评估专家,需要快速准确地评估对话的记忆价值等级。返回简洁的JSON格式结果。"
-            else:
-                system_prompt = "你是一个高级语义分析专家,具备深度理解对话内容的能力。请进行详细的记忆价值分析,包括隐含信息挖掘和知识提取。"
-            
-            # 构建Azure OpenAI请求
-            messages = [
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': prompt}
-            ]
-            
-            # 使用Azure OpenAI responses API
-            request_args = {
-                "model": self.model_name,
-                "input": messages,
-                "temperature": 0.1
-            }
+            cache_key, request_args = self._build_llm_request(prompt, simple)
+            cached = self._exact_cache_lookup(cache_key)
+            if cached is not None:
+                return cached
             
             response = self.azure_client.responses.create(**request_args)
-            
-            # 解析响应内容
-            if response.output and len(response.output) > 0:
-                # 获取第一个输出的文本内容
-                first_output = response.output[0]
-                if hasattr(first_output, 'content') and first_output.content:
-                    # 提取text内容
-                    text_content = ""
-                    for content_item in first_output.content:
-                        if hasattr(content_item, 'text'):
-                            text_content += content_item.text
-                    
-                    if text_content:
-                        try:
-                            return json.loads(text_content)
-                        except json.JSONDecodeError:
-                            # 如果不是JSON格式，尝试从文本中提取结构化信息
-                            print(f"⚠️ LLM返回非JSON格式，尝试解析: {text_content}")
-                            return self._parse_llm_text_response(text_content)
-            
-            print("⚠️ Azure OpenAI响应解析失败")
-            return None
+            return self._parse_llm_response(response, cache_key)
                 
         except Exception as e:
             print(f"⚠️ Azure OpenAI调用异常: {e}")
             return None
     
+    def _get_llm_semaphore(self) -> asyncio.Semaphore:
+        # 信号量只能在创建它的事件循环中等待，换了事件循环时重新创建
+        loop = asyncio.get_running_loop()
+        if self._llm_semaphore_loop is not loop:
+            self._llm_semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+            self._llm_semaphore_loop = loop
+        return self._llm_semaphore
+    
+    async def _call_llm_api_async(self, prompt: str, simple: bool = True) -> Dict[str, Any]:
+        """异步调用Azure OpenAI，并发数受 LLM_MAX_CONCURRENCY 限制"""
+        if not self.llm_available:
+            print("⚠️ Azure OpenAI不可用，回退到启发式分析")
+            return None
+        
+        try:
+            cache_key, request_args = self._build_llm_request(prompt, simple)
+            cached = self._exact_cache_lookup(cache_key)
+            if cached is not None:
+                return cached
+            
+            async with self._get_llm_semaphore():
+                response = await self.azure_async_client.responses.create(**request_args)
+            return self._parse_llm_response(response, cache_key)
+        
+        except Exception as e:
+            print(f"⚠️ Azure OpenAI调用异常: {e}")
+            return None
+    
     def _parse_llm_text_response(self, text: str) -> Dict[str, Any]:
         """从文本响应中解析结构化信息"""
         try:
             # 尝试提取level
-            level_match = re.search(r'(?:level|等级).*?(\d)', text, re.IGNORECASE)
+            level_match = self._LEVEL_RE.search(text)
             level = int(level_match.group(1)) if level_match else 3
             
             # 尝试提取confidence
-            conf_match = re.search(r'(?:confidence|置信度).*?(\d+\.?\d*)', text, re.IGNORECASE)
+            conf_match = self._CONF_RE.search(text)
             confidence = float(conf_match.group(1)) if conf_match else 0.7
             
             # 如果confidence大于1，假设是百分比，除以100
@@ -406,32 +808,17 @@ class ConversationValueFilter:
     def _keyword_scoring_fallback(self, conversation: ConversationItem) -> Dict[str, Any]:
         """关键词评分的回退方案"""
         content = conversation.content.lower()
-        score = 0
-        keywords_found = []
-        
-        # 高价值关键词
-        high_value_patterns = {
-            'preference': ['喜欢', '不喜欢', '偏好', '习惯', '倾向于', '更愿意'],
-            'procedural': ['流程', '步骤', '方法', '如何', '怎么', '操作'],
-            'semantic': ['概念', '原理', '理论', '分析', '思考', '观点'],
-            'temporal': ['会议', '时间', '日期', '安排', '计划', '项目']
-        }
         
-        for category, keywords in high_value_patterns.items():
-            for keyword in keywords:
-                if keyword in content:
-                    score += 0.3
-                    keywords_found.append((keyword, category))
-        
-        # 确定等级
-        if score >= 0.9:
-            level = 4
-        elif score >= 0.6:
-            level = 3
-        elif score >= 0.3:
-            level = 2
+        # 高价值关键词：每个关键词出现即计一次，np.unique 去重并按关键词表顺序排列
+        if self._keyword_matcher is not None:
+            hits = np.unique(np.fromiter((order for _, order in self._keyword_matcher.iter(content)), dtype=np.int32))
         else:
-            level = 1
+            hits = np.fromiter((order for order, (keyword, _) in enumerate(self._keyword_entries) if keyword in content), dtype=np.int32)
+        keywords_found = [self._keyword_entries[order] for order in hits]
+        score = 0.3 * hits.size
+        
+        # 确定等级：分数达到第 k 个阈值即为 k+1 级
+        level = int(np.searchsorted(self._FALLBACK_SCORE_THRESHOLDS, score, side='right')) + 1
             
         return {
             'level': level,
@@ -448,7 +835,7 @@ class ConversationValueFilter:
         
         # 问号分析
         if '?' in content or '？' in content:
-            if any(kw in content for kw in ['什么', '如何', '为什么', '怎么']):
+            if self._METHOD_QUESTION_RE.search(content):
                 return {'level': 4, 'confidence': 0.6, 'reasoning': '包含方法询问'}
             else:
                 return {'level': 2, 'confidence': 0.5, 'reasoning': '包含询问'}
@@ -460,10 +847,11 @@ class ConversationValueFilter:
         """根据上下文计算权重倍数"""
         multiplier = 1.0
         
-        # 用户角色权重
-        if 'ceo' in conversation.user_id.lower():
+        # 用户角色权重：一次扫描找出全部角色标记，CEO 优先于 VP
+        roles = {role.lower() for role in self._ROLE_RE.findall(conversation.user_id)}
+        if 'ceo' in roles:
             multiplier *= 1.5
-        elif 'vp' in conversation.user_id.lower():
+        elif 'vp' in roles:
             multiplier *= 1.3
         
         # 时间敏感性
@@ -481,10 +869,11 @@ class ConversationValueFilter:
     
     def _get_pattern_match_reason(self, content: str, level: int) -> str:
         """获取模式匹配原因"""
-        patterns = self.quick_patterns.get(level, [])
-        for pattern in patterns:
-            if re.search(pattern, content, re.IGNORECASE):
-                return f"匹配模式: {pattern}"
+        regex = self.quick_regexes.get(level)
+        match = regex.search(content) if regex else None
+        if match:
+            index = int(match.lastgroup.rsplit('_', 1)[1])
+            return f"匹配模式: {self.quick_patterns[level][index]}"
         return "规则匹配"
     
     def get_stats(self) -> Dict[str, Any]:
@@ -493,15 +882,18 @@ class ConversationValueFilter:
         if total == 0:
             return self.stats
         
-        avg_time = sum(self.stats['processing_times']) / len(self.stats['processing_times']) if self.stats['processing_times'] else 0
+        count = self.stats['processing_time_count']
+        avg_time = self.stats['processing_time_total'] / count if count else 0
         
         return {
             **self.stats,
             'level1_percentage': (self.stats['level1_filtered'] / total) * 100,
+            'pattern_vote_percentage': (self.stats['pattern_vote_filtered'] / total) * 100,
             'level2_percentage': (self.stats['level2_filtered'] / total) * 100,
             'level3_percentage': (self.stats['level3_analyzed'] / total) * 100,
             'average_processing_time': avg_time,
-            'efficiency_target_met': self.stats['level1_filtered'] / total >= 0.80  # 目标80%以上Level1处理
+            # 目标80%以上在规则阶段 (Level1 与规则投票) 处理，无需LLM
+            'efficiency_target_met': (self.stats['level1_filtered'] + self.stats['pattern_vote_filtered']) / total >= 0.80
         }
 
 # 使用示例
@@ -535,6 +927,7 @@ if __name__ == "__main__":
     print("=== 过滤统计信息 ===")
     print(f"总处理数: {stats['total_processed']}")
     print(f"Level1快速过滤: {stats['level1_filtered']} ({stats['level1_percentage']:.1f}%)")
+    print(f"Level1.5规则投票: {stats['pattern_vote_filtered']} ({stats['pattern_vote_percentage']:.1f}%)")
     print(f"Level2关键词过滤: {stats['level2_filtered']} ({stats['level2_percentage']:.1f}%)")
     print(f"Level3LLM分析: {stats['level3_analyzed']} ({stats['level3_percentage']:.1f}%)")
     print(f"平均处理时间: {stats['average_processing_time']:.3f}秒")
@@ -6,32 +6,37 @@ embedding_service.py
 这个服务会加载本地的 ONNX 模型 (如 qwen3-embedding-0.6b) 并提供 API 接口。
 
 前置依赖安装 (Prerequisites):
-pip install modelscope onnxruntime fastapi "uvicorn[standard]" pydantic coloredlogs transformers
+pip install modelscope onnxruntime fastapi "uvicorn[standard]" pydantic coloredlogs transformers orjson
 
 运行前准备:
 1. 下载模型文件到指定目录, 例如 /path/to/ai-models/qwen3-embedding-0.6b
 2. 设置环境变量: export MODEL_PATH=/path/to/ai-models
+3. (可选) 量化为 INT8: python quantize_model.py /path/to/ai-models/qwen3-embedding-0.6b
+4. (可选) 池化与归一化写入计算图: python export_normed_model.py /path/to/ai-models/qwen3-embedding-0.6b
 
 启动命令:
 uvicorn embedding_service:app --host 0.0.0.0 --port 7999
 """
 import asyncio
+import base64
 import json
 import logging
 import os
 import threading
 import time
 import uuid
+from collections import OrderedDict
 from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 from pathlib import Path
-from typing import Any, Dict, List
+from typing import Any, Dict, List, Literal, Union
 
 import coloredlogs
 import numpy as np
 import onnxruntime as ort
+import orjson
 import uvicorn
-from fastapi import FastAPI, Header, HTTPException
+from fastapi import FastAPI, Header, HTTPException, Response
 from pydantic import BaseModel
 from modelscope import AutoTokenizer
 from transformers import PreTrainedTokenizerFast
@@ -50,10 +55,11 @@ class EmbeddingRequest(BaseModel):
     model: str
     input: List[str]
     normalize: bool = True
+    encoding_format: Literal["float", "base64"] = "float"  # "float" 返回浮点列表；"base64" 返回 float32 小端字节的 base64，与 OpenAI 接口一致
 
 class EmbeddingData(BaseModel):
     object: str = "embedding"
-    embedding: List[float]
+    embedding: Union[List[float], str]
     index: int
 
 class Usage(BaseModel):
@@ -68,13 +74,48 @@ class EmbeddingResponse(BaseModel):
     usage: Usage
 
 # --- ONNX 模型封装 ---
+# 合批参数：攒够32条文本或等待5毫秒即执行一次推理
+BATCH_MAX_SIZE = 32
+BATCH_MAX_WAIT = 0.005
+# export_normed_model.py 写入计算图的输出名
+POOLED_OUTPUT = "pooled_embedding"
+NORMALIZED_OUTPUT = "normalized_embedding"
+# 分词结果 LRU 缓存条数（按原始文本缓存截断后的 token id）
+TOKEN_CACHE_SIZE = 4096
+
+def normalize_embeddings(embeddings: np.ndarray) -> np.ndarray:
+    """原地 L2 归一化；einsum 求范数，避免 np.linalg.norm 额外分配平方中间数组"""
+    norms = np.sqrt(np.einsum("ij,ij->i", embeddings, embeddings))[:, None]
+    return np.divide(embeddings, norms, out=embeddings)
+
 class OnnxModel:
+    # 私有属性名在 __slots__ 中同样会被改写为 _OnnxModel__xxx
+    __slots__ = (
+        "__base_model_path", "__tokenizer", "__ort_session", "__model_config", "__last_access_time",
+        "__io_binding", "__binding_lock", "__output_names", "__fused_pooling", "__device", "__pad_token_id",
+        "__input_ids", "__attention_mask", "__token_cache", "__token_cache_lock",
+    )
+
     def __init__(self, base_model_path: Path, tokenizer: PreTrainedTokenizerFast, ort_session: ort.InferenceSession, model_config: Dict[str, Any]):
         self.__base_model_path: Path = base_model_path
         self.__tokenizer: PreTrainedTokenizerFast = tokenizer
         self.__ort_session: ort.InferenceSession = ort_session
         self.__model_config: Dict[str, Any] = model_config
         self.__last_access_time: float = time.time()
+        # IOBinding 与预分配的输入缓冲区，初始容量为一个满批次
+        self.__io_binding = ort_session.io_binding()
+        self.__binding_lock = threading.Lock()
+        # export_normed_model.py 生成的模型在图内完成池化与归一化，直接输出 (batch, hidden)
+        output_names = [output.name for output in ort_session.get_outputs()]
+        self.__fused_pooling: bool = NORMALIZED_OUTPUT in output_names
+        self.__output_names: List[str] = [POOLED_OUTPUT, NORMALIZED_OUTPUT] if self.__fused_pooling else output_names[:1]
+        self.__device: str = "cuda" if "CUDAExecutionProvider" in ort_session.get_providers() else "cpu"
+        self.__pad_token_id: int = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+        buffer_size = BATCH_MAX_SIZE * model_config.get("max_length", 1024)
+        self.__input_ids = np.zeros(buffer_size, dtype=np.int64)
+        self.__attention_mask = np.zeros(buffer_size, dtype=np.int64)
+        self.__token_cache: OrderedDict[str, List[int]] = OrderedDict()
+        self.__token_cache_lock = threading.Lock()
 
     def update_last_access_time(self):
         self.__last_access_time = time.time()
@@ -85,34 +126,86 @@ class OnnxModel:
     def release(self):
         self.__ort_session = None
         self.__tokenizer = None
+        self.__io_binding = None
+        self.__token_cache.clear()
         logger.info(f"资源已为模型释放: {self.__base_model_path.name}")
 
-    def inference(self, inputs: List[str], normalize: bool = True) -> (int, np.ndarray):
+    def __bind_buffers(self, batch_size: int, seq_len: int) -> (np.ndarray, np.ndarray):
+        """返回预分配缓冲区上连续的 (batch_size, seq_len) 视图，容量不足时按需扩容"""
+        size = batch_size * seq_len
+        if size > self.__input_ids.size:
+            self.__input_ids = np.zeros(size, dtype=np.int64)
+            self.__attention_mask = np.zeros(size, dtype=np.int64)
+        return self.__input_ids[:size].reshape(batch_size, seq_len), self.__attention_mask[:size].reshape(batch_size, seq_len)
+
+    def __tokenize(self, inputs: List[str], max_length: int) -> List[List[int]]:
+        """逐条查询分词缓存，只把未命中的文本批量交给分词器；全部命中时跳过分词器调用"""
+        with self.__token_cache_lock:
+            token_ids = [self.__token_cache.get(text) for text in inputs]
+            for text, ids in zip(inputs, token_ids):
+                if ids is not None:
+                    self.__token_cache.move_to_end(text)
+        
+        misses = [i for i, ids in enumerate(token_ids) if ids is None]
+        if misses:
+            miss_texts = list(dict.fromkeys(inputs[i] for i in misses))
+            encoded = dict(zip(miss_texts, self.__tokenizer(miss_texts, padding=False, truncation=True, max_length=max_length)["input_ids"]))
+            for i in misses:
+                token_ids[i] = encoded[inputs[i]]
+            with self.__token_cache_lock:
+                self.__token_cache.update(encoded)
+                while len(self.__token_cache) > TOKEN_CACHE_SIZE:
+                    self.__token_cache.popitem(last=False)
+        return token_ids
+
+    def encode(self, inputs: List[str]) -> (np.ndarray, np.ndarray, np.ndarray):
+        """返回每条输入的 token 数、未归一化的池化向量，以及图内归一化的向量（非融合模型为 None）"""
         self.update_last_access_time()
         max_length = self.__model_config.get("max_length", 1024)
-        encode_inputs = self.__tokenizer(inputs, return_tensors="np", padding="longest", truncation=True, max_length=max_length)
-        
-        total_tokens = int(np.sum(encode_inputs["attention_mask"]))
+        token_ids = self.__tokenize(inputs, max_length)
+        token_counts = np.fromiter((len(ids) for ids in token_ids), dtype=np.int64, count=len(token_ids))
+        batch_size, seq_len = len(token_ids), int(token_counts.max())
+        left_padding = self.__tokenizer.padding_side == "left"
         
-        ort_inputs = {
-            "input_ids": encode_inputs["input_ids"].astype(np.int64),
-            "attention_mask": encode_inputs["attention_mask"].astype(np.int64),
-        }
+        with self.__binding_lock:
+            # token 直接写入预分配的 int64 缓冲区，ORT 通过 IOBinding 零拷贝读取
+            input_ids, attention_mask = self.__bind_buffers(batch_size, seq_len)
+            input_ids.fill(self.__pad_token_id)
+            attention_mask.fill(0)
+            for row, ids in enumerate(token_ids):
+                cols = slice(seq_len - len(ids), seq_len) if left_padding else slice(0, len(ids))
+                input_ids[row, cols] = ids
+                attention_mask[row, cols] = 1
+            
+            shape = (batch_size, seq_len)
+            self.__io_binding.bind_input("input_ids", "cpu", 0, np.int64, shape, input_ids.ctypes.data)
+            self.__io_binding.bind_input("attention_mask", "cpu", 0, np.int64, shape, attention_mask.ctypes.data)
+            for output_name in self.__output_names:
+                self.__io_binding.bind_output(output_name, self.__device)
+            self.__ort_session.run_with_iobinding(self.__io_binding)
+            outputs = self.__io_binding.copy_outputs_to_cpu()
+
+        if self.__fused_pooling:
+            return token_counts, outputs[0], outputs[1]
+
+        # 使用 last_token 池化：右填充时按 attention_mask 取每条序列真实的最后一个 token，而不是 PAD
+        embeddings = outputs[0]
+        if left_padding:
+            embeddings = embeddings[:, -1, :]
+        else:
+            embeddings = embeddings[np.arange(batch_size), token_counts - 1]
         
-        ort_outputs = self.__ort_session.run(None, ort_inputs)
-        embeddings = ort_outputs[0]
-
-        # 使用 last_token 池化
-        embeddings = embeddings[:, -1, :]
+        return token_counts, embeddings, None
 
+    def inference(self, inputs: List[str], normalize: bool = True) -> (int, np.ndarray):
+        token_counts, embeddings, normalized = self.encode(inputs)
         if normalize:
-            embeddings = embeddings / np.linalg.norm(embeddings, ord=2, axis=1, keepdims=True)
-        
-        return total_tokens, embeddings
+            embeddings = normalized if normalized is not None else normalize_embeddings(embeddings)
+        return int(token_counts.sum()), embeddings
 
 # --- ONNX 模型管理器 ---
 class OnnxModelManager:
-    def __init__(self, base_path: Path, max_executors: int = 2, max_active_models: int = 3, max_idle_time: int = 300):
+    def __init__(self, base_path: Path, max_executors: int = 1, max_active_models: int = 3, max_idle_time: int = 300):
         self.__base_path = base_path
         self.__max_active_models = max_active_models
         self.__max_idle_time = max_idle_time
@@ -121,6 +214,34 @@ class OnnxModelManager:
         self.__embedding_executor = ThreadPoolExecutor(max_workers=max_executors, thread_name_prefix="embedding")
         self.__lock = threading.RLock()
         self.__running = True
+        # 每个模型一个合批队列及其消费任务
+        self.__batch_queues: Dict[str, asyncio.Queue] = {}
+        self.__batch_tasks: Dict[str, asyncio.Task] = {}
+        self.__sess_options = self.__build_session_options()
+
+    @staticmethod
+    def __build_session_options() -> ort.SessionOptions:
+        """所有模型共用的会话选项；CPU 内存池注册到 ORT 环境中共享，同时加载多个模型也只占一份 arena"""
+        try:
+            ort.create_and_register_allocator(
+                ort.OrtMemoryInfo("Cpu", ort.OrtAllocatorType.ORT_ARENA_ALLOCATOR, 0, ort.OrtMemType.DEFAULT),
+                ort.OrtArenaCfg(0, -1, -1, -1),
+            )
+        except Exception as e:
+            # 同一进程内已注册过时会失败，沿用已有的共享分配器
+            logger.warning(f"注册共享CPU分配器失败: {e}")
+        
+        # 并行只交给 ORT 的 intra-op 线程池：单执行器线程串行提交批次，关闭自旋避免与事件循环争抢CPU
+        sess_options = ort.SessionOptions()
+        sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        sess_options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        sess_options.intra_op_num_threads = os.cpu_count() or 1
+        sess_options.inter_op_num_threads = 1
+        sess_options.enable_mem_pattern = True
+        sess_options.enable_cpu_mem_arena = True
+        sess_options.add_session_config_entry("session.intra_op.allow_spinning", "0")
+        sess_options.add_session_config_entry("session.use_env_allocators", "1")
+        return sess_options
 
     def init_available_models(self):
         logger.info("正在扫描可用的模型...")
@@ -140,14 +261,19 @@ class OnnxModelManager:
             
             model_path = self.__base_path / model_name
             tokenizer = AutoTokenizer.from_pretrained(str(model_path), trust_remote_code=True)
-            ort_session = ort.InferenceSession(str(model_path / "model.onnx"), providers=["CUDAExecutionProvider", "CPUExecutionProvider"])
+            # 优先使用 export_normed_model.py 生成的图内池化模型，其次是 quantize_model.py 生成的 INT8 模型
+            onnx_file = next(
+                (model_path / name for name in ("model.normed.onnx", "model.int8.onnx") if (model_path / name).exists()),
+                model_path / "model.onnx",
+            )
+            ort_session = ort.InferenceSession(str(onnx_file), sess_options=self.__sess_options, providers=["CUDAExecutionProvider", "CPUExecutionProvider"])
             
             model_config = {}
             if (model_path / "onnx_config.json").exists():
                 model_config = json.loads((model_path / "onnx_config.json").read_text(encoding="utf-8"))
 
             self.__loaded_models[model_name] = OnnxModel(model_path, tokenizer, ort_session, model_config)
-            logger.info(f"模型 {model_name} 已加载。推理提供者: {ort_session.get_providers()}")
+            logger.info(f"模型 {model_name} 已加载 ({onnx_file.name})。推理提供者: {ort_session.get_providers()}")
 
     def unload_idle_models(self):
         while self.__running:
@@ -163,17 +289,68 @@ class OnnxModelManager:
                     self.__loaded_models[name].release()
                     del self.__loaded_models[name]
 
-    async def inference_async(self, model_name: str, inputs: List[str], normalize: bool = True):
+    def __get_model(self, model_name: str) -> OnnxModel:
         with self.__lock:
             if model_name not in self.__loaded_models:
                 self.load_model(model_name)
-        
-        onnx_model = self.__loaded_models[model_name]
-        loop = asyncio.get_event_loop()
-        return await loop.run_in_executor(self.__embedding_executor, onnx_model.inference, inputs, normalize)
+            return self.__loaded_models[model_name]
+
+    async def inference_async(self, model_name: str, inputs: List[str], normalize: bool = True):
+        """提交到该模型的合批队列，等待所在批次推理完成后取回属于本请求的切片"""
+        self.__get_model(model_name)
+        future = asyncio.get_running_loop().create_future()
+        await self.__get_batch_queue(model_name).put((inputs, future))
+        token_counts, embeddings, normalized = await future
+        if normalize:
+            embeddings = normalized if normalized is not None else normalize_embeddings(embeddings)
+        return int(token_counts.sum()), embeddings
+
+    def __get_batch_queue(self, model_name: str) -> asyncio.Queue:
+        queue = self.__batch_queues.get(model_name)
+        if queue is None:
+            queue = self.__batch_queues[model_name] = asyncio.Queue()
+            self.__batch_tasks[model_name] = asyncio.create_task(self.__run_batches(model_name, queue), name=f"batch-{model_name}")
+        return queue
+
+    async def __run_batches(self, model_name: str, queue: asyncio.Queue):
+        """合并并发请求：攒够 BATCH_MAX_SIZE 条文本或等待 BATCH_MAX_WAIT 秒后一次前向推理，再按请求切分结果"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            size = len(batch[0][0])
+            deadline = loop.time() + BATCH_MAX_WAIT
+            while size < BATCH_MAX_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                batch.append(item)
+                size += len(item[0])
+            
+            texts = [text for inputs, _ in batch for text in inputs]
+            try:
+                onnx_model = self.__get_model(model_name)
+                token_counts, embeddings, normalized = await loop.run_in_executor(self.__embedding_executor, onnx_model.encode, texts)
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            
+            offset = 0
+            for inputs, future in batch:
+                end = offset + len(inputs)
+                if not future.done():
+                    future.set_result((token_counts[offset:end], embeddings[offset:end], normalized[offset:end] if normalized is not None else None))
+                offset = end
 
     def stop(self):
         self.__running = False
+        for task in self.__batch_tasks.values():
+            task.cancel()
         self.__embedding_executor.shutdown(wait=True)
 
 # --- FastAPI 应用实例和生命周期 ---
@@ -217,17 +394,29 @@ async def create_embeddings(request: EmbeddingRequest):
             request.model, request.input, request.normalize
         )
         
-        data = [
-            EmbeddingData(embedding=embedding.tolist(), index=i)
-            for i, embedding in enumerate(embeddings)
-        ]
+        embeddings = np.ascontiguousarray(embeddings, dtype='<f4')
+        if request.encoding_format == "base64":
+            # 二进制编码免去逐个浮点数转文本，响应体积约为 JSON 列表的 1/3；memoryview 直接读取连续行，不经 tobytes 复制
+            data = [
+                {"object": "embedding", "embedding": base64.b64encode(memoryview(embedding)).decode('ascii'), "index": i}
+                for i, embedding in enumerate(embeddings)
+            ]
+        else:
+            # orjson 直接序列化 numpy 行，省去 tolist() 与 pydantic 校验
+            data = [
+                {"object": "embedding", "embedding": embedding, "index": i}
+                for i, embedding in enumerate(embeddings)
+            ]
         
-        return EmbeddingResponse(
-            id=f"emb_{uuid.uuid4()}",
-            model=request.model,
-            data=data,
-            usage=Usage(prompt_tokens=total_tokens, total_tokens=total_tokens)
-        )
+        # 结构与 EmbeddingResponse 一致，直接返回序列化好的字节
+        payload = {
+            "id": f"emb_{uuid.uuid4()}",
+            "model": request.model,
+            "object": "list",
+            "data": data,
+            "usage": {"prompt_tokens": total_tokens, "total_tokens": total_tokens},
+        }
+        return Response(orjson.dumps(payload, option=orjson.OPT_SERIALIZE_NUMPY), media_type="application/json")
     except Exception as e:
         logger.error(f"嵌入推理时出错: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
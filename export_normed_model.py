@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+export_normed_model.py
+
+离线把 last_token 池化与 L2 归一化写进 ONNX 计算图，生成 model.normed.onnx。
+新图输出 pooled_embedding (未归一化) 与 normalized_embedding 两个 (batch, hidden) 张量，
+embedding_service 加载模型时优先使用该文件：ORT 只需拷出池化后的向量，而不是整个 (batch, seq, hidden) 隐状态，
+归一化也在 ORT 执行计划内完成。
+
+源模型优先使用 quantize_model.py 生成的 model.int8.onnx，否则使用 model.onnx。
+
+前置依赖: pip install onnx
+
+用法:
+python export_normed_model.py /path/to/ai-models/qwen3-embedding-0.6b
+"""
+import sys
+from pathlib import Path
+
+import onnx
+from modelscope import AutoTokenizer
+from onnx import TensorProto, helper
+
+POOLED_OUTPUT = "pooled_embedding"
+NORMALIZED_OUTPUT = "normalized_embedding"
+
+def get_opset(model: onnx.ModelProto) -> int:
+    return next(o.version for o in model.opset_import if o.domain in ("", "ai.onnx"))
+
+def add_pooling_nodes(model: onnx.ModelProto, left_padding: bool) -> onnx.ModelProto:
+    graph = model.graph
+    opset = get_opset(model)
+    hidden = graph.output[0]
+    elem_type = hidden.type.tensor_type.elem_type
+    nodes, initializers = [], []
+
+    if left_padding:
+        # 左填充时每条序列的最后一个 token 都在末位
+        initializers.append(helper.make_tensor("pool_last_position", TensorProto.INT64, [], [-1]))
+        nodes.append(helper.make_node("Gather", [hidden.name, "pool_last_position"], [POOLED_OUTPUT], axis=1))
+    else:
+        # 右填充时按 attention_mask 求每条序列真实长度，GatherND(batch_dims=1) 取出最后一个 token
+        initializers += [
+            helper.make_tensor("pool_seq_axis", TensorProto.INT64, [1], [1]),
+            helper.make_tensor("pool_last_axis", TensorProto.INT64, [1], [-1]),
+            helper.make_tensor("pool_one", TensorProto.INT64, [], [1]),
+        ]
+        nodes.append(helper.make_node("Cast", ["attention_mask"], ["pool_mask"], to=TensorProto.INT64))
+        if opset >= 13:
+            nodes.append(helper.make_node("ReduceSum", ["pool_mask", "pool_seq_axis"], ["pool_lengths"], keepdims=0))
+        else:
+            nodes.append(helper.make_node("ReduceSum", ["pool_mask"], ["pool_lengths"], axes=[1], keepdims=0))
+        nodes.append(helper.make_node("Sub", ["pool_lengths", "pool_one"], ["pool_last_index"]))
+        if opset >= 13:
+            nodes.append(helper.make_node("Unsqueeze", ["pool_last_index", "pool_last_axis"], ["pool_indices"]))
+        else:
+            nodes.append(helper.make_node("Unsqueeze", ["pool_last_index"], ["pool_indices"], axes=[-1]))
+        nodes.append(helper.make_node("GatherND", [hidden.name, "pool_indices"], [POOLED_OUTPUT], batch_dims=1))
+
+    if opset >= 18:
+        initializers.append(helper.make_tensor("norm_axis", TensorProto.INT64, [1], [-1]))
+        nodes.append(helper.make_node("ReduceL2", [POOLED_OUTPUT, "norm_axis"], ["embedding_norm"], keepdims=1))
+    else:
+        nodes.append(helper.make_node("ReduceL2", [POOLED_OUTPUT], ["embedding_norm"], axes=[-1], keepdims=1))
+    nodes.append(helper.make_node("Div", [POOLED_OUTPUT, "embedding_norm"], [NORMALIZED_OUTPUT]))
+
+    graph.node.extend(nodes)
+    graph.initializer.extend(initializers)
+    del graph.output[:]
+    graph.output.extend([
+        helper.make_tensor_value_info(POOLED_OUTPUT, elem_type, ["batch", "hidden"]),
+        helper.make_tensor_value_info(NORMALIZED_OUTPUT, elem_type, ["batch", "hidden"]),
+    ])
+    return model
+
+def main(model_path: Path):
+    source = model_path / "model.int8.onnx"
+    if not source.exists():
+        source = model_path / "model.onnx"
+    target = model_path / "model.normed.onnx"
+    tokenizer = AutoTokenizer.from_pretrained(str(model_path), trust_remote_code=True)
+    left_padding = tokenizer.padding_side == "left"
+
+    print(f"🔧 写入池化与归一化节点 ({'左' if left_padding else '右'}填充): {source.name} -> {target.name}")
+    model = add_pooling_nodes(onnx.load(str(source)), left_padding)
+    onnx.save(model, str(target), save_as_external_data=True, location=f"{target.name}.data")
+    # 按路径校验，避免超过 2GB 的模型在内存中序列化失败
+    onnx.checker.check_model(str(target))
+    print(f"✅ 已生成 {target}")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("用法: python export_normed_model.py <模型目录>")
+        sys.exit(1)
+    main(Path(sys.argv[1]))
@@ -1,16 +1,30 @@
 # -*- coding: utf-8 -*-
 import os
+import asyncio
 import requests
 import json
+import orjson
 import uuid
 import time
 import re
 import logging
+import base64
+import hashlib
+import threading
 import importlib.util
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict, deque
+from itertools import islice
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from openai import OpenAI
 from dotenv import load_dotenv
-from conversation_value_filter import ConversationValueFilter, ConversationItem, FilterResult
+import numpy as np
+from openai.types.responses import Response
+from conversation_value_filter import (ConversationValueFilter, ConversationItem, FilterResult, SemanticResponseCache,
+                                       EMBEDDING_SERVICE_URL, EMBEDDING_MODEL_NAME)
 from task_todo_manager import TaskTodoManager
 
 # --- 日志配置 ---
@@ -37,9 +51,49 @@ load_dotenv()
 
 # 全局常量
 MEMORY_SERVICE_URL = "http://127.0.0.1:8000"
+MEMORY_CACHE_SIZE = 512
+MEMORY_CACHE_TTL = 300  # 秒
+# 熔断：连续失败 BREAKER_FAIL_MAX 次后 BREAKER_RESET_TIMEOUT 秒内直接返回 degraded，之后放行一次试探请求
+BREAKER_FAIL_MAX = 5
+BREAKER_RESET_TIMEOUT = 30  # 秒
+DEGRADED_RESPONSE = {"status": "degraded", "detail": "memory service unavailable"}
 USER_ID = "project_manager_alice"
 AGENT_ID = "agent_project_management_assistant"
 SKILLS_DIR = 'skills'
+_SKILL_NAME_RE = re.compile(r'^[a-zA-Z0-9_-]+\Z')
+# 技能元数据磁盘缓存：按 (文件名, mtime_ns) 失效，技能文件未改动时启动无需 exec_module
+SKILL_META_CACHE_FILE = os.path.join(SKILLS_DIR, '.meta_cache.json')
+SKILL_LOAD_WORKERS = 8  # 需要重新导入的技能模块并行加载的线程数上限
+BACKGROUND_WORKERS = 2  # 后台记忆写入线程数
+MEMORY_TIMEOUT = (1, 15)  # (连接, 读取) 超时：本地服务连不上时快速失败，读取仍留足向量检索的时间
+CONSOLIDATION_MAX_BYTES = 16 * 1024  # 单次记忆整合写入的文本上限 (UTF-8 字节)
+MAX_WORKING_MEMORY = 20  # 推理对话历史的最大条数，超出部分转移到STM
+STM_SUMMARY_ROUNDS = 15  # 上下文中保留的最近轮次摘要数
+STM_FLUSH_THRESHOLD = 8  # STM 消息缓冲达到该条数时批量写入
+# 历史摘要消息的固定首尾，中间为逐轮渲染的摘要块
+HISTORY_SUMMARY_HEADER = "## 📚 历史对话摘要\n"
+HISTORY_SUMMARY_FOOTER = "\n## 🎯 当前对话\n以下是当前轮次的对话："
+# 记忆转化时判断偏好 (Level 3) 与程序性知识 (Level 4) 的关键词
+_PREF_KW = ("喜欢", "偏好", "习惯", "倾向", "爱好")
+_PROC_KW = ("流程", "步骤", "如何", "方法", "操作")
+# 关键词合并为一个交替正则，一次扫描判断是否命中任意关键词
+_PREF_RE = re.compile("|".join(map(re.escape, _PREF_KW)))
+_PROC_RE = re.compile("|".join(map(re.escape, _PROC_KW)))
+# 轮次摘要中"使用记忆"的识别：命名分组对应记忆类型，一次扫描找出全部命中
+_MEMORY_USAGE_RE = re.compile(r"(?P<semantic_memory>语义|semantic)|(?P<episodic_memory>情节|episodic)|(?P<ltm_memory>长期|ltm)"
+                              r"|(?P<knowledge_graph>知识图谱|kg)|(?P<procedural_memory>程序性|procedural)|(?P<working_memory>工作|wm)")
+# 互不依赖的只读记忆查询工具：模型一次返回多个时并发执行
+READ_ONLY_MEMORY_TOOLS = frozenset({
+    "query_ltm_preference", "query_episodic_memory", "query_semantic_memory", "query_knowledge_graph", "query_stm"
+})
+
+# 推理循环的LLM响应缓存 (默认关闭，AGENT_LLM_CACHE=1 开启)：完整请求精确命中，
+# 或仅含系统提示+用户输入时，同一用户同一系统提示下语义相似的输入复用不含工具调用的最终回答。
+# 只有 temperature 为 0 (AGENT_LLM_TEMPERATURE=0) 时响应才可复用，否则即使开启也不缓存
+LLM_CACHE_ENABLED = os.getenv("AGENT_LLM_CACHE", "0") != "0"
+LLM_TEMPERATURE = float(os.environ["AGENT_LLM_TEMPERATURE"]) if os.getenv("AGENT_LLM_TEMPERATURE") else None
+LLM_EXACT_CACHE_SIZE = 1024
+LLM_SEMANTIC_CACHE_THRESHOLD = 0.92
 
 # --- OpenAI 客户端初始化 ---
 try:
@@ -60,19 +114,368 @@ except Exception as e:
     exit(1)
 
 # --- 辅助函数 ---
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+JSON_HEADERS = {"Content-Type": "application/json"}
+
+def _dumps(obj) -> str:
+    """工具观察结果序列化为 JSON 字符串 (UTF-8 原样输出，等价于 ensure_ascii=False)"""
+    return orjson.dumps(obj, option=ORJSON_OPTIONS).decode('utf-8')
+
+class _LazyJSON:
+    """日志参数包装：仅在记录真正输出时才序列化，DEBUG 关闭时不产生任何 JSON 字符串"""
+    __slots__ = ("obj", "indent")
+    def __init__(self, obj, indent=None):
+        self.obj, self.indent = obj, indent
+    def __str__(self):
+        return json.dumps(self.obj, indent=self.indent, ensure_ascii=False, default=str)
+
+def _load_skill_meta_cache() -> dict:
+    try:
+        with open(SKILL_META_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save_skill_meta_cache(cache: dict):
+    try:
+        with open(SKILL_META_CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+    except (OSError, TypeError, ValueError) as e:
+        logger.warning(f"写入技能元数据缓存失败: {e}")
+
+def _skill_meta_fresh(entry: os.DirEntry, cache: dict) -> bool:
+    cached = cache.get(entry.name)
+    return bool(cached) and cached.get("mtime_ns") == entry.stat().st_mtime_ns
+
+def _exec_skill_metadata(entry: os.DirEntry, skill_name: str):
+    """导入技能模块并返回 get_skill_metadata() 结果 (无该函数时为 None)"""
+    spec = importlib.util.spec_from_file_location(f"{SKILLS_DIR}.{skill_name}", entry.path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.get_skill_metadata() if hasattr(module, 'get_skill_metadata') else None
+
+def _prefetch_skill_metadata(stale: list) -> dict:
+    """在线程池中并行导入 [(entry, skill_name)]，返回 {文件名: 元数据或异常}，与磁盘读取和模块初始化重叠"""
+    def load(item):
+        try:
+            return _exec_skill_metadata(*item)
+        except Exception as e:
+            return e
+    with ThreadPoolExecutor(max_workers=min(SKILL_LOAD_WORKERS, len(stale))) as executor:
+        return dict(zip((entry.name for entry, _ in stale), executor.map(load, stale)))
+
+def _read_skill_metadata(entry: os.DirEntry, skill_name: str, cache: dict, prefetched: dict = None):
+    """返回技能的 get_skill_metadata() 结果 (无该函数时为 None)；文件未变化时直接使用缓存，变化时才导入模块"""
+    if _skill_meta_fresh(entry, cache):
+        return cache[entry.name].get("metadata")
+    mtime_ns = entry.stat().st_mtime_ns
+    if prefetched is not None and entry.name in prefetched:
+        metadata = prefetched[entry.name]
+        if isinstance(metadata, Exception):
+            raise metadata
+    else:
+        metadata = _exec_skill_metadata(entry, skill_name)
+    try:
+        json.dumps(metadata)
+        cache[entry.name] = {"mtime_ns": mtime_ns, "metadata": metadata}
+    except (TypeError, ValueError):
+        cache.pop(entry.name, None)  # 元数据不可序列化时不缓存，下次启动重新导入
+    return metadata
+
+def _sanitize_input(raw_input: str) -> str:
+    """只有含孤立代理字符 (终端解码失败时出现) 的输入才需要替换，纯 ASCII 和正常 UTF-8 原样返回"""
+    if raw_input.isascii():
+        return raw_input
+    try:
+        raw_input.encode('utf-8')
+        return raw_input
+    except UnicodeEncodeError:
+        return raw_input.encode('utf-8', errors='replace').decode('utf-8')
+
+def _build_memory_session() -> requests.Session:
+    """记忆服务的共享会话：连接池复用 keep-alive 连接，连接失败或网关类 5xx 时指数退避重试（POST 不会在读取失败后重发）"""
+    session = requests.Session()
+    retry = Retry(total=2, read=0, backoff_factor=0.25, status_forcelist=(502, 503, 504),
+                  allowed_methods=frozenset({"POST"}), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=10, pool_maxsize=50, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["Connection"] = "keep-alive"
+    return session
+
+_MEMORY_SESSION = _build_memory_session()
+
+class _MemoryLRU:
+    """只读记忆检索结果的进程内 LRU + TTL 缓存，键为 payload 的 sha256；写入/清除某类记忆时整类失效。
+    每次失效递增该类记忆的代数，检索前记下代数，返回时代数已变化 (期间有写入) 的结果不写入缓存"""
+    def __init__(self, maxsize: int = MEMORY_CACHE_SIZE, ttl: float = MEMORY_CACHE_TTL):
+        self.maxsize, self.ttl = maxsize, ttl
+        self._entries = OrderedDict()  # key -> (过期时间, memory_type, 结果)
+        self._generations = {}  # memory_type -> 失效次数
+        self._lock = threading.Lock()  # 并发检索在线程池中读写
+        self.hits = self.misses = 0
+
+    @staticmethod
+    def make_key(payload: dict) -> str:
+        return hashlib.sha256(orjson.dumps(payload, option=ORJSON_OPTIONS | orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def generation(self, memory_type: str) -> int:
+        with self._lock:
+            return self._generations.get(memory_type, 0)
+
+    def put(self, key: str, memory_type: str, result: dict, generation: int = None):
+        with self._lock:
+            if generation is not None and self._generations.get(memory_type, 0) != generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, memory_type, result)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, memory_type: str):
+        with self._lock:
+            self._generations[memory_type] = self._generations.get(memory_type, 0) + 1
+            for key in [k for k, entry in self._entries.items() if entry[1] == memory_type]:
+                del self._entries[key]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._entries),
+                "hit_rate": self.hits / total if total else 0.0}
+
+_MEMORY_CACHE = _MemoryLRU()
+
+class _CircuitBreaker:
+    """记忆服务熔断器：closed -> (连续失败 fail_max 次) open -> (reset_timeout 后) half-open 放行一次试探"""
+    def __init__(self, fail_max: int = BREAKER_FAIL_MAX, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.fail_max, self.reset_timeout = fail_max, reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self._probing = True  # half-open：只放行一个试探请求
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._failures, self._opened_at, self._probing = 0, None, False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._probing or self._failures >= self.fail_max:
+                if self._opened_at is None or self._probing:
+                    logger.warning(f"记忆服务连续失败 {self._failures} 次，熔断 {self.reset_timeout} 秒")
+                self._opened_at, self._probing = time.monotonic(), False
+
+_MEMORY_BREAKER = _CircuitBreaker()
+
+def _is_service_failure(error: Exception) -> bool:
+    """连接错误、超时和 5xx 计入熔断；4xx (如旧版服务没有某个接口) 不代表服务不可用"""
+    if isinstance(error, requests.exceptions.HTTPError) and error.response is not None:
+        return error.response.status_code >= 500
+    return isinstance(error, requests.exceptions.RequestException)
+
 def call_memory_service(endpoint: str, payload: dict) -> dict:
+    if endpoint not in ("store", "clear"):
+        return _post_memory_service(endpoint, payload)
+    # 写入/清除前后各失效一次：请求期间 (如后台存储轮次摘要时) 并发检索到的旧结果会在完成后清掉，
+    # 代数变化也使这些检索的结果不会写入缓存
+    memory_type = payload.get("memory_type")
+    _MEMORY_CACHE.invalidate(memory_type)
+    try:
+        return _post_memory_service(endpoint, payload)
+    finally:
+        _MEMORY_CACHE.invalidate(memory_type)
+
+def _post_memory_service(endpoint: str, payload: dict) -> dict:
     url = f"{MEMORY_SERVICE_URL}/{endpoint}"
-    logger.debug(f"准备调用记忆服务: Endpoint={endpoint}, Payload={json.dumps(payload, ensure_ascii=False)}")
+    # 先在本地序列化：无法编码的请求体不占用 half-open 试探，也不计入熔断
+    try:
+        body = orjson.dumps(payload, option=ORJSON_OPTIONS)
+    except TypeError as e:
+        error_message = f"记忆服务请求序列化失败: {e}"
+        logger.error(error_message)
+        return {"status": "error", "detail": error_message}
+    if not _MEMORY_BREAKER.allow():
+        logger.warning(f"记忆服务已熔断，跳过调用: Endpoint={endpoint}")
+        return dict(DEGRADED_RESPONSE)
+    logger.debug("准备调用记忆服务: Endpoint=%s, Payload=%s", endpoint, _LazyJSON(payload))
     try:
-        response = requests.post(url, json=payload, timeout=15)
+        response = _MEMORY_SESSION.post(url, data=body, headers=JSON_HEADERS, timeout=MEMORY_TIMEOUT)
         response.raise_for_status()
-        json_response = response.json()
-        logger.debug(f"记忆服务响应: {json.dumps(json_response, ensure_ascii=False)}")
+        json_response = orjson.loads(response.content)
+        _MEMORY_BREAKER.record_success()
+        logger.debug("记忆服务响应: %s", _LazyJSON(json_response))
         return json_response
-    except requests.exceptions.RequestException as e:
+    except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
+        if _is_service_failure(e):
+            _MEMORY_BREAKER.record_failure()
+        else:
+            _MEMORY_BREAKER.record_success()  # 服务有响应，只是请求本身不被接受
         error_message = f"调用记忆服务失败: {e}"
         logger.error(error_message)
         return {"status": "error", "detail": error_message}
+    except Exception as e:
+        # 其他异常 (如响应体解析出错) 同样计入失败，保证 half-open 试探标记被复位
+        _MEMORY_BREAKER.record_failure()
+        error_message = f"调用记忆服务失败: {e}"
+        logger.error(error_message)
+        return {"status": "error", "detail": error_message}
+
+def call_memory_service_batch(items: list):
+    """一次 POST 到 /retrieve_batch 检索多个记忆模块；items 为 [{memory_type, params}]，结果与输入顺序一致。
+    批量接口不可用 (如旧版服务返回 404) 时返回 None，由调用方回退到逐个检索"""
+    url = f"{MEMORY_SERVICE_URL}/retrieve_batch"
+    try:
+        body = orjson.dumps({"batch": items}, option=ORJSON_OPTIONS)
+    except TypeError as e:
+        logger.warning(f"批量记忆请求序列化失败: {e}")
+        return None
+    if not _MEMORY_BREAKER.allow():
+        return [dict(DEGRADED_RESPONSE) for _ in items]
+    logger.debug("准备批量调用记忆服务: %s", _LazyJSON(items))
+    try:
+        response = _MEMORY_SESSION.post(url, data=body, headers=JSON_HEADERS, timeout=MEMORY_TIMEOUT)
+        response.raise_for_status()
+        results = orjson.loads(response.content)["results"]
+        _MEMORY_BREAKER.record_success()
+        logger.debug("记忆服务批量响应: %s", _LazyJSON(results))
+        return results
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        if _is_service_failure(e):
+            _MEMORY_BREAKER.record_failure()
+        else:
+            _MEMORY_BREAKER.record_success()  # 服务有响应，只是请求本身不被接受
+        logger.warning(f"批量调用记忆服务失败: {e}")
+        return None
+    except Exception as e:
+        _MEMORY_BREAKER.record_failure()
+        logger.warning(f"批量调用记忆服务失败: {e}")
+        return None
+
+def retrieve_memory_cached(payload: dict) -> dict:
+    """经 _MEMORY_CACHE 的 retrieve 调用，仅缓存成功结果"""
+    key = _MEMORY_CACHE.make_key(payload)
+    result = _MEMORY_CACHE.get(key)
+    if result is None:
+        generation = _MEMORY_CACHE.generation(payload["memory_type"])
+        result = call_memory_service('retrieve', payload)
+        if result.get("status") not in ("error", "degraded"):
+            _MEMORY_CACHE.put(key, payload["memory_type"], result, generation)
+    return result
+
+def _compact_content(part) -> dict:
+    """message 内容片段：output_text 且无注解/logprobs 时直接构建，其余情况回退到 model_dump"""
+    if getattr(part, 'type', None) == 'output_text' and not part.annotations and getattr(part, 'logprobs', None) is None:
+        return {"annotations": [], "text": part.text, "type": "output_text"}
+    return part.model_dump(exclude_none=True)
+
+def _compact_output(output) -> dict:
+    """把 response.output 中的条目转为写回对话历史的字典：function_call、message 及其纯文本片段直接按已知字段构建，
+    其他类型 (如 reasoning) 使用 model_dump；值为 None 的字段省略，与 exclude_none 一致"""
+    output_type = getattr(output, 'type', None)
+    if output_type == 'function_call':
+        item = {"type": "function_call", "id": getattr(output, 'id', None), "call_id": output.call_id,
+                "name": output.name, "arguments": output.arguments, "status": getattr(output, 'status', None)}
+    elif output_type == 'message':
+        item = {"type": "message", "id": getattr(output, 'id', None), "role": getattr(output, 'role', None),
+                "status": getattr(output, 'status', None),
+                "content": [_compact_content(c) for c in (getattr(output, 'content', None) or []) if c]}
+    else:
+        return output.model_dump(exclude_none=True)
+    return {k: v for k, v in item.items() if v is not None}
+
+class _LLMResponseCache:
+    """responses.create 的响应缓存：键为 sha256(模型|工具集|用户|完整对话历史) 的进程内 LRU，
+    外加基于 SemanticResponseCache 的语义层。语义层的 stage 按模型、工具集、用户和系统提示划分，
+    且只在对话历史恰为 [系统提示, 用户输入] 时使用，其他用户或带有记忆上下文/历史摘要的请求不会命中。
+    只缓存没有 function_call 的响应，命中不会跳过任何工具副作用"""
+    def __init__(self, model: str, tools: list, user_id: str, system_message: dict):
+        tools_hash = hashlib.sha256(orjson.dumps(tools, option=ORJSON_OPTIONS | orjson.OPT_SORT_KEYS)).hexdigest()
+        self._prefix = f"{model}|{tools_hash}|{user_id}|"
+        self._system_message = system_message
+        self._exact = OrderedDict()
+        stage_key = self._prefix.encode() + orjson.dumps(system_message, option=ORJSON_OPTIONS | orjson.OPT_SORT_KEYS)
+        self._semantic = SemanticResponseCache(stage=f"agent:{hashlib.sha256(stage_key).hexdigest()[:32]}",
+                                               threshold=LLM_SEMANTIC_CACHE_THRESHOLD)
+        self._http = requests.Session()
+        self.hits = {"exact": 0, "semantic": 0}
+        self.misses = 0
+
+    def _key(self, history: list) -> str:
+        return hashlib.sha256(self._prefix.encode() + orjson.dumps(history, option=ORJSON_OPTIONS | orjson.OPT_SORT_KEYS)).hexdigest()
+
+    def _embed(self, text: str):
+        try:
+            response = self._http.post(EMBEDDING_SERVICE_URL, json={"model": EMBEDDING_MODEL_NAME, "input": [text], "encoding_format": "base64"}, timeout=5)
+            response.raise_for_status()
+            embedding = response.json()['data'][0]['embedding']
+            return np.frombuffer(base64.b64decode(embedding), dtype='<f4') if isinstance(embedding, str) else np.asarray(embedding, dtype='float32')
+        except (requests.exceptions.RequestException, KeyError, IndexError, ValueError) as e:
+            logger.warning(f"嵌入服务不可用，跳过LLM语义缓存: {e}")
+            return None
+
+    def get_or_call(self, history: list, call):
+        key = self._key(history)
+        cached = self._exact.get(key)
+        if cached is not None:
+            self._exact.move_to_end(key)
+            self.hits["exact"] += 1
+            logger.info("⚡ LLM响应精确缓存命中")
+            return Response.model_validate(cached)
+        last = history[-1] if history else None
+        embedding = None
+        # 语义层只用于 [系统提示, 用户输入]：stage 已覆盖系统提示，嵌入覆盖用户输入
+        if (len(history) == 2 and history[0] == self._system_message and isinstance(last, dict)
+                and last.get("role") == "user" and isinstance(last.get("content"), str)):
+            embedding = self._embed(last["content"])
+            cached = self._semantic.get(embedding) if embedding is not None else None
+            if cached is not None:
+                self.hits["semantic"] += 1
+                logger.info("⚡ LLM响应语义缓存命中")
+                return Response.model_validate(cached)
+        self.misses += 1
+        response = call()
+        if not any(getattr(output, 'type', None) == 'function_call' for output in response.output):
+            dumped = response.model_dump(mode='json', exclude_none=True)
+            self._exact[key] = dumped
+            if len(self._exact) > LLM_EXACT_CACHE_SIZE:
+                self._exact.popitem(last=False)
+            if embedding is not None:
+                self._semantic.put(embedding, dumped)
+        return response
+
+async def _gather_memories(calls: list) -> list:
+    """并发执行 [(函数, 参数字典)] 形式的只读记忆查询，按输入顺序返回 [(结果或异常, 耗时)]"""
+    async def timed_call(func, kwargs):
+        start_time = time.time()
+        try:
+            result = await asyncio.to_thread(func, **kwargs)
+        except Exception as e:
+            logger.exception(f"并发记忆查询出错: {kwargs}")
+            result = e
+        return result, time.time() - start_time
+    return await asyncio.gather(*(timed_call(func, kwargs) for func, kwargs in calls))
 
 class ProjectManagementAgent:
     def __init__(self, user_id, agent_id):
@@ -81,6 +484,14 @@ class ProjectManagementAgent:
         self.conversation_history = []  # 当前轮次的推理对话
         self.conversation_id = str(uuid.uuid4())  # 为STM同步生成会话ID
         self.round_id = 0  # 对话轮次计数器
+        self._system_prompt = self._build_system_prompt()  # 只依赖 agent_id/user_id，会话内不变
+        # 系统消息对象跨轮次复用，保证请求前缀逐字节一致以命中下游提示缓存
+        self._system_message = {"role": "system", "content": self._system_prompt}
+        # 本会话最近的轮次摘要：首轮从STM加载一次，之后由 _finalize_conversation_round 本地追加
+        self._stm_summaries = None
+        self._summary_blocks = None  # 与 _stm_summaries 一一对应的已渲染摘要文本，新摘要只渲染自身
+        self._enhanced_context = None  # 上次构建的增强上下文，摘要变化时置空重建
+        self._memories_used_this_round = set()  # 助手消息写入对话历史时识别出的记忆类型，轮次结束时清空
         
         logger.info(f"Agent {self.agent_id} 正在为用户 {self.user_id} 进行初始化...")
         logger.info(f"会话ID: {self.conversation_id}")
@@ -94,57 +505,96 @@ class ProjectManagementAgent:
         logger.info("✅ 任务Todo追踪管理器初始化完成")
         
         self.tools_definitions, self.tool_functions = self._initialize_tools()
+        self._llm_cache = None
+        if LLM_CACHE_ENABLED:
+            if LLM_TEMPERATURE == 0:
+                self._llm_cache = _LLMResponseCache(model_name, self.tools_definitions, self.user_id, self._system_message)
+            else:
+                logger.warning("⚠️ LLM响应缓存需要 AGENT_LLM_TEMPERATURE=0，当前采样温度下不启用缓存")
+        # 轮次摘要存储、STM→长期记忆整合等写入放到后台线程，不阻塞用户响应
+        self._bg_executor = ThreadPoolExecutor(max_workers=BACKGROUND_WORKERS, thread_name_prefix="memory-bg")
+        self._bg_tasks = set()
+        self._active_consolidations = set()  # 正在整合的 conversation_id，整合未结束时的再次触发直接跳过
+        self._bg_lock = threading.Lock()
+        # 待写入 STM 的消息缓冲，攒够一批或在轮次结束/检索STM前一次写入
+        self._stm_buffer = []
+        self._stm_lock = threading.Lock()
         logger.info("项目管理Agent已准备就绪。")
 
-    def _initialize_tools(self):
-        """[项目管理版] 为七大记忆模块提供完整、精确的工具集"""
-        tool_functions = {}
-        tools_definitions = []
+    # 技能工具定义在所有 Agent 实例间共享，技能目录中任一文件变化 (签名不同) 时才重新构建
+    _SKILL_TOOLS_CACHE = None
+    _SKILL_TOOLS_SIGNATURE = None
 
-        # 1. 动态加载外部技能 (程序性记忆)
+    @staticmethod
+    def _skills_signature():
+        with os.scandir(SKILLS_DIR) as entries:
+            return tuple(sorted((e.name, e.stat().st_mtime_ns) for e in entries if e.name.endswith('.py') and e.is_file()))
+
+    @classmethod
+    def _load_skill_tools(cls) -> list:
+        """返回外部技能 (程序性记忆) 的工具定义列表，命中类级缓存时不再读取技能元数据"""
         if not os.path.exists(SKILLS_DIR): os.makedirs(SKILLS_DIR); logger.info(f"技能目录 '{SKILLS_DIR}' 不存在，已自动创建。")
-        for filename in os.listdir(SKILLS_DIR):
-            if filename.endswith('.py') and not filename.startswith('__'):
-                skill_name = filename[:-3]
-                
-                # 过滤不符合OpenAI函数名规范的技能名（包含中文字符）
-                if not re.match(r'^[a-zA-Z0-9_-]+$', skill_name):
-                    logger.debug(f"跳过不符合函数名规范的技能: {skill_name}")
-                    continue
-                
-                try:
-                    module_path = f"{SKILLS_DIR}.{skill_name}"
-                    spec = importlib.util.spec_from_file_location(module_path, os.path.join(SKILLS_DIR, filename))
-                    module = importlib.util.module_from_spec(spec)
-                    spec.loader.exec_module(module)
-                    if hasattr(module, 'get_skill_metadata'):
-                        metadata = module.get_skill_metadata()
-                        
-                        # 兼容三种参数格式：列表、字典或完整的OpenAI schema
-                        params = metadata.get("parameters", [])
-                        if isinstance(params, list):
-                            # 列表格式：['param1', 'param2']
-                            params_schema = {
-                                "type": "object",
-                                "properties": {param: {"type": "string"} for param in params},
-                                "required": params
-                            }
-                        elif isinstance(params, dict) and "type" in params:
-                            # 完整的OpenAI schema格式
-                            params_schema = params
-                        else:
-                            # 字典格式：{'param1': {'description': '...', 'required': True}}
-                            params_schema = {
-                                "type": "object", 
-                                "properties": {k: {"type": "string", "description": v.get("description", "")} for k, v in params.items()}, 
-                                "required": [k for k, v in params.items() if v.get("required")]
-                            }
-                        
-                        tools_definitions.append({"type": "function", "name": skill_name, "description": metadata.get("description"), "parameters": params_schema})
-                        tool_functions[skill_name] = (lambda s_name: lambda **kwargs: self._execute_skill(skill_name=s_name, kwargs=kwargs))(skill_name)
-                        logger.info(f"成功动态加载[程序记忆]技能: {skill_name}")
-                except Exception as e:
-                    logger.error(f"加载技能 {skill_name} 失败: {e}")
+        signature = cls._skills_signature()
+        if cls._SKILL_TOOLS_CACHE is not None and cls._SKILL_TOOLS_SIGNATURE == signature:
+            logger.info(f"复用已构建的技能工具定义，共 {len(cls._SKILL_TOOLS_CACHE)} 个")
+            return cls._SKILL_TOOLS_CACHE
+        skill_definitions = []
+        # 技能由记忆服务执行，本地只需元数据来构建工具定义
+        meta_cache = _load_skill_meta_cache()
+        seen_files = set()
+        with os.scandir(SKILLS_DIR) as entries:
+            skill_entries = sorted((e for e in entries if e.name.endswith('.py') and not e.name.startswith('__') and e.is_file()), key=lambda e: e.name)
+        candidates = []
+        for entry in skill_entries:
+            skill_name = entry.name[:-3]
+            # 过滤不符合OpenAI函数名规范的技能名（包含中文字符）
+            if not _SKILL_NAME_RE.match(skill_name):
+                logger.debug(f"跳过不符合函数名规范的技能: {skill_name}")
+                continue
+            candidates.append((entry, skill_name))
+        # 缓存失效的技能先并行导入，再在主线程按文件名顺序构建工具定义
+        stale = [(entry, skill_name) for entry, skill_name in candidates if not _skill_meta_fresh(entry, meta_cache)]
+        prefetched = _prefetch_skill_metadata(stale) if stale else {}
+        for entry, skill_name in candidates:
+            seen_files.add(entry.name)
+            try:
+                metadata = _read_skill_metadata(entry, skill_name, meta_cache, prefetched)
+                if metadata is not None:
+                    # 兼容三种参数格式：列表、字典或完整的OpenAI schema
+                    params = metadata.get("parameters", [])
+                    if isinstance(params, list):
+                        # 列表格式：['param1', 'param2']
+                        params_schema = {
+                            "type": "object",
+                            "properties": {param: {"type": "string"} for param in params},
+                            "required": params
+                        }
+                    elif isinstance(params, dict) and "type" in params:
+                        # 完整的OpenAI schema格式
+                        params_schema = params
+                    else:
+                        # 字典格式：{'param1': {'description': '...', 'required': True}}
+                        params_schema = {
+                            "type": "object", 
+                            "properties": {k: {"type": "string", "description": v.get("description", "")} for k, v in params.items()}, 
+                            "required": [k for k, v in params.items() if v.get("required")]
+                        }
+                    
+                    skill_definitions.append({"type": "function", "name": skill_name, "description": metadata.get("description"), "parameters": params_schema})
+                    logger.info(f"成功动态加载[程序记忆]技能: {skill_name}")
+            except Exception as e:
+                logger.error(f"加载技能 {skill_name} 失败: {e}")
+        # 清理已删除技能的缓存项
+        meta_cache = {name: item for name, item in meta_cache.items() if name in seen_files}
+        _save_skill_meta_cache(meta_cache)
+        cls._SKILL_TOOLS_CACHE, cls._SKILL_TOOLS_SIGNATURE = skill_definitions, signature
+        return skill_definitions
+
+    def _initialize_tools(self):
+        """[项目管理版] 为七大记忆模块提供完整、精确的工具集"""
+        # 1. 外部技能 (程序性记忆)：定义跨实例共享，执行函数按实例绑定
+        tools_definitions = list(self._load_skill_tools())
+        tool_functions = {definition["name"]: functools.partial(self._execute_skill, definition["name"]) for definition in tools_definitions}
         
         # 2. 加入与记忆模块一一对应的内置工具
         meta_tools_def = [
@@ -176,7 +626,10 @@ class ProjectManagementAgent:
         return tools_definitions, tool_functions
 
     def _get_system_prompt(self):
-        """项目管理助手的系统提示"""
+        """项目管理助手的系统提示 (初始化时生成一次)"""
+        return self._system_prompt
+
+    def _build_system_prompt(self):
         return f"""你是{self.agent_id}，一个专业的项目管理智能助手，为项目经理{self.user_id}提供全方位的项目管理支持。
 
 **【你的专业领域】**
@@ -259,14 +712,16 @@ class ProjectManagementAgent:
         
         logger.info("项目管理Agent交互循环开始。")
         
-        self.conversation_history = [{"role": "system", "content": self._get_system_prompt()}]
+        self.conversation_history = [self._system_message]
         
         while True:
-            raw_input = input(f"\n{self.user_id} > "); user_input = raw_input.encode('utf-8', errors='replace').decode('utf-8'); logger.info(f"收到用户输入: '{user_input}'")
+            raw_input = input(f"\n{self.user_id} > "); user_input = _sanitize_input(raw_input); logger.info(f"收到用户输入: '{user_input}'")
             if user_input.lower() in ['退出', 'exit', 'quit']: 
                 # 完成当前任务（如果有）
                 if self.todo_manager.current_task_id:
                     self.todo_manager.complete_task("用户主动退出")
+                self._flush_stm_buffer()
+                self._shutdown_background()
                 logger.info("用户请求退出。"); print("再见！期待下次为您的项目管理工作提供支持！"); break
             
             # 🎯 开始新任务Todo追踪
@@ -299,9 +754,10 @@ class ProjectManagementAgent:
             
             assistant_message = {"role": "assistant", "content": final_answer}
             self.conversation_history.append(assistant_message)
+            self._note_memories_used(final_answer)
             
-            # 🔄 实时同步到STM（旧版格式）
-            self._sync_message_to_stm(assistant_message)
+            # 🔄 同步到STM（旧版格式），轮次结束时写入本轮缓冲
+            self._sync_message_to_stm(assistant_message, flush=True)
             
             logger.info(f"Agent最终回答: '{final_answer}'")
             
@@ -316,15 +772,20 @@ class ProjectManagementAgent:
             logger.info(f"📋 任务完成: {task_id}")
             
     def _think_and_act_loop(self, max_turns=15):
-        """采用强制单工具执行模式 - 彻底解决Azure OpenAI call_id不匹配问题"""
+        """默认强制单工具执行模式以避免 Azure OpenAI call_id 不匹配；多个只读记忆查询则整体并发执行并一次性回填全部输出"""
         logger.info("进入强制单工具执行Tool Calling模式...")
         
         for i in range(max_turns):
             logger.info(f"循环轮次 {i+1}/{max_turns}")
             try:
                 request_args = {"model": model_name, "tools": self.tools_definitions, "input": self.conversation_history}
-                logger.debug(f"发送给LLM的请求参数:\n{json.dumps(request_args, indent=2, ensure_ascii=False)}")
-                response = azure_client.responses.create(**request_args)
+                if LLM_TEMPERATURE is not None:
+                    request_args["temperature"] = LLM_TEMPERATURE
+                logger.debug("发送给LLM的请求参数:\n%s", _LazyJSON(request_args, indent=2))
+                if self._llm_cache is not None:
+                    response = self._llm_cache.get_or_call(self.conversation_history, lambda: azure_client.responses.create(**request_args))
+                else:
+                    response = azure_client.responses.create(**request_args)
             except Exception as e:
                 logger.error("调用LLM API时发生错误")
                 logger.exception(e)
@@ -339,15 +800,37 @@ class ProjectManagementAgent:
                 return "抱歉，我在思考时遇到了一点问题，请您稍后再试。"
             
             response_message = response.output[0]
-            self.conversation_history.append(response_message.model_dump(exclude_none=True))
+            self.conversation_history.append(_compact_output(response_message))
             
-            tool_calls = [output for output in response.output if hasattr(output, 'type') and output.type == 'function_call']
-            text_content = "".join([item.text for output in response.output if hasattr(output, 'type') and output.type == 'message' for item in output.content if hasattr(item, 'type') and item.type == 'output_text'])
+            # 一次遍历同时收集工具调用与文本输出
+            tool_calls, text_parts = [], []
+            for output in response.output:
+                output_type = getattr(output, 'type', None)
+                if output_type == 'function_call':
+                    tool_calls.append(output)
+                elif output_type == 'message':
+                    text_parts.extend(item.text for item in output.content if getattr(item, 'type', None) == 'output_text')
+            text_content = "".join(text_parts)
 
             if tool_calls:
                 logger.info(f"模型决定调用 {len(tool_calls)} 个工具。")
                 if text_content: logger.info(f"模型的中间思考过程: {text_content}")
                 
+                # ⚡ 多个只读记忆查询：并发执行，每个 function_call 都写入历史并配对输出，call_id 一一对应
+                if len(tool_calls) > 1 and all(call.name in READ_ONLY_MEMORY_TOOLS and getattr(call, 'call_id', None) for call in tool_calls):
+                    for call in tool_calls:
+                        if call is not response_message:
+                            self.conversation_history.append(_compact_output(call))
+                    observation_contents = self._execute_memory_queries_concurrently(tool_calls)
+                    for call, observation_content in zip(tool_calls, observation_contents):
+                        self.conversation_history.append({
+                            "type": "function_call_output",
+                            "call_id": call.call_id,
+                            "output": observation_content
+                        })
+                    logger.info(f"本轮并发执行了 {len(tool_calls)} 个记忆查询: {[call.name for call in tool_calls]}")
+                    continue
+                
                 # 🔥 强制单工具执行策略：彻底避免多工具状态冲突
                 executed_tools = []
                 
@@ -369,16 +852,17 @@ class ProjectManagementAgent:
                     logger.error(observation_content)
                 else:
                     try:
-                        function_args = json.loads(tool_call.arguments)
+                        function_args = orjson.loads(tool_call.arguments)
                         logger.info(f"准备执行工具 '{function_name}'，参数: {function_args}")
                         
                         # 🎯 Todo检查：避免重复执行相同操作
-                        should_skip, cached_result = self.todo_manager.should_skip_action(function_name, function_args)
+                        action_hash = self.todo_manager.compute_action_hash(function_name, function_args)
+                        should_skip, cached_result = self.todo_manager.should_skip_action(function_name, function_args, action_hash)
                         
                         if should_skip:
                             logger.info(f"🔄 检测到重复操作，使用缓存结果: {function_name}")
                             observation = cached_result
-                            observation_content = json.dumps(observation, ensure_ascii=False)
+                            observation_content = _dumps(observation)
                         else:
                             # 执行新操作
                             start_time = time.time()
@@ -386,13 +870,13 @@ class ProjectManagementAgent:
                             execution_time = time.time() - start_time
                             
                             # 记录操作完成
-                            self.todo_manager.mark_action_completed(function_name, function_args, observation, execution_time)
-                            observation_content = json.dumps(observation, ensure_ascii=False)
+                            self.todo_manager.mark_action_completed(function_name, function_args, observation, execution_time, action_hash)
+                            observation_content = _dumps(observation)
                         
                         logger.info(f"工具 '{function_name}' 的观察结果: {observation}")
                     except Exception as e:
                         logger.exception(f"执行工具 '{function_name}' 时出错")
-                        observation_content = json.dumps({"status": "error", "detail": str(e)})
+                        observation_content = _dumps({"status": "error", "detail": str(e)})
                 
                 # 立即添加工具输出
                 self.conversation_history.append({
@@ -410,14 +894,82 @@ class ProjectManagementAgent:
                 logger.info("未检测到工具调用，判定为最终答案。"); return text_content
         logger.warning(f"已达到最大循环次数 {max_turns}，强制退出循环。"); return "抱歉，经过几轮深度思考后，我仍然无法找到解决您请求的有效方法。"
 
-    def _execute_skill(self, skill_name: str, args: list = [], kwargs: dict = {}) -> dict:
-        logger.info(f"底层技能执行器: skill_name={skill_name}, args={args}, kwargs={kwargs}")
-        params = {'skill_name': skill_name, 'args': args, 'kwargs': kwargs}; payload = {"memory_type": "procedural_skill", "params": params}
+    def _retrieve_memories_batch(self, pending: list) -> list:
+        """把 [(下标, 工具名, 参数)] 合并为一次 /retrieve_batch 请求；参数不合法或批量接口不可用时回退到并发单次请求"""
+        start_time = time.time()
+        try:
+            items = [self._memory_query_payload(name, args) for _, name, args in pending]
+        except TypeError as e:
+            logger.warning(f"记忆查询参数不合法，回退到逐个执行: {e}")
+            items = None
+        if items is not None:
+            keys = [_MEMORY_CACHE.make_key(item) for item in items]
+            observations = [_MEMORY_CACHE.get(key) for key in keys]
+            missing = [j for j, observation in enumerate(observations) if observation is None]
+            generations = {j: _MEMORY_CACHE.generation(items[j]["memory_type"]) for j in missing}
+            fetched = call_memory_service_batch([items[j] for j in missing]) if missing else []
+            if fetched is not None and len(fetched) == len(missing):
+                for j, observation in zip(missing, fetched):
+                    observations[j] = observation
+                    if observation.get("status") not in ("error", "degraded"):
+                        _MEMORY_CACHE.put(keys[j], items[j]["memory_type"], observation, generations[j])
+                execution_time = time.time() - start_time
+                logger.info(f"批量检索 {len(items)} 个记忆查询完成 (缓存命中 {len(items) - len(missing)} 个)，耗时 {execution_time:.3f}秒")
+                return [(observation, execution_time) for observation in observations]
+            logger.warning("批量检索接口不可用，回退到并发单次请求")
+        return asyncio.run(_gather_memories([(self.tool_functions[name], args) for _, name, args in pending]))
+
+    def _execute_memory_queries_concurrently(self, tool_calls: list) -> list:
+        """并发执行一组只读记忆查询，返回与 tool_calls 顺序一致的观察结果 JSON 字符串"""
+        observation_contents = [None] * len(tool_calls)
+        pending, action_hashes = [], {}
+        for i, tool_call in enumerate(tool_calls):
+            try:
+                function_args = orjson.loads(tool_call.arguments)
+            except orjson.JSONDecodeError as e:
+                observation_contents[i] = _dumps({"status": "error", "detail": str(e)})
+                continue
+            # 🎯 Todo检查：避免重复执行相同操作
+            action_hashes[i] = self.todo_manager.compute_action_hash(tool_call.name, function_args)
+            should_skip, cached_result = self.todo_manager.should_skip_action(tool_call.name, function_args, action_hashes[i])
+            if should_skip:
+                logger.info(f"🔄 检测到重复操作，使用缓存结果: {tool_call.name}")
+                observation_contents[i] = _dumps(cached_result)
+            else:
+                pending.append((i, tool_call.name, function_args))
+        
+        results = self._retrieve_memories_batch(pending) if pending else []
+        for (i, function_name, function_args), (observation, execution_time) in zip(pending, results):
+            if isinstance(observation, Exception):
+                observation_contents[i] = _dumps({"status": "error", "detail": str(observation)})
+                continue
+            self.todo_manager.mark_action_completed(function_name, function_args, observation, execution_time, action_hashes[i])
+            observation_contents[i] = _dumps(observation)
+            logger.info(f"工具 '{function_name}' 的观察结果: {observation}")
+        return observation_contents
+
+    def _execute_skill(self, skill_name: str, /, **kwargs) -> dict:
+        logger.info(f"底层技能执行器: skill_name={skill_name}, kwargs={kwargs}")
+        params = {'skill_name': skill_name, 'args': [], 'kwargs': kwargs}; payload = {"memory_type": "procedural_skill", "params": params}
         return call_memory_service('retrieve', payload)
 
     # --- 新增的、与记忆模块一一对应的工具实现 ---
+    def _memory_query_payload(self, function_name: str, function_args: dict) -> dict:
+        """只读记忆查询工具对应的 retrieve 请求体，供单次调用与批量检索共用"""
+        builders = {
+            "query_ltm_preference": self._ltm_preference_payload,
+            "query_episodic_memory": self._episodic_memory_payload,
+            "query_semantic_memory": self._semantic_memory_payload,
+            "query_knowledge_graph": self._knowledge_graph_payload,
+            "query_stm": self._stm_payload,
+        }
+        return builders[function_name](**function_args)
+
     def _query_ltm_preference(self, key: str) -> dict:
         logger.info(f"执行工具 [query_ltm_preference]: key='{key}'")
+        return retrieve_memory_cached(self._ltm_preference_payload(key))
+
+    def _ltm_preference_payload(self, key: str) -> dict:
         
         # 🔧 修复：添加key映射逻辑，匹配实际数据库中的key格式
         key_mapping = {
@@ -434,31 +986,39 @@ class ProjectManagementAgent:
         mapped_key = key_mapping.get(key, key)
         logger.info(f"🔄 Key映射: '{key}' -> '{mapped_key}'")
         
-        payload = {"memory_type": "ltm_preference", "params": {"user_id": self.user_id, "key": mapped_key}}
-        return call_memory_service('retrieve', payload)
+        return {"memory_type": "ltm_preference", "params": {"user_id": self.user_id, "key": mapped_key}}
 
     def _query_episodic_memory(self, query_text: str) -> dict:
         logger.info(f"执行工具 [query_episodic_memory]: query_text='{query_text}'")
-        payload = {"memory_type": "episodic", "params": {"query_text": query_text}}
-        return call_memory_service('retrieve', payload)
+        return retrieve_memory_cached(self._episodic_memory_payload(query_text))
+
+    def _episodic_memory_payload(self, query_text: str) -> dict:
+        return {"memory_type": "episodic", "params": {"query_text": query_text}}
 
     def _query_semantic_memory(self, query_text: str) -> dict:
         logger.info(f"执行工具 [query_semantic_memory]: query_text='{query_text}'")
-        payload = {"memory_type": "semantic_fact", "params": {"query_text": query_text}}
-        return call_memory_service('retrieve', payload)
+        return retrieve_memory_cached(self._semantic_memory_payload(query_text))
+
+    def _semantic_memory_payload(self, query_text: str) -> dict:
+        return {"memory_type": "semantic_fact", "params": {"query_text": query_text}}
 
     def _query_knowledge_graph(self, subject: str, relation: str) -> dict:
         logger.info(f"执行工具 [query_knowledge_graph]: subject='{subject}', relation='{relation}'")
-        payload = {"memory_type": "kg_relation", "params": {"subject": subject, "relation": relation}}
-        return call_memory_service('retrieve', payload)
+        return retrieve_memory_cached(self._knowledge_graph_payload(subject, relation))
+
+    def _knowledge_graph_payload(self, subject: str, relation: str) -> dict:
+        return {"memory_type": "kg_relation", "params": {"subject": subject, "relation": relation}}
     
     def _query_stm(self, conversation_id: str = None, limit: int = 10) -> dict:
         logger.info(f"执行工具 [query_stm]: conversation_id='{conversation_id or self.conversation_id}', limit={limit}")
-        payload = {"memory_type": "stm", "params": {
+        return retrieve_memory_cached(self._stm_payload(conversation_id, limit))
+
+    def _stm_payload(self, conversation_id: str = None, limit: int = 10) -> dict:
+        self._flush_stm_buffer()  # 查询前写入缓冲中的消息，保证能读到本轮内容
+        return {"memory_type": "stm", "params": {
             "conversation_id": conversation_id or self.conversation_id,
             "limit": limit
         }}
-        return call_memory_service('retrieve', payload)   
     
     def _manage_working_memory(self, action: str, task_id: str, data: dict = None) -> dict:
         logger.info(f"执行工具 [manage_working_memory]: action='{action}', task_id='{task_id}'")
@@ -594,7 +1154,7 @@ class ProjectManagementAgent:
             
         elif filter_result.memory_level == 3:
             # Level 3: 提取用户偏好
-            if any(keyword in user_input for keyword in ["喜欢", "偏好", "习惯", "倾向", "爱好"]):
+            if _PREF_RE.search(user_input):
                 preference_key = f"extracted_preference_{int(time.time())}"
                 preference_value = f"从对话提取: {user_input}"
                 payload = {"memory_type": "ltm_preference", "params": {
@@ -609,7 +1169,7 @@ class ProjectManagementAgent:
             
         elif filter_result.memory_level == 4:
             # Level 4: 提取程序性知识
-            if any(keyword in user_input for keyword in ["流程", "步骤", "如何", "方法", "操作"]):
+            if _PROC_RE.search(user_input):
                 skill_name = f"extracted_procedure_{int(time.time())}"
                 skill_code = f"""
 # 从对话中提取的程序性知识
@@ -649,53 +1209,90 @@ def execute():
         
         return filter_result, consolidation_success
     
-    def _sync_message_to_stm(self, message):
-        """🔄 实时同步消息到短期记忆"""
+    def _sync_message_to_stm(self, message, flush: bool = False):
+        """🔄 消息加入STM缓冲，达到批量阈值 (或 flush=True) 时一次写入"""
+        self._sync_messages_to_stm([message], flush)
+
+    def _sync_messages_to_stm(self, messages: list, flush: bool = False):
         try:
-            content = f"[{message['role']}] {message['content']}"
-            # 修复参数结构：role和timestamp需要作为顶级参数
-            payload = {"memory_type": "stm", "params": {
-                "conversation_id": self.conversation_id,
-                "content": content,
-                "role": message["role"],
-                "timestamp": datetime.now().isoformat(),
-                "user_id": self.user_id
-            }}
-            result = call_memory_service('store', payload)
-            if result.get("status") == "success":
-                logger.debug(f"🔄 消息已同步到STM: {content[:50]}...")
-            else:
-                logger.warning(f"⚠️ STM同步失败: {result}")
+            timestamp = datetime.now().isoformat()
+            entries = [{"content": f"[{message['role']}] {message['content']}", "role": message["role"], "timestamp": timestamp, "user_id": self.user_id}
+                       for message in messages if "role" in message and "content" in message]  # 跳过 function_call 等无角色条目
+            with self._stm_lock:
+                self._stm_buffer.extend(entries)
+                should_flush = flush or len(self._stm_buffer) >= STM_FLUSH_THRESHOLD
+            if should_flush:
+                self._flush_stm_buffer()
         except Exception as e:
             logger.warning(f"⚠️ STM同步失败: {e}")
 
+    def _flush_stm_buffer(self):
+        """把缓冲中的消息通过一次 store 请求批量写入STM"""
+        with self._stm_lock:
+            messages, self._stm_buffer = self._stm_buffer, []
+        if not messages:
+            return
+        payload = {"memory_type": "stm", "params": {"conversation_id": self.conversation_id, "messages": messages}}
+        result = call_memory_service('store', payload)
+        if result.get("status") == "success":
+            logger.debug(f"🔄 {len(messages)} 条消息已批量同步到STM")
+        else:
+            logger.warning(f"⚠️ STM批量同步失败 ({len(messages)} 条): {result}")
+
+    def _submit_background(self, func, *args):
+        """提交后台任务 (fire-and-forget)，异常只记录日志"""
+        future = self._bg_executor.submit(func, *args)
+        with self._bg_lock:
+            self._bg_tasks.add(future)
+        def on_done(f):
+            with self._bg_lock:
+                self._bg_tasks.discard(f)
+            if f.exception() is not None:
+                logger.warning(f"⚠️ 后台记忆任务失败: {f.exception()}")
+        future.add_done_callback(on_done)
+        return future
+
+    def _shutdown_background(self):
+        """退出前等待在途的后台写入完成"""
+        with self._bg_lock:
+            pending = len(self._bg_tasks)
+        if pending:
+            logger.info(f"等待 {pending} 个后台记忆任务完成...")
+        self._bg_executor.shutdown(wait=True)
+
     def _manage_conversation_capacity(self):
         """🧠 智能容量管理 - 工作记忆与STM协调"""
-        max_working_memory = 20  # 工作记忆最大容量
-        
-        if len(self.conversation_history) > max_working_memory:
+        if len(self.conversation_history) > MAX_WORKING_MEMORY:
             # 转移较早的对话到STM并从工作记忆移除
-            overflow_count = len(self.conversation_history) - max_working_memory
-            transferred_messages = []
-            
-            for i in range(overflow_count):
-                old_message = self.conversation_history.pop(1)  # 保留系统消息，从索引1开始移除
-                # 确保已同步到STM
-                self._sync_message_to_stm(old_message)
-                transferred_messages.append(old_message)
+            overflow_count = len(self.conversation_history) - MAX_WORKING_MEMORY
+            # 保留系统消息，一次切片移除索引1起的溢出部分 (逐条 pop(1) 每次都要整体前移列表)
+            transferred_messages = self.conversation_history[1:1 + overflow_count]
+            del self.conversation_history[1:1 + overflow_count]
+            # 确保已同步到STM：整批加入缓冲并一次写入
+            self._sync_messages_to_stm(transferred_messages, flush=True)
             
             logger.info(f"🧠 工作记忆容量管理: 转移 {overflow_count} 条消息到STM")
             
-        # 定期触发STM→长期记忆转化
+        # 定期触发STM→长期记忆转化 (后台执行)，整合读取STM前先写入缓冲
         if len(self.conversation_history) % 10 == 0:
+            self._flush_stm_buffer()
             self._trigger_memory_consolidation()
 
     def _trigger_memory_consolidation(self):
-        """🔄 触发记忆整合 - STM向长期记忆转化"""
+        """🔄 触发记忆整合 - 提交到后台线程；同一会话已有整合在进行时跳过"""
+        with self._bg_lock:
+            if self.conversation_id in self._active_consolidations:
+                logger.info("🔄 记忆整合仍在进行，跳过本次触发")
+                return
+            self._active_consolidations.add(self.conversation_id)
+        self._submit_background(self._run_memory_consolidation, self.conversation_id)
+
+    def _run_memory_consolidation(self, conversation_id: str):
+        """🔄 记忆整合 - STM向长期记忆转化"""
         try:
             # 获取当前对话的STM内容
             payload = {"memory_type": "stm", "params": {
-                "conversation_id": self.conversation_id,
+                "conversation_id": conversation_id,
                 "limit": 50
             }}
             stm_result = call_memory_service('retrieve', payload)
@@ -704,16 +1301,24 @@ def execute():
                 stm_memories = stm_result.get("data", [])
                 
                 if stm_memories and len(stm_memories) > 10:
-                    # 批量分析并转化为长期记忆
-                    consolidated_content = "\n".join([
-                        mem.get('content', '') for mem in stm_memories if mem.get('content')
-                    ])
+                    # 批量分析并转化为长期记忆：从最新的消息往前取，达到字节上限即停止，再按时间顺序拼接
+                    parts, budget = [], CONSOLIDATION_MAX_BYTES
+                    for mem in reversed(stm_memories):
+                        content = mem.get('content')
+                        if not content:
+                            continue
+                        size = len(content.encode('utf-8')) + 1
+                        if size > budget:
+                            break
+                        parts.append(content)
+                        budget -= size
+                    consolidated_content = "\n".join(reversed(parts))
                     
                     # 通过记忆漏斗系统自动分类和存储
                     payload = {"memory_type": "episodic", "params": {
-                        "text": f"对话整合记忆 [{self.conversation_id}]: {consolidated_content}",
+                        "text": f"对话整合记忆 [{conversation_id}]: {consolidated_content}",
                         "metadata": {
-                            "conversation_id": self.conversation_id,
+                            "conversation_id": conversation_id,
                             "consolidation_timestamp": datetime.now().isoformat(),
                             "source": "stm_consolidation",
                             "user_id": self.user_id
@@ -728,59 +1333,67 @@ def execute():
                         
         except Exception as e:
             logger.warning(f"⚠️ 记忆整合失败: {e}")
+        finally:
+            with self._bg_lock:
+                self._active_consolidations.discard(conversation_id)
 
     def _build_enhanced_context(self):
         """🧠 构建增强上下文：STM历史摘要 + 系统提示"""
-        enhanced_context = [{"role": "system", "content": self._get_system_prompt()}]
+        # 上一轮之后摘要未变化时直接复用 (调用方会追加消息，返回副本)
+        if self._enhanced_context is not None:
+            return list(self._enhanced_context)
+
+        enhanced_context = [self._system_message]
         
         try:
-            # 获取STM中的历史对话摘要
-            payload = {
-                "memory_type": "stm", 
-                "params": {
-                    "conversation_id": self.conversation_id,
-                    "retrieve_type": "summaries",
-                    "last_k": 15  # 获取最近15轮的摘要
-                }
-            }
-            stm_result = call_memory_service('retrieve', payload)
-            
-            if stm_result.get("status") == "success":
-                stm_summaries = stm_result.get("data", [])
-                
-                if stm_summaries:
-                    # 构建历史上下文摘要
-                    history_summary = "## 📚 历史对话摘要\n"
-                    for summary in stm_summaries:
-                        round_info = f"**轮次 {summary.get('round_id', 'N/A')}**: "
-                        user_req = summary.get('user_request', '')[:100] + "..."
-                        final_ans = summary.get('final_answer', '')[:150] + "..."
-                        memories_used = summary.get('memories_used', [])
-                        
-                        history_summary += f"{round_info}\n"
-                        history_summary += f"用户请求: {user_req}\n"
-                        history_summary += f"最终回答: {final_ans}\n"
-                        if memories_used:
-                            history_summary += f"使用记忆: {', '.join(memories_used[:3])}\n"
-                        history_summary += "\n---\n"
-                    
-                    # 添加历史摘要到上下文
-                    enhanced_context.append({
-                        "role": "system", 
-                        "content": history_summary + "\n## 🎯 当前对话\n以下是当前轮次的对话："
-                    })
-                    
-                    logger.info(f"📚 已加载 {len(stm_summaries)} 轮历史对话摘要到上下文")
-                else:
-                    logger.info("📚 暂无历史对话摘要")
-            else:
-                logger.warning(f"⚠️ 获取STM摘要失败: {stm_result}")
-                
+            if self._stm_summaries is None:
+                self._load_stm_summaries()
+            if self._stm_summaries:
+                history_summary = f"{HISTORY_SUMMARY_HEADER}{''.join(self._summary_blocks)}{HISTORY_SUMMARY_FOOTER}"
+                enhanced_context.append({"role": "system", "content": history_summary})
+                logger.info(f"📚 已加载 {len(self._stm_summaries)} 轮历史对话摘要到上下文")
+            elif self._stm_summaries is not None:
+                logger.info("📚 暂无历史对话摘要")
         except Exception as e:
             logger.warning(f"⚠️ 构建增强上下文失败: {e}")
-        
+
+        # STM摘要加载失败时不缓存，下一轮重试
+        if self._stm_summaries is not None:
+            self._enhanced_context = enhanced_context
+            return list(enhanced_context)
         return enhanced_context
 
+    def _load_stm_summaries(self):
+        """从STM获取本会话最近15轮摘要 (只在首次构建上下文时调用，失败则下轮重试)"""
+        payload = {
+            "memory_type": "stm", 
+            "params": {
+                "conversation_id": self.conversation_id,
+                "retrieve_type": "summaries",
+                "last_k": STM_SUMMARY_ROUNDS
+            }
+        }
+        stm_result = call_memory_service('retrieve', payload)
+        if stm_result.get("status") == "success":
+            self._stm_summaries = deque(stm_result.get("data", []), maxlen=STM_SUMMARY_ROUNDS)
+            self._summary_blocks = deque(map(self._render_summary_block, self._stm_summaries), maxlen=STM_SUMMARY_ROUNDS)
+        else:
+            logger.warning(f"⚠️ 获取STM摘要失败: {stm_result}")
+
+    @staticmethod
+    def _truncate(text: str, limit: int) -> str:
+        return text if len(text) <= limit else f"{text[:limit]}..."
+
+    @classmethod
+    def _render_summary_block(cls, summary: dict) -> str:
+        user_request = cls._truncate(summary.get('user_request', ''), 100)
+        final_answer = cls._truncate(summary.get('final_answer', ''), 150)
+        block = f"**轮次 {summary.get('round_id', 'N/A')}**: \n用户请求: {user_request}\n最终回答: {final_answer}\n"
+        memories_used = summary.get('memories_used')
+        if memories_used:
+            block += f"使用记忆: {', '.join(islice(memories_used, 3))}\n"
+        return block + "\n---\n"
+
     def _finalize_conversation_round(self, user_input: str, final_answer: str):
         """🔚 对话轮次结束处理：提取记忆并存储摘要"""
         try:
@@ -797,7 +1410,7 @@ def execute():
                 "conversation_length": len(self.conversation_history)
             }
             
-            # 存储到STM摘要系统
+            # 存储到STM摘要系统 (后台执行，摘要已在主线程构建好)
             payload = {
                 "memory_type": "stm",
                 "params": {
@@ -806,43 +1419,50 @@ def execute():
                     "round_id": self.round_id
                 }
             }
-            
-            result = call_memory_service('store', payload)
-            if result.get("status") == "success":
-                logger.info(f"🔚 轮次 {self.round_id} 摘要已存储到STM")
-            else:
-                logger.warning(f"⚠️ 轮次摘要存储失败: {result}")
+            self._submit_background(self._store_round_summary, payload)
+            # 本地摘要同步追加，下一轮无需再从STM读取
+            if self._stm_summaries is not None:
+                self._stm_summaries.append(conversation_summary)
+                self._summary_blocks.append(self._render_summary_block(conversation_summary))
+                self._enhanced_context = None
                 
         except Exception as e:
             logger.warning(f"⚠️ 轮次结束处理失败: {e}")
+        finally:
+            self._memories_used_this_round.clear()
+
+    def _store_round_summary(self, payload: dict):
+        result = call_memory_service('store', payload)
+        if result.get("status") == "success":
+            logger.info(f"🔚 轮次 {payload['params']['round_id']} 摘要已存储到STM")
+        else:
+            logger.warning(f"⚠️ 轮次摘要存储失败: {result}")
+
+    def _note_memories_used(self, content):
+        """📊 助手文本消息写入对话历史时扫描一次，记录本轮使用的记忆类型"""
+        # 检查常见的记忆操作关键词
+        if isinstance(content, str) and ("retrieve" in content or "查询" in content):
+            self._memories_used_this_round.update(match.lastgroup for match in _MEMORY_USAGE_RE.finditer(content))
 
     def _extract_memories_used_in_round(self):
-        """📊 从当前轮次的对话中提取使用的记忆类型"""
-        memories_used = []
-        
-        # 分析对话历史中的助手消息，查找工具调用模式
-        for message in self.conversation_history:
-            if message.get("role") == "assistant":
-                content = message.get("content", "")
-                # 检查常见的记忆操作关键词
-                if "retrieve" in content or "查询" in content:
-                    if "语义" in content or "semantic" in content: memories_used.append("semantic_memory")
-                    if "情节" in content or "episodic" in content: memories_used.append("episodic_memory") 
-                    if "长期" in content or "ltm" in content: memories_used.append("ltm_memory")
-                    if "知识图谱" in content or "kg" in content: memories_used.append("knowledge_graph")
-                    if "程序性" in content or "procedural" in content: memories_used.append("procedural_memory")
-                    if "工作" in content or "wm" in content: memories_used.append("working_memory")
-        
-        return list(set(memories_used))  # 去重
+        """📊 本轮使用的记忆类型 (已在消息写入时识别)"""
+        return list(self._memories_used_this_round)
 
     def _end_conversation(self) -> dict:
         logger.info("执行工具 [end_conversation]")
-        self.conversation_history = [{"role": "system", "content": self._get_system_prompt()}]
+        self._flush_stm_buffer()
+        self.conversation_history = [self._system_message]
         return {"status": "success", "message": "好的，很高兴为您的项目管理工作提供支持。"}
 
 if __name__ == "__main__":
     setup_logging()
     logger.info("================== 项目管理Agent会话开始 ==================")
     agent = ProjectManagementAgent(user_id=USER_ID, agent_id=AGENT_ID)
-    agent.run()
+    try:
+        agent.run()
+    finally:
+        _MEMORY_SESSION.close()
+    logger.info(f"记忆检索缓存统计: {_MEMORY_CACHE.stats()}")
+    if agent._llm_cache is not None:
+        logger.info(f"LLM响应缓存统计: 命中 {agent._llm_cache.hits}, 未命中 {agent._llm_cache.misses}")
     logger.info("================== 项目管理Agent会话结束 ==================")
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+"""
+quantize_model.py
+
+离线将嵌入模型的 model.onnx 动态量化为 INT8 权重 (model.int8.onnx)。
+embedding_service 加载模型时会优先使用 model.int8.onnx。
+量化后用一组探针文本比较 FP32 与 INT8 的向量余弦相似度，低于 0.99 时给出警告。
+
+用法:
+python quantize_model.py /path/to/ai-models/qwen3-embedding-0.6b
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+from modelscope import AutoTokenizer
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+MIN_COSINE = 0.99
+PROBE_TEXTS = [
+    "你好，今天天气怎么样？",
+    "请帮我总结一下这次项目会议的结论和待办事项。",
+    "我们决定下周一上线新版本，测试由小王负责。",
+    "Python 中如何用 asyncio 并发执行多个请求？",
+    "The quarterly report is due next Friday.",
+]
+
+def embed(session: ort.InferenceSession, tokenizer, texts):
+    encoded = tokenizer(texts, return_tensors="np", padding="longest", truncation=True, max_length=1024)
+    outputs = session.run(None, {
+        "input_ids": encoded["input_ids"].astype(np.int64),
+        "attention_mask": encoded["attention_mask"].astype(np.int64),
+    })[0]
+    # 与服务一致的 last_token 池化
+    if tokenizer.padding_side == "left":
+        pooled = outputs[:, -1, :]
+    else:
+        pooled = outputs[np.arange(outputs.shape[0]), encoded["attention_mask"].sum(axis=1) - 1]
+    return pooled / np.linalg.norm(pooled, axis=1, keepdims=True)
+
+def main(model_path: Path):
+    fp32_file, int8_file = model_path / "model.onnx", model_path / "model.int8.onnx"
+    print(f"🔧 量化 {fp32_file} -> {int8_file}")
+    quantize_dynamic(str(fp32_file), str(int8_file), weight_type=QuantType.QInt8, use_external_data_format=True)
+
+    tokenizer = AutoTokenizer.from_pretrained(str(model_path), trust_remote_code=True)
+    providers = ["CPUExecutionProvider"]
+    fp32 = embed(ort.InferenceSession(str(fp32_file), providers=providers), tokenizer, PROBE_TEXTS)
+    int8 = embed(ort.InferenceSession(str(int8_file), providers=providers), tokenizer, PROBE_TEXTS)
+    cosines = np.einsum("ij,ij->i", fp32, int8)
+    print(f"📊 FP32/INT8 余弦相似度: 最小 {cosines.min():.4f}, 平均 {cosines.mean():.4f}")
+    if cosines.min() < MIN_COSINE:
+        print(f"⚠️ 最小余弦相似度低于 {MIN_COSINE}，建议删除 {int8_file.name} 继续使用 FP32 模型")
+    else:
+        print("✅ 量化模型精度验证通过")
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        print("用法: python quantize_model.py <模型目录>")
+        sys.exit(1)
+    main(Path(sys.argv[1]))
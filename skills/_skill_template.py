@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+通用技能模板 - 按类别生成技能的 execute / get_skill_info
+各类别的附加字段在生成时选定，执行时不再逐个比较类别
+"""
+
+import json
+import time
+from datetime import datetime
+
+# orjson 可选：直接编码为 UTF-8 字节，未安装时回退到标准库 json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+def _data_processing_fields(name, variant, input_data):
+    return {'processed_records': len(str(input_data)) * 10, 'data_quality_score': 0.90}
+
+def _document_generation_fields(name, variant, input_data):
+    return {'document_type': name, 'pages_generated': 5, 'format': ['PDF', 'DOCX', 'HTML'][variant % 3]}
+
+def _business_automation_fields(name, variant, input_data):
+    return {'automation_level': '中级', 'efficiency_gain': '35%', 'time_saved': '2小时'}
+
+def _communication_fields(name, variant, input_data):
+    return {'accuracy': 0.93, 'processing_speed': '150ms', 'supported_languages': 8}
+
+def _analysis_fields(name, variant, input_data):
+    return {'analysis_depth': '中等', 'confidence_score': 0.88, 'insights_count': 5}
+
+def _integration_fields(name, variant, input_data):
+    return {'integration_type': '异步', 'throughput': '1500req/min', 'latency': '15ms'}
+
+# 不同类别的特定处理逻辑
+CATEGORY_FIELDS = {
+    'data_processing': _data_processing_fields,
+    'document_generation': _document_generation_fields,
+    'business_automation': _business_automation_fields,
+    'communication': _communication_fields,
+    'analysis': _analysis_fields,
+    'integration': _integration_fields,
+}
+
+def make_skill(name, description, category, version):
+    """返回 (execute, get_skill_info)；variant 取版本号中的数字 (如 v2 -> 2)"""
+    category_fields = CATEGORY_FIELDS.get(category)
+    variant = int(version.lstrip('v') or 0)
+
+    def execute(*args, **kwargs):
+        start = time.perf_counter()
+
+        # 解析输入参数
+        if args:
+            input_data = args[0] if args[0] else {}
+        else:
+            input_data = kwargs
+
+        # 模拟技能执行逻辑
+        result = {
+            'skill_name': name,
+            'category': category,
+            'version': version,
+            'input': input_data,
+            'processed_at': datetime.now().isoformat(),
+            'status': 'success'
+        }
+        if category_fields is not None:
+            result.update(category_fields(name, variant, input_data))
+
+        # 添加执行时间 (单调时钟，单位秒)
+        result['execution_time'] = f"{time.perf_counter() - start:.6f}s"
+
+        # 结果只供程序解析，使用紧凑 JSON
+        if orjson is not None:
+            return orjson.dumps(result, option=orjson.OPT_NON_STR_KEYS).decode('utf-8')
+        return json.dumps(result, ensure_ascii=False, separators=(',', ':'))
+
+    execute.__doc__ = f"""
+    {name}主执行函数
+    {description}
+    """
+
+    def get_skill_info():
+        """获取技能信息"""
+        return {
+            'name': name,
+            'description': description,
+            'category': category,
+            'version': version,
+            'parameters': ['input_data'],
+            'returns': 'JSON格式的执行结果',
+            'usage': 'execute(input_data)'
+        }
+
+    return execute, get_skill_info
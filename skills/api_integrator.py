@@ -14,80 +14,14 @@ API集成器 - 集成第三方API服务
 版本: v2
 """
 
-import json
-import time
 from datetime import datetime
 
-def execute(*args, **kwargs):
-    """
-    API集成器主执行函数
-    集成第三方API服务
-    """
-    start_time = datetime.now()
-    
-    # 解析输入参数
-    if args:
-        input_data = args[0] if args[0] else {}
-    else:
-        input_data = kwargs
-    
-    # 模拟技能执行逻辑
-    result = {
-        'skill_name': 'API集成器',
-        'category': 'integration',
-        'version': 'v2',
-        'input': input_data,
-        'processed_at': start_time.isoformat(),
-        'status': 'success'
-    }
-    
-    # 不同类别的特定处理逻辑
-    if 'integration' == 'data_processing':
-        result['processed_records'] = len(str(input_data)) * 10
-        result['data_quality_score'] = 0.90
-        
-    elif 'integration' == 'document_generation':
-        result['document_type'] = 'API集成器'
-        result['pages_generated'] = 5
-        result['format'] = ['PDF', 'DOCX', 'HTML'][variant % 3]
-        
-    elif 'integration' == 'business_automation':
-        result['automation_level'] = '中级'
-        result['efficiency_gain'] = '35%'
-        result['time_saved'] = '2小时'
-        
-    elif 'integration' == 'communication':
-        result['accuracy'] = 0.93
-        result['processing_speed'] = '150ms'
-        result['supported_languages'] = 8
-        
-    elif 'integration' == 'analysis':
-        result['analysis_depth'] = '中等'
-        result['confidence_score'] = 0.88
-        result['insights_count'] = 5
-        
-    elif 'integration' == 'integration':
-        result['integration_type'] = '异步'
-        result['throughput'] = '1500req/min'
-        result['latency'] = '15ms'
-    
-    # 添加执行时间
-    end_time = datetime.now()
-    result['execution_time'] = str(end_time - start_time)
-    
-    return json.dumps(result, ensure_ascii=False, indent=2)
+try:
+    from ._skill_template import make_skill
+except ImportError:  # 直接以脚本运行 (python skills/xxx.py) 时没有父包
+    from _skill_template import make_skill
 
-def get_skill_info():
-    """获取技能信息"""
-    return {
-        'name': 'API集成器',
-        'description': '集成第三方API服务',
-        'category': 'integration',
-        'version': 'v2',
-        'parameters': ['input_data'],
-        'returns': 'JSON格式的执行结果',
-        'usage': 'execute(input_data)'
-    }
+execute, get_skill_info = make_skill('API集成器', '集成第三方API服务', 'integration', 'v2')
 
 if __name__ == "__main__":
     # 测试代码
@@ -8,12 +8,15 @@ def get_skill_metadata():
     }
 
 
-def execute(destination, preference):
-    # 模拟航班预订逻辑
-    if "靠窗" in preference:
-        seat_type = "靠窗座位"
-    else:
-        seat_type = "过道座位"
-    
+import functools
+
+@functools.lru_cache(maxsize=512)
+def _compute_flight(destination, prefers_window):
+    # 模拟航班预订逻辑：结果只取决于目的地和是否靠窗
+    seat_type = "靠窗座位" if prefers_window else "过道座位"
     flight_no = f"CA{1800 + hash(destination) % 200}"
+    return flight_no, seat_type
+
+def execute(destination, preference):
+    flight_no, seat_type = _compute_flight(destination, "靠窗" in preference)
     return f"已为您预订{destination}航班 {flight_no}，{seat_type}"
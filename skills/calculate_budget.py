@@ -25,30 +25,36 @@ def get_skill_metadata():
 import json
 import re
 
+_DAYS_RE = re.compile(r'\d+')
+
+# 预算标准
+FLIGHT_COST = 1200  # 经济舱往返
+HOTEL_COSTS = {"5star": 800, "4star": 500, "3star": 300}
+MEAL_COST_PER_DAY = 300
+TRANSPORT_COST = 200
+
+def _parse_days(days_str):
+    # 整数或纯数字字符串直接转换，其余从字符串中提取数字，支持 "3天" 或 "3" 格式
+    if type(days_str) is int and days_str >= 0:
+        return days_str
+    if isinstance(days_str, str) and days_str.isdecimal():
+        return int(days_str)
+    days_match = _DAYS_RE.search(str(days_str))
+    return int(days_match.group()) if days_match else 3  # 默认值
+
 def execute(days_str, hotel_level="5star"):
-    # 从字符串中提取数字，支持 "3天" 或 "3" 格式
-    days_match = re.search(r'\d+', str(days_str))
-    if days_match:
-        days = int(days_match.group())
-    else:
-        days = 3  # 默认值
-    
-    # 预算标准
-    flight_cost = 1200  # 经济舱往返
-    hotel_costs = {"5star": 800, "4star": 500, "3star": 300}
-    meal_cost_per_day = 300
-    transport_cost = 200
-    
-    hotel_cost = hotel_costs.get(hotel_level, 800) * days
-    meal_cost = meal_cost_per_day * days
-    total = flight_cost + hotel_cost + meal_cost + transport_cost
+    days = _parse_days(days_str)
+    hotel_rate = HOTEL_COSTS.get(hotel_level, 800)
+    hotel_cost = hotel_rate * days
+    meal_cost = MEAL_COST_PER_DAY * days
+    total = FLIGHT_COST + hotel_cost + meal_cost + TRANSPORT_COST
     
-    return f"""
-💰 差旅预算计算 (共{days}天):
-  ✈️  机票: ¥{flight_cost}
-  🏨 酒店: ¥{hotel_cost} ({hotel_level}, ¥{hotel_costs.get(hotel_level, 800)}/晚)
-  🍽️  餐费: ¥{meal_cost} (¥{meal_cost_per_day}/天)
-  🚗 交通: ¥{transport_cost}
-  ─────────────────
-  💳 总计: ¥{total}
-"""
+    return (
+        f"\n💰 差旅预算计算 (共{days}天):\n"
+        f"  ✈️  机票: ¥{FLIGHT_COST}\n"
+        f"  🏨 酒店: ¥{hotel_cost} ({hotel_level}, ¥{hotel_rate}/晚)\n"
+        f"  🍽️  餐费: ¥{meal_cost} (¥{MEAL_COST_PER_DAY}/天)\n"
+        f"  🚗 交通: ¥{TRANSPORT_COST}\n"
+        f"  ─────────────────\n"
+        f"  💳 总计: ¥{total}\n"
+    )
@@ -21,6 +21,10 @@ def get_skill_metadata():
         }
     }
 
+_MD_PREFIX = '# Document\n\n'
+
 def execute(text, format_type='markdown'):
-    if format_type == 'markdown': return f'# Document\n\n{text}'
-    else: return text.upper()
\ No newline at end of file
+    if format_type == 'markdown': return _MD_PREFIX + text
+    # 已是全大写的 ASCII 文本无需再转换
+    if text.isascii() and text.isupper(): return text
+    return text.upper()
\ No newline at end of file
@@ -47,6 +47,10 @@ class TaskTodoManager:
         action_str = f"{tool_name}|{sorted_params}"
         return hashlib.md5(action_str.encode('utf-8')).hexdigest()[:12]
     
+    def compute_action_hash(self, tool_name: str, params: Dict) -> str:
+        """预先计算操作哈希，调用方可在 should_skip_action 与 mark_action_completed 之间复用，避免重复序列化参数"""
+        return self._generate_action_hash(tool_name, params)
+    
     def start_new_task(self, task_description: str, initial_plan: List[str] = None) -> str:
         """开始新任务，创建todo.md文件"""
         self.current_task_id = f"task_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
@@ -90,9 +94,9 @@ class TaskTodoManager:
         logger.info(f"新任务开始: {self.current_task_id} - {task_description}")
         return self.current_task_id
     
-    def check_action_completed(self, tool_name: str, params: Dict) -> Optional[Dict]:
+    def check_action_completed(self, tool_name: str, params: Dict, action_hash: str = None) -> Optional[Dict]:
         """检查某个操作是否已经完成"""
-        action_hash = self._generate_action_hash(tool_name, params)
+        action_hash = action_hash or self._generate_action_hash(tool_name, params)
         
         if action_hash in self.completed_actions.get("actions", {}):
             action_record = self.completed_actions["actions"][action_hash]
@@ -101,9 +105,9 @@ class TaskTodoManager:
         
         return None
     
-    def mark_action_completed(self, tool_name: str, params: Dict, result: Any, execution_time: float = 0):
+    def mark_action_completed(self, tool_name: str, params: Dict, result: Any, execution_time: float = 0, action_hash: str = None):
         """标记某个操作为已完成"""
-        action_hash = self._generate_action_hash(tool_name, params)
+        action_hash = action_hash or self._generate_action_hash(tool_name, params)
         
         action_record = {
             "tool_name": tool_name,
@@ -213,9 +217,9 @@ class TaskTodoManager:
             "actions": list(self.completed_actions.get("actions", {}).keys())
         }
     
-    def should_skip_action(self, tool_name: str, params: Dict) -> tuple[bool, Optional[Dict]]:
+    def should_skip_action(self, tool_name: str, params: Dict, action_hash: str = None) -> tuple[bool, Optional[Dict]]:
         """判断是否应该跳过某个操作（已完成且结果有效）"""
-        cached_result = self.check_action_completed(tool_name, params)
+        cached_result = self.check_action_completed(tool_name, params, action_hash)
         
         if cached_result:
             # 检查结果是否仍然有效（例如，可以添加时间检查等逻辑）
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""记忆服务熔断器：half-open 试探请求抛出非 requests 异常时不能卡死在试探状态"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 模块导入时会初始化 Azure OpenAI 客户端，测试中只需要配置齐全
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "test-key")
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "http://127.0.0.1:9")
+os.environ.setdefault("AZURE_OPENAI_DEPLOYMENT", "test-deployment")
+
+import project_management_demo_real as agent_module
+
+
+class _BadJSONResponse:
+    content = b"<html>not json</html>"
+
+    def raise_for_status(self):
+        pass
+
+
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = agent_module._CircuitBreaker(fail_max=1, reset_timeout=0)
+    monkeypatch.setattr(agent_module, "_MEMORY_BREAKER", breaker)
+    return breaker
+
+
+def _open_breaker(breaker):
+    breaker.record_failure()
+    assert breaker._opened_at is not None
+
+
+def test_half_open_probe_released_on_non_requests_exception(breaker, monkeypatch):
+    _open_breaker(breaker)
+
+    def raise_runtime_error(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(agent_module._MEMORY_SESSION, "post", raise_runtime_error)
+    result = agent_module.call_memory_service("retrieve", {"memory_type": "stm", "params": {}})
+    assert result["status"] == "error"
+    assert breaker._probing is False
+    # reset_timeout=0：下一次调用可以再次试探
+    assert breaker.allow() is True
+
+
+def test_half_open_probe_released_on_unparseable_body(breaker, monkeypatch):
+    _open_breaker(breaker)
+    monkeypatch.setattr(agent_module._MEMORY_SESSION, "post", lambda *args, **kwargs: _BadJSONResponse())
+    result = agent_module.call_memory_service("retrieve", {"memory_type": "stm", "params": {}})
+    assert result["status"] == "error"
+    assert breaker._probing is False
+
+
+def test_batch_probe_released_on_non_requests_exception(breaker, monkeypatch):
+    _open_breaker(breaker)
+
+    def raise_runtime_error(*args, **kwargs):
+        raise RuntimeError("boom")
+
+    monkeypatch.setattr(agent_module._MEMORY_SESSION, "post", raise_runtime_error)
+    assert agent_module.call_memory_service_batch([{"memory_type": "stm", "params": {}}]) is None
+    assert breaker._probing is False
+
+
+def test_unserializable_payload_does_not_consume_probe(breaker):
+    _open_breaker(breaker)
+    result = agent_module.call_memory_service("retrieve", {"memory_type": "stm", "params": {"bad": object()}})
+    assert result["status"] == "error"
+    assert breaker._probing is False
+    assert breaker.allow() is True
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""记忆检索缓存：后台写入期间并发检索到的旧结果不能留在缓存中"""
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 模块导入时会初始化 Azure OpenAI 客户端，测试中只需要配置齐全
+os.environ.setdefault("AZURE_OPENAI_API_KEY", "test-key")
+os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "http://127.0.0.1:9")
+os.environ.setdefault("AZURE_OPENAI_DEPLOYMENT", "test-deployment")
+
+import project_management_demo_real as agent_module
+
+RETRIEVE_PAYLOAD = {"memory_type": "stm", "params": {"conversation_id": "c1", "retrieve_type": "summaries"}}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    cache = agent_module._MemoryLRU()
+    monkeypatch.setattr(agent_module, "_MEMORY_CACHE", cache)
+    return cache
+
+
+def test_retrieve_during_store_is_not_cached(cache, monkeypatch):
+    store_started, finish_store = threading.Event(), threading.Event()
+    stored = []
+
+    def fake_post(endpoint, payload):
+        if endpoint == "store":
+            store_started.set()
+            finish_store.wait(5)
+            stored.append(payload)
+            return {"status": "success"}
+        return {"status": "success", "data": list(stored)}
+
+    monkeypatch.setattr(agent_module, "_post_memory_service", fake_post)
+    writer = threading.Thread(target=agent_module.call_memory_service, args=("store", {"memory_type": "stm", "params": {}}))
+    writer.start()
+    store_started.wait(5)
+
+    # 写入尚未完成时检索到的是旧结果
+    assert agent_module.retrieve_memory_cached(RETRIEVE_PAYLOAD)["data"] == []
+    finish_store.set()
+    writer.join(5)
+
+    assert agent_module.retrieve_memory_cached(RETRIEVE_PAYLOAD)["data"] == stored
+
+
+def test_retrieve_without_writes_is_cached(cache, monkeypatch):
+    calls = []
+    monkeypatch.setattr(agent_module, "_post_memory_service",
+                        lambda endpoint, payload: calls.append(endpoint) or {"status": "success", "data": []})
+    agent_module.retrieve_memory_cached(RETRIEVE_PAYLOAD)
+    agent_module.retrieve_memory_cached(RETRIEVE_PAYLOAD)
+    assert calls == ["retrieve"]
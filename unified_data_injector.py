@@ -23,6 +23,8 @@ import random
 import sys
 import os
 from datetime import datetime, timedelta
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 # === 配置 ===
 MEMORY_SERVICE_URL = "http://127.0.0.1:8000"
 EMBEDDING_SERVICE_URL = "http://127.0.0.1:7999/v1/embeddings"
@@ -33,6 +35,9 @@ class UnifiedDataInjector:
     """统一数据注入器 - 整合所有记忆类型的数据注入功能"""
     
     def __init__(self):
+        # 注入过程对记忆服务发起大量请求，共享会话复用 keep-alive 连接，连接失败时短退避重试
+        self.http = requests.Session()
+        self.http.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=32, max_retries=Retry(total=2, backoff_factor=0.1)))
         self.redis_client = redis.Redis(decode_responses=True)
         self.sqlite_conn = sqlite3.connect('/aml/agent_memory/ltm.db')
         # 自动初始化数据库表结构
@@ -172,7 +177,7 @@ class UnifiedDataInjector:
         
         # 检查内存服务API
         try:
-            response = requests.get(f"{MEMORY_SERVICE_URL}/health", timeout=5)
+            response = self.http.get(f"{MEMORY_SERVICE_URL}/health", timeout=5)
             if response.status_code == 200:
                 print("✅ 内存服务API: 正常")
             else:
@@ -184,7 +189,7 @@ class UnifiedDataInjector:
         
         # 检查Embedding服务
         try:
-            response = requests.get(f"{EMBEDDING_SERVICE_URL.replace('/v1/embeddings', '')}/health", timeout=5)
+            response = self.http.get(f"{EMBEDDING_SERVICE_URL.replace('/v1/embeddings', '')}/health", timeout=5)
             if response.status_code == 200:
                 print("✅ Embedding服务: 正常")
             else:
@@ -341,7 +346,7 @@ class UnifiedDataInjector:
         ]
         
         for data in semantic_data:
-            response = requests.post(f"{MEMORY_SERVICE_URL}/store", json={
+            response = self.http.post(f"{MEMORY_SERVICE_URL}/store", json={
                 "memory_type": data["memory_type"],
                 "params": {
                     "text": data["content"],
@@ -414,7 +419,7 @@ class UnifiedDataInjector:
         ]
         
         for data in episodic_data:
-            response = requests.post(f"{MEMORY_SERVICE_URL}/store", json={
+            response = self.http.post(f"{MEMORY_SERVICE_URL}/store", json={
                 "memory_type": data["memory_type"],
                 "params": {
                     "text": data["content"],
@@ -458,7 +463,7 @@ class UnifiedDataInjector:
         success_count = 0
         for data in preference_data:
             try:
-                response = requests.post(f"{MEMORY_SERVICE_URL}/store", json={
+                response = self.http.post(f"{MEMORY_SERVICE_URL}/store", json={
                     "memory_type": "ltm_preference",
                     "params": {
                         "user_id": USER_ID,
@@ -481,7 +486,7 @@ class UnifiedDataInjector:
         print("\n🔍 验证注入结果...")
         for data in preference_data:
             try:
-                response = requests.post(f"{MEMORY_SERVICE_URL}/retrieve", json={
+                response = self.http.post(f"{MEMORY_SERVICE_URL}/retrieve", json={
                     "memory_type": "ltm_preference", 
                     "params": {
                         "user_id": USER_ID,
@@ -558,7 +563,7 @@ class UnifiedDataInjector:
         ]
         
         for data in knowledge_graph_data:
-            response = requests.post(f"{MEMORY_SERVICE_URL}/store", json={
+            response = self.http.post(f"{MEMORY_SERVICE_URL}/store", json={
                 "memory_type": "kg_relation",
                 "params": {
                     "subject": data["subject"],
@@ -610,7 +615,7 @@ class UnifiedDataInjector:
         ]
         
         for data in working_memory_data:
-            response = requests.post(f"{MEMORY_SERVICE_URL}/store", json={
+            response = self.http.post(f"{MEMORY_SERVICE_URL}/store", json={
                 "memory_type": "wm",
                 "params": {
                     "agent_id": AGENT_ID,
@@ -689,7 +694,7 @@ class UnifiedDataInjector:
             try:
                 memory_type = base["type"]
                 if memory_type == "episodic":
-                    response = requests.post(f"{MEMORY_SERVICE_URL}/store", json={
+                    response = self.http.post(f"{MEMORY_SERVICE_URL}/store", json={
                         "memory_type": "episodic",
                         "params": {
                             "text": content,
@@ -697,7 +702,7 @@ class UnifiedDataInjector:
                         }
                     })
                 elif memory_type == "semantic":
-                    response = requests.post(f"{MEMORY_SERVICE_URL}/store", json={
+                    response = self.http.post(f"{MEMORY_SERVICE_URL}/store", json={
                         "memory_type": "semantic_fact", 
                         "params": {
                             "text": content,